@@ -0,0 +1,127 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from pydantic import TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def _adapter(output_type: Any) -> TypeAdapter:
+    # Output types are models or lists of models (packed mode); TypeAdapter handles both
+    return TypeAdapter(output_type)
+
+
+def make_cache_key(
+    agent_name: str,
+    model_name: str,
+    system_prompt: str,
+    prompt: str,
+    output_type: Any,
+    extra: Any = None,
+) -> str:
+    """Canonical content hash of everything that determines an agent response"""
+    payload = {
+        "agent": agent_name,
+        "model": model_name,
+        "system_prompt": system_prompt,
+        "prompt": prompt,
+        "output_schema": _adapter(output_type).json_schema(),
+        "extra": extra,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for agent outputs: an in-process LRU in front of an
+    optional SQLite file. Entries expire after `ttl_seconds` in both tiers.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10_000, ttl_seconds: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats: Counter = Counter()
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, agent TEXT, value TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str, output_type: Any, agent_name: str = "") -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    self.stats[f"{agent_name}.hits"] += 1
+                    return _adapter(output_type).validate_json(value)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    self.stats[f"{agent_name}.hits"] += 1
+                    return _adapter(output_type).validate_json(row[0])
+
+            self.stats["misses"] += 1
+            self.stats[f"{agent_name}.misses"] += 1
+            return None
+
+    def set(self, key: str, output: Any, output_type: Any, agent_name: str = "") -> None:
+        expires_at = time.time() + self.ttl_seconds
+        value = _adapter(output_type).dump_json(output).decode()
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, agent, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, agent_name, value, expires_at),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Drop expired entries from both tiers, returning the number of SQLite rows removed"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expires_at, _) in self._memory.items() if expires_at <= now]:
+                del self._memory[key]
+            if self._db is None:
+                return 0
+            removed = self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+            self._db.commit()
+            return removed
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,35 +1,38 @@
-from pydantic_ai import Agent, RunContext
+from collections import Counter
+from typing import TYPE_CHECKING, Optional
 from models.outputs import ChannelPreference
+from models.repair import repairing_model
 from dependencies.customer_deps import CustomerDependencies
-from pydantic_ai.models.google import GoogleModelSettings
-import logfire
+from models.customer import CustomerProfile
+from agents.runtime import run_agent
+from agents.channel_rules import decide_channel
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
 
-logfire.configure()
-logfire.instrument_pydantic_ai()
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, RunContext
 
 # Configure the model settings for Google Gemini 2.5 Flash-Lite
-model_settings = GoogleModelSettings(
-    google_thinking_config={'thinking_budget': 0}
-)
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
 
-channel_agent = Agent(
-    'google-gla:gemini-2.5-flash-lite',
-    deps_type=CustomerDependencies,
-    output_type=ChannelPreference,  # Changed from result_type to output_type
-    model_settings=model_settings,
-    system_prompt=(
-        "You are a customer engagement specialist. "
-        "Analyze customer digital behavior and preferences to determine "
-        "the most effective communication channels and optimal contact times. "
-        "Consider engagement history, demographic factors, and behavioral patterns."
-    )
+SYSTEM_PROMPT = (
+    "You are a customer engagement specialist. "
+    "Analyze customer digital behavior and preferences to determine "
+    "the most effective communication channels and optimal contact times. "
+    "Consider engagement history, demographic factors, and behavioral patterns."
 )
 
-@channel_agent.system_prompt
-def add_engagement_context(ctx: RunContext[CustomerDependencies]) -> str:
-    """Add engagement context"""
-    profile = ctx.deps.customer_profile
-    
+USER_PROMPT = "Determine the best communication channels and timing for this customer."
+
+# Rule-based decisions at or above this confidence skip the LLM call
+rules_confidence_threshold = 0.75
+
+# How often each path was taken: "rules" or "llm"
+channel_path_counts = Counter()
+
+@traced("prompt")
+def render_engagement_context(profile: CustomerProfile) -> str:
+    """Render the engagement context for a profile"""
     return f"""
 Customer Engagement Profile:
 - Age: {profile.age}
@@ -38,10 +41,56 @@ Customer Engagement Profile:
 - Digital Engagement: {profile.digital_engagement}
 """
 
+def add_engagement_context(ctx: "RunContext[CustomerDependencies]") -> str:
+    """Add engagement context"""
+    return render_engagement_context(ctx.deps.customer_profile)
+
+@register_agent('channel_agent')
+def build_channel_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    agent = Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='channel_agent',
+        deps_type=CustomerDependencies,
+        output_type=repairing_model(ChannelPreference),  # Changed from result_type to output_type
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+    agent.system_prompt(add_engagement_context)
+    return agent
+
+def configure_channel_rules(threshold: float) -> None:
+    """Set the confidence needed to use the rule-based answer (above 1.0 always calls the LLM)"""
+    global rules_confidence_threshold
+    rules_confidence_threshold = threshold
+
+def rule_based_preference(profile: CustomerProfile) -> Optional[ChannelPreference]:
+    """Return the rule-based preference if it is confident enough, counting which path is taken"""
+    decision = decide_channel(profile)
+    if decision.confidence >= rules_confidence_threshold:
+        channel_path_counts["rules"] += 1
+        return decision.preference
+    channel_path_counts["llm"] += 1
+    return None
+
+def default_channel_preference(deps: CustomerDependencies) -> ChannelPreference:
+    """Engagement-based rule decision whatever its confidence, used when the agent misses its deadline"""
+    return decide_channel(deps.customer_profile).preference
+
 async def analyze_channel_preference(deps: CustomerDependencies) -> ChannelPreference:
-    """Determine best communication channel"""
-    result = await channel_agent.run(
-        "Determine the best communication channels and timing for this customer.",
-        deps=deps
+    """Determine best communication channel, using the rules when they are confident"""
+    preference = rule_based_preference(deps.customer_profile)
+    if preference is not None:
+        return preference
+    return await run_llm_channel_preference(deps)
+
+async def run_llm_channel_preference(deps: CustomerDependencies) -> ChannelPreference:
+    """Ask channel_agent for the channel preference"""
+    return await run_agent(
+        get_agent('channel_agent'),
+        USER_PROMPT,
+        deps=deps,
+        system_prompt=SYSTEM_PROMPT + render_engagement_context(deps.customer_profile),
     )
-    return result.output  # Changed from result.data to result.output
@@ -0,0 +1,103 @@
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from models.customer import CustomerProfile
+from models.outputs import ChannelPreference
+from models.repair import parse_number
+
+# App sessions per week at which app-based channels are considered saturated
+SATURATED_SESSIONS_PER_WEEK = 14
+# Signals whose presence makes the rule-based decision trustworthy
+SIGNALS = ("mobile_app_sessions_per_week", "email_open_rate", "push_notification_enabled")
+
+_TRUE = {"true", "yes", "y", "1", "on", "enabled"}
+_FALSE = {"false", "no", "n", "0", "off", "disabled", ""}
+
+
+@dataclass
+class ChannelDecision:
+    """Rule-based channel preference together with how much to trust it"""
+    preference: ChannelPreference
+    confidence: float
+    scores: Dict[str, float]
+
+
+def _number(value: Any) -> Optional[float]:
+    """A finite number from an engagement value ("65%" and "3" included), or None"""
+    if isinstance(value, bool):
+        return None
+    number = float(value) if isinstance(value, (int, float)) else parse_number(value)
+    return number if number is not None and math.isfinite(number) else None
+
+
+def _flag(value: Any) -> Optional[bool]:
+    """A yes/no engagement value, or None when it is neither"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+        return value.strip().lower() in _TRUE
+    return None
+
+
+def engagement_signals(profile: CustomerProfile) -> Dict[str, Any]:
+    """The SIGNALS present in the customer's engagement data and parsable; malformed values count as missing"""
+    engagement = profile.digital_engagement
+    signals = {
+        "mobile_app_sessions_per_week": _number(engagement.get("mobile_app_sessions_per_week")),
+        "email_open_rate": _number(engagement.get("email_open_rate")),
+        "push_notification_enabled": _flag(engagement.get("push_notification_enabled")),
+    }
+    return {name: value for name, value in signals.items() if value is not None}
+
+
+def score_channels(profile: CustomerProfile) -> Dict[str, float]:
+    """Score every channel in [0, 1] from the customer's engagement data"""
+    signals = engagement_signals(profile)
+    app_usage = min(max(signals.get("mobile_app_sessions_per_week", 0.0), 0.0) / SATURATED_SESSIONS_PER_WEEK, 1.0)
+    push_enabled = signals.get("push_notification_enabled", False)
+
+    return {
+        "push_notification": 0.5 + 0.5 * app_usage if push_enabled else 0.0,
+        "in_app": 0.9 * app_usage,
+        "email": min(max(signals.get("email_open_rate", 0.0), 0.0), 1.0),
+        "sms": 0.25,
+        "phone": 0.7 if profile.age >= 65 else 0.15,
+    }
+
+
+def decide_channel(profile: CustomerProfile) -> ChannelDecision:
+    """
+    Map engagement data to a ChannelPreference deterministically. Confidence
+    combines how many engagement signals are present with the margin between
+    the two best channels, so sparse or ambiguous profiles score low.
+    """
+    scores = score_channels(profile)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    primary, runner_up = ranked[0], ranked[1]
+    margin = scores[primary] - scores[runner_up]
+
+    signals = engagement_signals(profile)
+    present = len(signals) + bool(profile.preferred_contact_times)
+    completeness = present / (len(SIGNALS) + 1)
+    confidence = completeness * min(1.0, 0.5 + 2 * margin)
+
+    sessions = signals.get("mobile_app_sessions_per_week", 0.0)
+    open_rate = signals.get("email_open_rate", 0.0)
+    if sessions >= 7 or open_rate >= 0.5:
+        personalization_level = "high"
+    elif sessions >= 2 or open_rate >= 0.2:
+        personalization_level = "medium"
+    else:
+        personalization_level = "low"
+
+    preference = ChannelPreference(
+        primary_channel=primary,
+        secondary_channels=[channel for channel in ranked[1:3] if scores[channel] >= 0.3],
+        best_contact_time=", ".join(profile.preferred_contact_times) or "weekday evening",
+        engagement_likelihood=round(scores[primary], 2),
+        personalization_level=personalization_level,
+    )
+    return ChannelDecision(preference=preference, confidence=round(confidence, 3), scores=scores)
@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import math
+from collections import Counter, defaultdict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from pipeline.stats import percentile
+
+T = TypeVar("T")
+
+# Set by DeadlinePolicy.run for its call; flipped by mark_model_call when the
+# call reaches the model, so rule fast paths and cache hits are not sampled
+_model_called: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("deadline_model_called", default=None)
+
+
+def mark_model_call() -> None:
+    """Note that the analysis running under DeadlinePolicy.run, if any, sent a model request"""
+    called = _model_called.get()
+    if called is not None:
+        called[0] = True
+
+
+class DeadlinePolicy:
+    """
+    Tail-latency control for individual analyses. Once an analysis has
+    `min_samples` latencies, a call still running after the
+    `hedge_percentile` latency gets one hedged duplicate, and whichever of
+    the two succeeds first is used. A call with no result after its deadline
+    is cancelled and replaced by a deterministic fallback output, reported
+    as degraded. Errors are not replaced: a call that fails (and whose hedge,
+    if any, fails too) raises as before. Only calls that reached the model
+    (see mark_model_call) and deadline misses are sampled.
+    """
+
+    def __init__(
+        self,
+        deadline_seconds: Optional[float] = 20.0,
+        agent_deadlines: Optional[Dict[str, float]] = None,
+        hedge_percentile: Optional[float] = 95.0,
+        min_samples: int = 20,
+        window: int = 512,
+    ):
+        self.deadline_seconds = deadline_seconds
+        self.agent_deadlines = agent_deadlines or {}
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.stats: Counter = Counter()
+
+    def deadline_for(self, name: str) -> Optional[float]:
+        return self.agent_deadlines.get(name, self.deadline_seconds)
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """Seconds after which a call gets a hedged duplicate; None until enough latencies are known"""
+        samples = self.latencies[name]
+        if self.hedge_percentile is None or len(samples) < self.min_samples:
+            return None
+        return percentile(sorted(samples), self.hedge_percentile)
+
+    async def run(self, name: str, call: Callable[[], Awaitable[T]], fallback: Callable[[], T]) -> Tuple[T, bool]:
+        """Run `call` under the policy; returns its output and whether it is a degraded fallback"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = self.deadline_for(name)
+        hedge_delay = self.hedge_delay(name)
+        deadline_at = math.inf if deadline is None else started + deadline
+        hedge_at = None if hedge_delay is None else started + hedge_delay
+
+        called = [False]
+        token = _model_called.set(called)
+        try:
+            output = await self._first_success(name, call, deadline_at, hedge_at)
+        except asyncio.TimeoutError:
+            self.stats[f"{name}.deadline_misses"] += 1
+            # The call took at least this long; leaving it out would bias the percentile low
+            self.latencies[name].append(max(loop.time() - started, deadline))
+            return fallback(), True
+        finally:
+            _model_called.reset(token)
+        if called[0]:  # only model latencies drive the hedge delay
+            self.latencies[name].append(loop.time() - started)
+        return output, False
+
+    async def _first_success(
+        self, name: str, call: Callable[[], Awaitable[T]], deadline_at: float, hedge_at: Optional[float]
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        primary = asyncio.ensure_future(call())
+        pending = {primary}
+        hedged = hedge_at is None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                wake = deadline_at if hedged else min(hedge_at, deadline_at)
+                timeout = None if wake == math.inf else max(0.0, wake - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats[f"{name}.hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                if loop.time() >= deadline_at:
+                    raise asyncio.TimeoutError
+                if not hedged and loop.time() >= hedge_at:
+                    hedged = True
+                    self.stats[f"{name}.hedges"] += 1
+                    pending.add(asyncio.ensure_future(call()))
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# Shared policy; None runs every analysis without deadlines or hedging
+_policy: Optional[DeadlinePolicy] = None
+
+
+def configure_deadlines(policy: Optional[DeadlinePolicy]) -> None:
+    """Install (or remove, with None) the deadline and hedging policy for the analyses"""
+    global _policy
+    _policy = policy
+
+
+def get_deadline_policy() -> Optional[DeadlinePolicy]:
+    return _policy
+
+
+async def run_within_deadline(name: str, call: Callable[[], Awaitable[T]], fallback: Callable[[], T]) -> Tuple[T, bool]:
+    """Run an analysis under the configured policy, if any; returns (output, degraded)"""
+    policy = _policy
+    if policy is None:
+        return await call(), False
+    return await policy.run(name, call, fallback)
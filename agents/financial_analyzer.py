@@ -1,57 +1,35 @@
-from pydantic_ai import Agent, RunContext
+from typing import TYPE_CHECKING
 from models.outputs import FinancialSituation
+from models.repair import repairing_model
 from dependencies.customer_deps import CustomerDependencies
-from pydantic_ai.models.google import GoogleModelSettings
-import logfire
+from models.customer import CustomerProfile
+from agents.runtime import run_agent
+from pipeline.features import CustomerFeatures, render_features
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
 
-logfire.configure()
-logfire.instrument_pydantic_ai()
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, RunContext
 
 # Configure the model settings for Google Gemini 2.5 Flash-Lite
-model_settings = GoogleModelSettings(
-    google_thinking_config={'thinking_budget': 0}
-)
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
 
-# Create the financial analyzer agent with Gemini 2.5 Flash-Lite
-financial_analyzer = Agent(
-    'google-gla:gemini-2.5-flash-lite',
-    deps_type=CustomerDependencies,
-    output_type=FinancialSituation,  # Changed from result_type to output_type
-    model_settings=model_settings,
-    system_prompt=(
-        "You are an expert financial analyst specializing in consumer banking. "
-        "Analyze customer financial data to assess overall financial health, "
-        "identify spending patterns, calculate savings rates, detect risk indicators, "
-        "and uncover opportunities for financial improvement. "
-        "Provide actionable insights based on transaction history, income, and account balance."
-    )
+SYSTEM_PROMPT = (
+    "You are an expert financial analyst specializing in consumer banking. "
+    "Analyze customer financial data to assess overall financial health, "
+    "identify spending patterns, calculate savings rates, detect risk indicators, "
+    "and uncover opportunities for financial improvement. "
+    "Provide actionable insights based on transaction history, income, and account balance."
 )
 
-@financial_analyzer.tool
-async def calculate_debt_ratio(ctx: RunContext[CustomerDependencies]) -> float:
-    """Calculate debt-to-income ratio deterministically"""
-    profile = ctx.deps.customer_profile
-    account_data = profile.account_data
-    monthly_debt = sum(account_data.get('debts', []))
-    monthly_income = profile.income / 12  # Assuming income is annual
-    return monthly_debt / monthly_income if monthly_income > 0 else 0.0
-
-@financial_analyzer.tool
-async def get_spending_pattern(ctx: RunContext[CustomerDependencies]) -> str:
-    """Analyze spending by category"""
-    profile = ctx.deps.customer_profile
-    transactions = profile.recent_transactions
-    categories = {}
-    for txn in transactions:
-        category = txn.category
-        amount = txn.amount
-        categories[category] = categories.get(category, 0) + amount
-    return categories
+USER_PROMPT = "Analyze this customer's financial situation based on the provided data."
 
-@financial_analyzer.system_prompt
-def add_customer_context(ctx: RunContext[CustomerDependencies]) -> str:
-    """Add dynamic customer context to system prompt"""
-    profile = ctx.deps.customer_profile
+# Debt ratio and spending by category are precomputed (see pipeline.features)
+# and rendered into the prompt, so the analysis completes in a single model turn
+# instead of round-tripping through tool calls.
+@traced("prompt")
+def render_customer_context(profile: CustomerProfile, features: CustomerFeatures) -> str:
+    """Render the dynamic customer context for a profile"""
     return f"""
 Customer Context:
 - Customer ID: {profile.customer_id}
@@ -59,13 +37,60 @@ Customer Context:
 - Income: ${profile.income:,.2f}
 - Account Balance: ${profile.account_balance:,.2f}
 - Credit Score: {profile.credit_score or 'Not available'}
-- Recent Transactions: {len(profile.recent_transactions)} transactions
-"""
+- Recent Transactions: {features.transaction_count} transactions
+""" + render_features(features)
+
+def add_customer_context(ctx: "RunContext[CustomerDependencies]") -> str:
+    """Add dynamic customer context to system prompt"""
+    return render_customer_context(ctx.deps.customer_profile, ctx.deps.get_features())
+
+@register_agent('financial_analyzer')
+def build_financial_analyzer() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    agent = Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='financial_analyzer',
+        deps_type=CustomerDependencies,
+        output_type=repairing_model(FinancialSituation),  # Changed from result_type to output_type
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+    agent.system_prompt(add_customer_context)
+    return agent
+
+def default_financial_situation(deps: CustomerDependencies) -> FinancialSituation:
+    """Conservative assessment from the precomputed features, used when the agent misses its deadline"""
+    features = deps.get_features()
+    risks = []
+    if features.debt_to_income >= 0.43:
+        risks.append(f"High debt-to-income ratio ({features.debt_to_income:.0%})")
+    if features.savings_rate < 0:
+        risks.append("Spending exceeds income")
+    if risks:
+        health = "poor"
+    elif features.debt_to_income >= 0.36 or features.savings_rate < 0.1:
+        health = "fair"
+    else:
+        health = "good"  # never "excellent" without the full analysis
+    top_categories = sorted(features.category_spend, key=features.category_spend.get, reverse=True)[:3]
+    return FinancialSituation(
+        overall_health=health,
+        spending_pattern=(
+            f"Monthly spend ${features.monthly_spend:,.2f}, mostly on {', '.join(top_categories)}"
+            if top_categories else "No recent transactions"
+        ),
+        savings_rate=features.savings_rate,
+        risk_indicators=risks,
+        opportunities=[],
+    )
 
 async def analyze_financial_situation(deps: CustomerDependencies) -> FinancialSituation:
     """Run the financial analysis"""
-    result = await financial_analyzer.run(
-        "Analyze this customer's financial situation based on the provided data.",
-        deps=deps
-    )
-    return result.output  # Changed from result.data to result.output
\ No newline at end of file
+    return await run_agent(
+        get_agent('financial_analyzer'),
+        USER_PROMPT,
+        deps=deps,
+        system_prompt=SYSTEM_PROMPT + render_customer_context(deps.customer_profile, deps.get_features()),
+    )
\ No newline at end of file
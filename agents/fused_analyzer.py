@@ -0,0 +1,101 @@
+from typing import TYPE_CHECKING
+from models.outputs import FusedAnalysis
+from models.repair import repairing_model
+from dependencies.customer_deps import CustomerDependencies
+from models.customer import CustomerProfile
+from agents.runtime import run_agent
+from agents.financial_analyzer import default_financial_situation
+from agents.life_moment_identifier import default_life_moment
+from agents.channel_analyzer import default_channel_preference, rule_based_preference
+from agents.next_best_action import default_next_best_action
+from pipeline.features import CustomerFeatures, render_features, render_last_transaction
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, RunContext
+
+# Configure the model settings for Google Gemini 2.5 Flash-Lite
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
+
+SYSTEM_PROMPT = (
+    "You are a team of banking specialists analyzing one customer in a single pass. "
+    "Produce four assessments:\n"
+    "1. financial_situation: assess overall financial health, spending patterns, savings rate, "
+    "risk indicators and improvement opportunities from income, balance and transactions.\n"
+    "2. life_moment: identify significant life moments or transitions (career change, relocation, "
+    "marriage, new child, home purchase, retirement planning, education expenses, etc.) "
+    "with confidence and time sensitivity.\n"
+    "3. channel_preference: determine the most effective communication channels and contact times "
+    "from engagement history, demographics and behavior.\n"
+    "4. next_best_action: recommend the most appropriate product, service or advice "
+    "(savings accounts, credit cards, loans, investments, insurance, advisory) "
+    "that provides genuine customer value, consistent with the other three assessments."
+)
+
+USER_PROMPT = "Produce the financial, life moment, channel and next best action analyses for this customer."
+
+@traced("prompt")
+def render_fused_context(profile: CustomerProfile, features: CustomerFeatures) -> str:
+    """Render everything the four analysis agents see, with each field stated once"""
+    return f"""
+Customer Context:
+- Customer ID: {profile.customer_id}
+- Age: {profile.age}
+- Location: {profile.location}
+- Marital Status: {profile.marital_status or 'Unknown'}
+- Has Children: {profile.has_children}
+- Employment: {profile.employment_status or 'Unknown'}
+- Income: ${profile.income:,.2f}
+- Account Balance: ${profile.account_balance:,.2f}
+- Credit Score: {profile.credit_score or 'Not available'}
+- Recent Transactions: {features.transaction_count} transactions
+- Last Transaction: {render_last_transaction(features)}
+- Preferred Contact Times: {', '.join(profile.preferred_contact_times) or 'Not specified'}
+- Digital Engagement: {profile.digital_engagement}
+""" + render_features(features)
+
+def add_fused_context(ctx: "RunContext[CustomerDependencies]") -> str:
+    """Add the combined customer context"""
+    return render_fused_context(ctx.deps.customer_profile, ctx.deps.get_features())
+
+@register_agent('fused_analyzer')
+def build_fused_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    agent = Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='fused_analyzer',
+        deps_type=CustomerDependencies,
+        output_type=repairing_model(FusedAnalysis),
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+    agent.system_prompt(add_fused_context)
+    return agent
+
+def default_fused_analysis(deps: CustomerDependencies) -> FusedAnalysis:
+    """The four agents' deterministic fallbacks, used when the fused call misses its deadline"""
+    return FusedAnalysis(
+        financial_situation=default_financial_situation(deps),
+        life_moment=default_life_moment(deps),
+        channel_preference=default_channel_preference(deps),
+        next_best_action=default_next_best_action(deps),
+    )
+
+async def analyze_customer_fused(deps: CustomerDependencies) -> FusedAnalysis:
+    """
+    Run all four analyses in one request. As in the fan-out, a confident
+    rule-based channel decision takes precedence over the model's.
+    """
+    analysis = await run_agent(
+        get_agent('fused_analyzer'),
+        USER_PROMPT,
+        deps=deps,
+        system_prompt=SYSTEM_PROMPT + render_fused_context(deps.customer_profile, deps.get_features()),
+    )
+    preference = rule_based_preference(deps.customer_profile)
+    if preference is not None:
+        analysis = analysis.model_copy(update={"channel_preference": preference})
+    return analysis
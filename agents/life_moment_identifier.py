@@ -1,37 +1,34 @@
-from pydantic_ai import Agent, RunContext
+from typing import TYPE_CHECKING
 from models.outputs import LifeMoment
+from models.repair import repairing_model
 from dependencies.customer_deps import CustomerDependencies
-from pydantic_ai.models.google import GoogleModelSettings
-import logfire
+from models.customer import CustomerProfile
+from agents.runtime import run_agent
+from pipeline.features import CustomerFeatures, render_last_transaction
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
 
-logfire.configure()
-logfire.instrument_pydantic_ai()
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, RunContext
 
 # Configure the model settings for Google Gemini 2.5 Flash-Lite
-model_settings = GoogleModelSettings(
-    google_thinking_config={'thinking_budget': 0}
-)
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
 
-life_moment_agent = Agent(
-    'google-gla:gemini-2.5-flash-lite',
-    deps_type=CustomerDependencies,
-    output_type=LifeMoment,  # Changed from result_type to output_type
-    model_settings=model_settings,
-    system_prompt=(
-        "You are an expert in customer lifecycle analysis. "
-        "Identify significant life moments and transitions based on financial behavior, "
-        "demographic information, and transaction patterns. "
-        "Life moments include: career changes, relocation, marriage, new child, "
-        "home purchase, retirement planning, education expenses, etc. "
-        "Assess confidence and time sensitivity for each detected moment."
-    )
+SYSTEM_PROMPT = (
+    "You are an expert in customer lifecycle analysis. "
+    "Identify significant life moments and transitions based on financial behavior, "
+    "demographic information, and transaction patterns. "
+    "Life moments include: career changes, relocation, marriage, new child, "
+    "home purchase, retirement planning, education expenses, etc. "
+    "Assess confidence and time sensitivity for each detected moment."
 )
 
-@life_moment_agent.system_prompt
-def add_life_context(ctx: RunContext[CustomerDependencies]) -> str:
-    """Add customer life context"""
-    profile = ctx.deps.customer_profile
-    transaction_categories = [t.category for t in profile.recent_transactions]
+USER_PROMPT = "Identify any significant life moments or transitions for this customer."
+
+@traced("prompt")
+def render_life_context(profile: CustomerProfile, features: CustomerFeatures) -> str:
+    """Render the life context for a profile"""
+    transaction_categories = features.category_spend.keys()
     
     return f"""
 Customer Life Context:
@@ -40,13 +37,39 @@ Customer Life Context:
 - Has Children: {profile.has_children}
 - Employment: {profile.employment_status or 'Unknown'}
 - Location: {profile.location}
-- Transaction Categories: {', '.join(set(transaction_categories))}
+- Transaction Categories: {', '.join(transaction_categories)}
+- Last Transaction: {render_last_transaction(features)}
 """
 
+def add_life_context(ctx: "RunContext[CustomerDependencies]") -> str:
+    """Add customer life context"""
+    return render_life_context(ctx.deps.customer_profile, ctx.deps.get_features())
+
+@register_agent('life_moment_agent')
+def build_life_moment_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    agent = Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='life_moment_agent',
+        deps_type=CustomerDependencies,
+        output_type=repairing_model(LifeMoment),  # Changed from result_type to output_type
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+    agent.system_prompt(add_life_context)
+    return agent
+
+def default_life_moment(deps: CustomerDependencies) -> LifeMoment:
+    """No detected moments, used when the agent misses its deadline"""
+    return LifeMoment(detected_moments=[], confidence_score=0.0, time_sensitivity="long-term", relevant_needs=[])
+
 async def identify_life_moment(deps: CustomerDependencies) -> LifeMoment:
     """Identify customer life moments"""
-    result = await life_moment_agent.run(
-        "Identify any significant life moments or transitions for this customer.",
-        deps=deps
+    return await run_agent(
+        get_agent('life_moment_agent'),
+        USER_PROMPT,
+        deps=deps,
+        system_prompt=SYSTEM_PROMPT + render_life_context(deps.customer_profile, deps.get_features()),
     )
-    return result.output  # Changed from result.data to result.output
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import re
+import string
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from models.customer import CustomerProfile
+from models.outputs import (
+    FinancialSituation,
+    LifeMoment,
+    ChannelPreference,
+    NextBestAction,
+    HyperpersonalizedMessage
+)
+from models.repair import repairing_model
+from agents.runtime import run_agent
+from agents.scheduler import PRIORITY_SYNTHESIS
+from agents.synthesis_agent import SYSTEM_PROMPT, render_synthesis_prompt
+from agents.registry import get_agent, register_agent
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+# Configure the model settings for Google Gemini 2.5 Flash-Lite
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
+
+# Analysis fields every segment is keyed on, as "<analysis>.<field>"
+SEGMENT_FIELDS = (
+    "financial_situation.overall_health",
+    "life_moment.time_sensitivity",
+    "channel_preference.primary_channel",
+    "next_best_action.action_type",
+)
+
+# Output model of each analysis a segment field can refer to
+_ANALYSIS_TYPES = {
+    "financial_situation": FinancialSituation,
+    "life_moment": LifeMoment,
+    "channel_preference": ChannelPreference,
+    "next_best_action": NextBestAction,
+}
+
+# Placeholders a template may use; filled locally per customer by template_slots
+SLOTS = {
+    "customer_name": "the customer's full name",
+    "first_name": "the customer's first name",
+    "recommendation": "the specific product, service or advice recommended to the customer",
+    "life_moment": "the customer's main detected life moment",
+    "need": "the customer's main need arising from that moment",
+    "opportunity": "the customer's main financial improvement opportunity",
+    "best_contact_time": "the best time to contact the customer",
+    "account_balance": "the customer's account balance, formatted as an amount",
+    "monthly_income": "the customer's monthly income, formatted as an amount",
+}
+
+# Message fields holding free text, which may contain placeholders
+TEXT_FIELDS = ("message_subject", "message_body", "call_to_action", "optimal_send_time")
+
+TEMPLATE_INSTRUCTIONS = """
+This message is a TEMPLATE reused for every customer with the same financial health,
+time sensitivity, channel and action type. Write it for the customer above, but put
+customer-specific details only in these placeholders (in single braces) and do not use
+braces anywhere else:
+""" + "\n".join(f"- {{{name}}}: {description}" for name, description in SLOTS.items())
+
+@register_agent('template_agent')
+def build_template_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    return Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='template_agent',
+        output_type=repairing_model(HyperpersonalizedMessage),
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+
+_WORD = re.compile(r"[a-z]{3,}")
+
+
+def _first(values: Sequence[str], default: str) -> str:
+    return values[0] if values else default
+
+
+def template_slots(
+    profile: CustomerProfile,
+    financial: FinancialSituation,
+    life_moment: LifeMoment,
+    channel: ChannelPreference,
+    action: NextBestAction,
+) -> Dict[str, str]:
+    """Per-customer values of every placeholder in SLOTS"""
+    name = profile.customer_name.strip()
+    return {
+        "customer_name": name,
+        "first_name": name.split()[0] if name else name,
+        "recommendation": action.specific_recommendation,
+        "life_moment": _first(life_moment.detected_moments, "this stage of life"),
+        "need": _first(life_moment.relevant_needs, "your financial goals"),
+        "opportunity": _first(financial.opportunities, "growing your savings"),
+        "best_contact_time": channel.best_contact_time,
+        "account_balance": f"${profile.account_balance:,.2f}",
+        "monthly_income": f"${profile.income / 12:,.2f}",
+    }
+
+
+def segment_terms(financial: FinancialSituation, life_moment: LifeMoment, action: NextBestAction) -> FrozenSet[str]:
+    """Words describing what a message would be about, compared to decide whether a template fits"""
+    text = " ".join([
+        *life_moment.detected_moments,
+        *life_moment.relevant_needs,
+        *financial.opportunities,
+        action.specific_recommendation,
+    ])
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Jaccard similarity of two term sets (1.0 when both are empty)"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _placeholders(text: str) -> List[str]:
+    """Placeholder names used in `text`; raises ValueError on malformed or unknown ones"""
+    names = []
+    for _, name, spec, conversion in string.Formatter().parse(text):
+        if name is None:
+            continue
+        if name not in SLOTS or spec or conversion:
+            raise ValueError(f"Unsupported placeholder {{{name}}}")
+        names.append(name)
+    return names
+
+
+def validate_template(template: HyperpersonalizedMessage) -> None:
+    """Raise ValueError unless every text field only uses known placeholders"""
+    for name in TEXT_FIELDS:
+        _placeholders(getattr(template, name))
+    for element in template.personalization_elements:
+        _placeholders(element)
+
+
+def fill_template(template: HyperpersonalizedMessage, slots: Dict[str, str], channel: str) -> HyperpersonalizedMessage:
+    """Instantiate a validated template for one customer"""
+    update: Dict[str, Any] = {name: getattr(template, name).format_map(slots) for name in TEXT_FIELDS}
+    update["personalization_elements"] = [element.format_map(slots) for element in template.personalization_elements]
+    update["recommended_channel"] = channel
+    return template.model_copy(update=update)
+
+
+@dataclass
+class SegmentTemplate:
+    """The message template of one segment and the terms of the customer it was written for"""
+    template: HyperpersonalizedMessage
+    terms: FrozenSet[str]
+
+
+class TemplateLibrary:
+    """
+    Segment-level message templates. Customers are grouped on the analysis
+    fields in SEGMENT_FIELDS plus `extra_fields`. Once a segment has been
+    seen `min_support` times, one template request writes a parameterized
+    message for it, and later customers of the segment get that template
+    with their own name, amounts and moments filled in locally, skipping
+    synthesis. A customer gets full synthesis while its segment is below
+    `min_support`, when the template was rejected or its request failed,
+    or when the customer's term similarity to the template's customer is
+    below `similarity_threshold`.
+    """
+
+    def __init__(
+        self,
+        extra_fields: Sequence[str] = (),
+        min_support: int = 3,
+        similarity_threshold: float = 0.3,
+        path: Optional[str] = None,
+    ):
+        self.fields = tuple(SEGMENT_FIELDS) + tuple(field for field in extra_fields if field not in SEGMENT_FIELDS)
+        for field in self.fields:
+            analysis, _, name = field.partition(".")
+            if analysis not in _ANALYSIS_TYPES or name not in _ANALYSIS_TYPES[analysis].model_fields:
+                raise ValueError(f"Unknown segment field {field!r}")
+        self.min_support = min_support
+        self.similarity_threshold = similarity_threshold
+        self.path = path
+        self.stats: Counter = Counter()
+        self.templates: Dict[Tuple, Optional[SegmentTemplate]] = {}
+        self._support: Counter = Counter()
+        self._pending: Dict[Tuple, "asyncio.Future[Optional[SegmentTemplate]]"] = {}
+        if path:
+            self.load(path)
+
+    def segment_key(
+        self,
+        financial: FinancialSituation,
+        life_moment: LifeMoment,
+        channel: ChannelPreference,
+        action: NextBestAction,
+    ) -> Tuple:
+        outputs = {
+            "financial_situation": financial,
+            "life_moment": life_moment,
+            "channel_preference": channel,
+            "next_best_action": action,
+        }
+        key = []
+        for field in self.fields:
+            analysis, _, name = field.partition(".")
+            value = getattr(outputs[analysis], name)
+            if isinstance(value, float):
+                value = round(value, 1)  # numeric fields are bucketed
+            elif isinstance(value, list):
+                value = ",".join(sorted(map(str, value)))
+            key.append(value)
+        return tuple(key)
+
+    async def personalize(
+        self,
+        profile: CustomerProfile,
+        financial: FinancialSituation,
+        life_moment: LifeMoment,
+        channel: ChannelPreference,
+        action: NextBestAction,
+    ) -> Optional[HyperpersonalizedMessage]:
+        """The customer's message from its segment template, or None when it needs full synthesis"""
+        key = self.segment_key(financial, life_moment, channel, action)
+        terms = segment_terms(financial, life_moment, action)
+        self._support[key] += 1
+
+        if key in self.templates:
+            segment = self.templates[key]
+        elif key in self._pending:
+            segment = await asyncio.shield(self._pending[key])
+        elif self._support[key] >= self.min_support:
+            segment = await self._generate(key, terms, financial, life_moment, channel, action)
+        else:
+            self.stats["new_segment"] += 1
+            return None
+
+        if segment is None:
+            # A rejected template stays in self.templates; a failed request does not
+            self.stats["rejected_segment" if key in self.templates else "failed_segment"] += 1
+            return None
+        if similarity(terms, segment.terms) < self.similarity_threshold:
+            self.stats["low_similarity"] += 1
+            return None
+        self.stats["template_hits"] += 1
+        slots = template_slots(profile, financial, life_moment, channel, action)
+        return fill_template(segment.template, slots, channel.primary_channel)
+
+    async def _generate(
+        self,
+        key: Tuple,
+        terms: FrozenSet[str],
+        financial: FinancialSituation,
+        life_moment: LifeMoment,
+        channel: ChannelPreference,
+        action: NextBestAction,
+    ) -> Optional[SegmentTemplate]:
+        """Write the segment's template once; concurrent customers of the segment wait for it"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        segment = None
+        try:
+            prompt = render_synthesis_prompt(financial, life_moment, channel, action, "{customer_name}")
+            template = await run_agent(
+                get_agent('template_agent'), prompt + TEMPLATE_INSTRUCTIONS, system_prompt=SYSTEM_PROMPT, priority=PRIORITY_SYNTHESIS
+            )
+            validate_template(template)
+            segment = SegmentTemplate(template, terms)
+            self.stats["templates_generated"] += 1
+        except ValueError:
+            self.stats["templates_rejected"] += 1
+        except Exception:
+            # Leave the segment unknown so a later customer retries; this customer
+            # and the waiters get full synthesis instead
+            self.stats["templates_failed"] += 1
+            del self._pending[key]
+            future.set_result(None)
+            return None
+        except asyncio.CancelledError:
+            del self._pending[key]
+            future.set_result(None)
+            raise
+        self.templates[key] = segment
+        del self._pending[key]
+        future.set_result(segment)
+        return segment
+
+    def load(self, path: str) -> None:
+        """Add the templates saved at `path` (if it exists and was keyed on the same fields)"""
+        try:
+            with open(path) as handle:
+                data = json.load(handle)
+        except FileNotFoundError:
+            return
+        if tuple(data["fields"]) != self.fields:
+            return
+        for entry in data["segments"]:
+            template = HyperpersonalizedMessage.model_validate(entry["template"])
+            self.templates[tuple(entry["key"])] = SegmentTemplate(template, frozenset(entry["terms"]))
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the accepted templates as JSON, to be loaded by a later campaign"""
+        segments = [
+            {"key": list(key), "template": segment.template.model_dump(), "terms": sorted(segment.terms)}
+            for key, segment in self.templates.items()
+            if segment is not None
+        ]
+        with open(path or self.path, "w") as handle:
+            json.dump({"fields": list(self.fields), "segments": segments}, handle, indent=2)
+
+
+# Shared library; None synthesizes every message
+_library: Optional[TemplateLibrary] = None
+
+
+def configure_message_templates(library: Optional[TemplateLibrary]) -> None:
+    """Install (or remove, with None) the segment template library used by synthesis"""
+    global _library
+    _library = library
+
+
+def get_message_templates() -> Optional[TemplateLibrary]:
+    return _library
@@ -1,37 +1,32 @@
-from pydantic_ai import Agent, RunContext
+from typing import TYPE_CHECKING
 from models.outputs import NextBestAction
+from models.repair import repairing_model
 from dependencies.customer_deps import CustomerDependencies
-from pydantic_ai.models.google import GoogleModelSettings
-import logfire
+from models.customer import CustomerProfile
+from agents.runtime import run_agent
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
 
-logfire.configure()
-logfire.instrument_pydantic_ai()
+if TYPE_CHECKING:
+    from pydantic_ai import Agent, RunContext
 
 # Configure the model settings for Google Gemini 2.5 Flash-Lite
-model_settings = GoogleModelSettings(
-    google_thinking_config={'thinking_budget': 0}
-)
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
 
-nba_agent = Agent(
-    'google-gla:gemini-2.5-flash-lite',
-    deps_type=CustomerDependencies,
-    output_type=NextBestAction, 
-    model_settings=model_settings,
-    system_prompt=(
-        "You are a banking product specialist and relationship manager. "
-        "Based on customer financial situation and needs, recommend the most "
-        "appropriate next best action or offer. Consider products like: "
-        "savings accounts, credit cards, loans, investment products, "
-        "insurance, or financial advisory services. "
-        "Prioritize recommendations that provide genuine customer value."
-    )
+SYSTEM_PROMPT = (
+    "You are a banking product specialist and relationship manager. "
+    "Based on customer financial situation and needs, recommend the most "
+    "appropriate next best action or offer. Consider products like: "
+    "savings accounts, credit cards, loans, investment products, "
+    "insurance, or financial advisory services. "
+    "Prioritize recommendations that provide genuine customer value."
 )
 
-@nba_agent.system_prompt
-def add_product_context(ctx: RunContext[CustomerDependencies]) -> str:
-    """Add context for product recommendations"""
-    profile = ctx.deps.customer_profile
-    
+USER_PROMPT = "Recommend the next best action or offer for this customer."
+
+@traced("prompt")
+def render_product_context(profile: CustomerProfile) -> str:
+    """Render the product recommendation context for a profile"""
     return f"""
 Customer Financial Profile:
 - Income: ${profile.income:,.2f}
@@ -40,10 +35,41 @@ Customer Financial Profile:
 - Age: {profile.age}
 """
 
+def add_product_context(ctx: "RunContext[CustomerDependencies]") -> str:
+    """Add context for product recommendations"""
+    return render_product_context(ctx.deps.customer_profile)
+
+@register_agent('nba_agent')
+def build_nba_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    agent = Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='nba_agent',
+        deps_type=CustomerDependencies,
+        output_type=repairing_model(NextBestAction), 
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+    agent.system_prompt(add_product_context)
+    return agent
+
+def default_next_best_action(deps: CustomerDependencies) -> NextBestAction:
+    """Conservative low-priority engagement action, used when the agent misses its deadline"""
+    return NextBestAction(
+        action_type="engagement",
+        specific_recommendation="Invite the customer to a no-obligation review of their accounts and goals",
+        priority="low",
+        expected_value=0.0,
+        rationale="Default recommendation: the product analysis did not complete in time",
+    )
+
 async def recommend_next_action(deps: CustomerDependencies) -> NextBestAction:
     """Generate next best action recommendation"""
-    result = await nba_agent.run(
-        "Recommend the next best action or offer for this customer.",
-        deps=deps
+    return await run_agent(
+        get_agent('nba_agent'),
+        USER_PROMPT,
+        deps=deps,
+        system_prompt=SYSTEM_PROMPT + render_product_context(deps.customer_profile),
     )
-    return result.output  # Changed from result.data to result.output
@@ -0,0 +1,214 @@
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Annotated, Awaitable, Callable, Dict, List, Optional, Type, Union
+
+from pydantic import BaseModel, Field, ValidationError, WrapValidator, create_model
+
+from agents import channel_analyzer, financial_analyzer, life_moment_identifier, next_best_action
+from agents.registry import get_agent, register_agent
+from agents.runtime import estimate_tokens, run_agent
+from agents.scheduler import is_rate_limited
+from agents.usage import TokenBudgetExceeded
+from dependencies.customer_deps import CustomerDependencies
+from models.outputs import ChannelPreference, FinancialSituation, LifeMoment, NextBestAction
+from models.repair import repairing_model
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+PACKING_INSTRUCTIONS = (
+    "\n\nYou will receive several customers, each introduced by a '### Customer <id>' header. "
+    "Analyze every customer independently and return exactly one result per customer, "
+    "setting customer_id to the id from its header."
+)
+
+# Rough size of a rendered output entry, used to reserve room in the token budget
+OUTPUT_TOKENS_PER_CUSTOMER = 250
+
+
+def _drop_invalid(value, handler):
+    # An invalid entry becomes None instead of failing the whole packed response;
+    # the customer is then retried individually.
+    try:
+        return handler(value)
+    except ValidationError:
+        return None
+
+
+def packed_output_type(output_type: Type[BaseModel]):
+    """List of `output_type` entries tagged with the customer they belong to"""
+    entry = create_model(
+        f"Packed{output_type.__name__}",
+        __base__=repairing_model(output_type),
+        customer_id=(str, Field(description="Id of the customer this result belongs to")),
+    )
+    return List[Annotated[entry, WrapValidator(_drop_invalid)]]
+
+
+@dataclass
+class PackedAnalysis:
+    """An analysis agent as run in packed mode"""
+    name: str
+    output_type: Type[BaseModel]
+    system_prompt: str
+    render: Callable[[CustomerDependencies], str]
+    run_single: Callable[[CustomerDependencies], Awaitable[BaseModel]]
+
+    @property
+    def agent(self) -> "Agent":
+        return get_agent(f"{self.name}_packed")
+
+
+def _packed(name: str, module, output_type: Type[BaseModel], render, run_single) -> PackedAnalysis:
+    system_prompt = module.SYSTEM_PROMPT + PACKING_INSTRUCTIONS
+
+    @register_agent(f"{name}_packed")
+    def build() -> "Agent":
+        from pydantic_ai import Agent
+
+        return Agent(
+            name=f"{name}_packed",
+            output_type=packed_output_type(output_type),
+            model_settings=module.model_settings,
+            system_prompt=system_prompt,
+        )
+
+    return PackedAnalysis(name, output_type, system_prompt, render, run_single)
+
+
+PACKED_ANALYSES = [
+    _packed(
+        "financial_situation", financial_analyzer, FinancialSituation,
+        lambda deps: financial_analyzer.render_customer_context(deps.customer_profile, deps.get_features()),
+        financial_analyzer.analyze_financial_situation,
+    ),
+    _packed(
+        "life_moment", life_moment_identifier, LifeMoment,
+        lambda deps: life_moment_identifier.render_life_context(deps.customer_profile, deps.get_features()),
+        life_moment_identifier.identify_life_moment,
+    ),
+    _packed(
+        "channel_preference", channel_analyzer, ChannelPreference,
+        lambda deps: channel_analyzer.render_engagement_context(deps.customer_profile),
+        channel_analyzer.run_llm_channel_preference,
+    ),
+    _packed(
+        "next_best_action", next_best_action, NextBestAction,
+        lambda deps: next_best_action.render_product_context(deps.customer_profile),
+        next_best_action.recommend_next_action,
+    ),
+]
+
+
+class PackedAnalyzer:
+    """
+    Runs the four analysis agents over many customers with one request per
+    chunk of customers instead of one per customer. Chunks are bounded by an
+    estimated token budget and by a per-agent chunk size that shrinks when
+    packed responses come back incomplete and grows again when they do not.
+    Missing or invalid entries are retried with the single-customer agent.
+    A customer whose retry fails gets the exception in place of the output,
+    so it fails alone instead of taking its chunk down with it. A packed
+    request rejected by the token budget or rate limited (after the
+    scheduler's retries) is not fanned out into individual requests: every
+    customer of its chunk gets the error.
+    """
+
+    def __init__(self, token_budget: int = 8000, max_chunk_size: int = 32, min_chunk_size: int = 1):
+        self.token_budget = token_budget
+        self.max_chunk_size = max_chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.chunk_sizes = {analysis.name: max(min_chunk_size, max_chunk_size // 2) for analysis in PACKED_ANALYSES}
+        self.stats = {"packed_requests": 0, "packed_entries": 0, "individual_retries": 0, "failed_packed_requests": 0}
+
+    async def analyze(self, deps_list: List[CustomerDependencies]) -> Dict[str, List[Union[BaseModel, BaseException]]]:
+        """Return the four analysis outputs (or the exception in its place) of every customer, aligned with `deps_list`"""
+        # Confident rule-based channel decisions never reach the packed channel agent
+        channel_results: Dict[str, Optional[BaseModel]] = {
+            deps.customer_profile.customer_id: channel_analyzer.rule_based_preference(deps.customer_profile)
+            for deps in deps_list
+        }
+
+        async def run(analysis: PackedAnalysis) -> List[Union[BaseModel, BaseException]]:
+            if analysis.name == "channel_preference":
+                pending = [d for d in deps_list if channel_results[d.customer_profile.customer_id] is None]
+                resolved = await self._run_analysis(analysis, pending)
+                channel_results.update(resolved)
+                return [channel_results[d.customer_profile.customer_id] for d in deps_list]
+            resolved = await self._run_analysis(analysis, deps_list)
+            return [resolved[d.customer_profile.customer_id] for d in deps_list]
+
+        outputs = await asyncio.gather(*(run(analysis) for analysis in PACKED_ANALYSES), return_exceptions=True)
+        return {
+            analysis.name: [output] * len(deps_list) if isinstance(output, BaseException) else output
+            for analysis, output in zip(PACKED_ANALYSES, outputs)
+        }
+
+    def _chunks(self, analysis: PackedAnalysis, deps_list: List[CustomerDependencies]):
+        """Split customers into chunks that fit both the chunk size and the token budget"""
+        limit = self.chunk_sizes[analysis.name]
+        base_tokens = estimate_tokens(analysis.system_prompt)
+        chunk, sections, tokens = [], [], base_tokens
+        for deps in deps_list:
+            section = f"### Customer {deps.customer_profile.customer_id}\n{analysis.render(deps)}"
+            cost = estimate_tokens(section) + OUTPUT_TOKENS_PER_CUSTOMER
+            if chunk and (len(chunk) >= limit or tokens + cost > self.token_budget):
+                yield chunk, "\n".join(sections)
+                chunk, sections, tokens = [], [], base_tokens
+            chunk.append(deps)
+            sections.append(section)
+            tokens += cost
+        if chunk:
+            yield chunk, "\n".join(sections)
+
+    async def _run_chunk(
+        self, analysis: PackedAnalysis, chunk: List[CustomerDependencies], prompt: str
+    ) -> Dict[str, Union[BaseModel, BaseException]]:
+        wanted = {deps.customer_profile.customer_id: deps for deps in chunk}
+        found: Dict[str, Union[BaseModel, BaseException]] = {}
+        self.stats["packed_requests"] += 1
+        try:
+            entries = await run_agent(analysis.agent, prompt, system_prompt=analysis.system_prompt)
+        except Exception as exc:
+            self.stats["failed_packed_requests"] += 1
+            if isinstance(exc, TokenBudgetExceeded) or is_rate_limited(exc):
+                raise  # individual requests would hit the same limit, len(chunk) times over
+            entries = []  # the whole chunk falls back to individual requests
+
+        for entry in entries:
+            if entry is not None and entry.customer_id in wanted and entry.customer_id not in found:
+                # Strip the packing-only field to recover the agent's regular output model
+                found[entry.customer_id] = analysis.output_type.model_validate(
+                    entry.model_dump(exclude={"customer_id"})
+                )
+        self.stats["packed_entries"] += len(found)
+        self._adapt(analysis.name, len(found), len(chunk))
+
+        missing = [deps for customer_id, deps in wanted.items() if customer_id not in found]
+        self.stats["individual_retries"] += len(missing)
+        retried = await asyncio.gather(*(analysis.run_single(deps) for deps in missing), return_exceptions=True)
+        for deps, output in zip(missing, retried):
+            found[deps.customer_profile.customer_id] = output
+        return found
+
+    def _adapt(self, name: str, returned: int, requested: int) -> None:
+        size = self.chunk_sizes[name]
+        if returned < requested * 0.9:
+            size = max(self.min_chunk_size, size // 2)
+        elif returned == requested:
+            size = min(self.max_chunk_size, size + 2)
+        self.chunk_sizes[name] = size
+
+    async def _run_analysis(
+        self, analysis: PackedAnalysis, deps_list: List[CustomerDependencies]
+    ) -> Dict[str, Union[BaseModel, BaseException]]:
+        results: Dict[str, Union[BaseModel, BaseException]] = {}
+        chunks = list(self._chunks(analysis, deps_list))
+        chunk_results = await asyncio.gather(
+            *(self._run_chunk(analysis, chunk, prompt) for chunk, prompt in chunks), return_exceptions=True
+        )
+        for (chunk, _), chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, BaseException):
+                chunk_result = {deps.customer_profile.customer_id: chunk_result for deps in chunk}
+            results.update(chunk_result)
+        return results
@@ -0,0 +1,87 @@
+import importlib
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+from agents.tracing import init_instrumentation
+from dependencies.model_provider import get_model
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+# Modules whose agents register themselves on import; prewarm_agents loads
+# them all so any registered name can be pre-warmed before main is imported
+AGENT_MODULES = (
+    "agents.financial_analyzer",
+    "agents.life_moment_identifier",
+    "agents.channel_analyzer",
+    "agents.next_best_action",
+    "agents.fused_analyzer",
+    "agents.synthesis_agent",
+    "agents.message_templates",
+    "agents.packed",
+)
+
+# Factory of every registered agent, by agent name
+_factories: Dict[str, Callable[[], "Agent"]] = {}
+
+# Agents built so far, by agent name
+_agents: Dict[str, "Agent"] = {}
+
+
+def register_agent(name: str) -> Callable:
+    """Decorator registering a factory that builds agent `name` on its first get_agent()"""
+    def register(factory: Callable[[], "Agent"]) -> Callable[[], "Agent"]:
+        if name in _factories:
+            raise ValueError(f"Agent {name!r} is already registered")
+        _factories[name] = factory
+        return factory
+    return register
+
+
+def get_agent(name: str) -> "Agent":
+    """
+    The agent registered as `name`, built on first use. pydantic-ai (and
+    the Gemini client behind get_model) is only imported, and logfire only
+    configured, once the first agent is needed.
+    """
+    agent = _agents.get(name)
+    if agent is None:
+        if name not in _factories:
+            raise KeyError(f"Unknown agent {name!r}; registered: {', '.join(sorted(_factories))}")
+        init_instrumentation()
+        agent = _agents[name] = _factories[name]()
+    return agent
+
+
+def registered_agents() -> List[str]:
+    return sorted(_factories)
+
+
+def built_agents() -> List[str]:
+    return sorted(_agents)
+
+
+def load_agent_modules() -> None:
+    """Import every module in AGENT_MODULES so all agents are registered"""
+    for module in AGENT_MODULES:
+        importlib.import_module(module)
+
+
+def prewarm_agents(names: Optional[Iterable[str]] = None, model: bool = True) -> float:
+    """
+    Build agents `names` (all registered agents when None) and, with `model`,
+    the shared model and its HTTP client, so a worker pays for imports and
+    construction before its first customer instead of during it. Returns the
+    seconds spent.
+    """
+    start = time.perf_counter()
+    load_agent_modules()
+    names = registered_agents() if names is None else list(names)
+    unknown = [name for name in names if name not in _factories]
+    if unknown:
+        raise ValueError(f"Unknown agents {', '.join(unknown)}; registered: {', '.join(registered_agents())}")
+    for name in names:
+        get_agent(name)
+    if model:
+        get_model()
+    return time.perf_counter() - start
@@ -0,0 +1,187 @@
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from agents.cache import ResponseCache, make_cache_key
+from agents.deadlines import mark_model_call
+from agents.scheduler import PRIORITY_ANALYSIS, RateLimitScheduler
+from agents.tracing import span
+from agents.usage import UsageTracker, current_customer, usage_totals
+from dependencies.model_provider import get_model
+from models.repair import strict_model, strict_output
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+# Shared response cache; None disables caching
+_response_cache: Optional[ResponseCache] = None
+
+# Shared rate-limit scheduler; None sends requests unthrottled
+_scheduler: Optional[RateLimitScheduler] = None
+
+# Shared token accounting and budgets; None records nothing
+_usage_tracker: Optional[UsageTracker] = None
+
+# Rough size of a structured agent response, used when estimating tokens
+ESTIMATED_OUTPUT_TOKENS = 250
+
+
+def configure_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Install (or remove, with None) the response cache used by all agents"""
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
+
+
+def configure_scheduler(scheduler: Optional[RateLimitScheduler]) -> None:
+    """Install (or remove, with None) the rate-limit scheduler every agent call goes through"""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def get_scheduler() -> Optional[RateLimitScheduler]:
+    return _scheduler
+
+
+def configure_usage_tracker(tracker: Optional[UsageTracker]) -> None:
+    """Install (or remove, with None) the tracker that accounts every agent run"""
+    global _usage_tracker
+    _usage_tracker = tracker
+
+
+def get_usage_tracker() -> Optional[UsageTracker]:
+    return _usage_tracker
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def model_name() -> str:
+    model = get_model()
+    return getattr(model, "model_name", None) or str(model)
+
+
+async def run_agent(
+    agent: "Agent",
+    prompt: str,
+    deps: Any = None,
+    system_prompt: str = "",
+    cache_extra: Any = None,
+    priority: int = PRIORITY_ANALYSIS,
+    on_partial: Optional[Callable[[str], None]] = None,
+):
+    """
+    Run an agent and return its output, serving it from the response cache
+    when one is configured. `system_prompt` is the fully rendered system
+    prompt and `cache_extra` covers any other input the agent reads (e.g.
+    via tools), so together they key the cached response. Model requests go
+    through the scheduler, if configured, with the given priority, and are
+    accounted by the usage tracker, if configured.
+
+    With `on_partial`, the response is streamed and `on_partial` receives the
+    text received so far after every chunk (for agents with text or
+    NativeOutput output). A retried request starts over with shorter text.
+    Cached outputs are returned without calling it.
+    """
+    # NativeOutput and similar markers wrap the model type in `outputs`; agents parse
+    # into repairing models (see models.repair), returned and cached as the strict ones
+    output_type = strict_model(getattr(agent.output_type, "outputs", agent.output_type))
+    cache = _response_cache
+    if cache is None:
+        return strict_output(await _call_model(agent, prompt, deps, system_prompt, priority, on_partial), output_type)
+
+    key = make_cache_key(agent.name, model_name(), system_prompt, prompt, output_type, cache_extra)
+    cached = cache.get(key, output_type, agent.name)
+    if cached is not None:
+        if _usage_tracker is not None:
+            _usage_tracker.record_cache_hit(agent.name, current_customer())
+        return cached
+
+    output = strict_output(await _call_model(agent, prompt, deps, system_prompt, priority, on_partial), output_type)
+    cache.set(key, output, output_type, agent.name)
+    return output
+
+
+@dataclass
+class StreamedRun:
+    """Output and usage of a streamed run, shaped like a pydantic-ai run result"""
+    output: Any
+    usage: Any
+
+
+async def _run_streamed(
+    agent: "Agent", prompt: str, deps: Any, model, on_partial: Callable[[str], None], usage: Any = None
+) -> StreamedRun:
+    from pydantic_ai.messages import TextPart
+
+    async with agent.run_stream(prompt, deps=deps, model=model, usage=usage) as stream:
+        async for response in stream.stream_response(debounce_by=None):
+            text = "".join(part.content for part in response.parts if isinstance(part, TextPart))
+            if text:
+                on_partial(text)
+        return StreamedRun(await stream.get_output(), stream.usage)
+
+
+async def _call_model(
+    agent: "Agent", prompt: str, deps: Any, system_prompt: str, priority: int, on_partial: Optional[Callable] = None
+):
+    mark_model_call()
+    tracker = _usage_tracker
+    if tracker is None:
+        return (await _run_scheduled(agent, prompt, deps, system_prompt, priority, [0], on_partial)).output
+
+    from pydantic_ai.usage import RunUsage
+
+    # Filled in by pydantic-ai as requests complete, so a run that raises (exhausted
+    # output retries, 5xx, 429 past the scheduler's retries, deadline or hedge
+    # cancellation) is still accounted with the tokens it spent
+    usage = RunUsage()
+    attempts = [0]
+    started = time.perf_counter()
+    failed = True
+    try:
+        async with tracker.admit(agent.name):
+            result = await _run_scheduled(agent, prompt, deps, system_prompt, priority, attempts, on_partial, usage)
+        failed = False
+    finally:
+        if attempts[0]:  # nothing was sent when the budget rejected the run
+            totals = usage_totals(usage, time.perf_counter() - started, attempts[0], failed)
+            tracker.record(agent.name, totals, current_customer())
+    return result.output
+
+
+async def _run_scheduled(
+    agent: "Agent",
+    prompt: str,
+    deps: Any,
+    system_prompt: str,
+    priority: int,
+    attempts: list,
+    on_partial: Optional[Callable[[str], None]] = None,
+    usage: Any = None,
+):
+    """
+    agent.run (or a streamed run) through the scheduler, if configured;
+    counts attempts in `attempts[0]` and accumulates usage into `usage`
+    """
+    model = get_model()
+
+    async def call():
+        attempts[0] += 1
+        # A request after a 429 is a retry; time waiting for the scheduler stays in the enclosing "queue"
+        with span("model" if attempts[0] == 1 else "retry"):
+            if on_partial is not None:
+                return await _run_streamed(agent, prompt, deps, model, on_partial, usage)
+            return await agent.run(prompt, deps=deps, model=model, usage=usage)
+
+    scheduler = _scheduler
+    if scheduler is None:
+        return await call()
+    estimated = estimate_tokens(system_prompt + prompt) + ESTIMATED_OUTPUT_TOKENS
+    with span("queue"):
+        return await scheduler.run(call, priority, estimated)
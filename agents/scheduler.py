@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import random
+import time
+from collections import Counter
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Lower values are served first: synthesis finishes customers whose analysis is done
+PRIORITY_SYNTHESIS = 0
+PRIORITY_ANALYSIS = 1
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to `capacity` units"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they already are)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # oversized requests wait for a full bucket
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount  # may go negative when actual usage exceeds the estimate
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose level lives in shared memory, so schedulers in several
+    processes draw from one quota. Pass it to worker processes when they are
+    started; time.monotonic() is system-wide, so refills agree across them.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None, context=multiprocessing):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self._state = context.Array("d", [self.capacity, time.monotonic()])  # level, last refill
+
+    @property
+    def level(self) -> float:
+        return self._state[0]
+
+    @level.setter
+    def level(self, value: float) -> None:
+        self._state[0] = value
+
+    @property
+    def _updated(self) -> float:
+        return self._state[1]
+
+    @_updated.setter
+    def _updated(self, value: float) -> None:
+        self._state[1] = value
+
+    def wait_time(self, amount: float) -> float:
+        with self._state.get_lock():
+            return super().wait_time(amount)
+
+    def take(self, amount: float) -> None:
+        with self._state.get_lock():
+            super().take(amount)
+
+
+def burst_capacity(per_minute: float) -> float:
+    """A few seconds of burst at most, so the quota is spread over the minute"""
+    return max(1.0, per_minute / 20)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    from pydantic_ai.exceptions import ModelHTTPError
+
+    return isinstance(exc, ModelHTTPError) and exc.status_code == 429
+
+
+class RateLimitScheduler:
+    """
+    Admission control shared by every agent call. A call waits until both
+    token buckets (requests/min and tokens/min) can pay for it and a
+    concurrency slot is free; waiters are served by priority, then FIFO.
+    The concurrency limit follows AIMD: it grows by ~1 per limit's worth of
+    fast successes and is cut on 429s (halved) or slow responses (by 10%).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 4000,
+        tokens_per_minute: float = 4_000_000,
+        initial_concurrency: int = 16,
+        min_concurrency: int = 1,
+        max_concurrency: int = 256,
+        latency_target: float = 5.0,
+        max_retries: int = 5,
+        backoff_seconds: float = 1.0,
+        requests_bucket: Optional[TokenBucket] = None,
+        tokens_bucket: Optional[TokenBucket] = None,
+    ):
+        # Buckets may be passed in to share one quota (e.g. SharedTokenBucket across processes)
+        self.requests = requests_bucket or TokenBucket(requests_per_minute, capacity=burst_capacity(requests_per_minute))
+        self.tokens = tokens_bucket or TokenBucket(tokens_per_minute, capacity=burst_capacity(tokens_per_minute))
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.in_flight = 0
+        self.stats: Counter = Counter()
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def run(self, call: Callable[[], Awaitable[T]], priority: int = PRIORITY_ANALYSIS, estimated_tokens: int = 0) -> T:
+        """Run `call` once admitted, retrying with backoff when the provider answers 429"""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, estimated_tokens)
+            started = time.monotonic()
+            try:
+                result = await call()
+            except Exception as exc:
+                if not is_rate_limited(exc):
+                    self.stats["errors"] += 1
+                    self._release_slot()
+                    raise
+                self._release(time.monotonic() - started, throttled=True)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff_seconds * 2 ** attempt * (0.5 + random.random()))
+                continue
+            except BaseException:
+                self._release_slot()  # cancelled: says nothing about the provider
+                raise
+            self._release(time.monotonic() - started, extra_tokens=_result_tokens(result) - estimated_tokens)
+            return result
+        raise AssertionError("unreachable")
+
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()  # admitted right as the caller was cancelled
+            raise
+
+    def _dispatch(self) -> None:
+        """Admit waiters in priority order while a slot and enough quota are available"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, tokens, future = self._waiters[0]
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                self.stats["quota_waits"] += 1
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self, latency: float, throttled: bool = False, extra_tokens: int = 0) -> None:
+        if throttled:
+            self.stats["throttled"] += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+        elif latency > self.latency_target:
+            self.stats["slow"] += 1
+            self.limit = max(self.min_concurrency, self.limit * 0.9)
+        else:
+            self.stats["ok"] += 1
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        if extra_tokens > 0:
+            self.tokens.take(extra_tokens)  # charge what the estimate missed
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+
+def _result_tokens(result) -> int:
+    """Total tokens reported by an agent run result, 0 if unknown"""
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return 0
+    usage = usage() if callable(usage) else usage
+    return getattr(usage, "total_tokens", 0) or 0
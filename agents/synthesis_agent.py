@@ -1,4 +1,11 @@
-from pydantic_ai import Agent
+import asyncio
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional
+
+import pydantic_core
+from pydantic import TypeAdapter, ValidationError, create_model
 from models.outputs import (
     FinancialSituation, 
     LifeMoment, 
@@ -6,42 +13,78 @@ from models.outputs import (
     NextBestAction,
     HyperpersonalizedMessage
 )
-import logfire
-
-logfire.configure()
-logfire.instrument_pydantic_ai()
+from models.repair import repairing_model
+from agents.registry import get_agent, register_agent
+from agents.tracing import traced
+from agents.runtime import run_agent
+from agents.scheduler import PRIORITY_SYNTHESIS
 
-from pydantic_ai.models.google import GoogleModelSettings
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
 
 # Configure the model settings for Google Gemini 2.5 Flash-Lite
-model_settings = GoogleModelSettings(
-    google_thinking_config={'thinking_budget': 0}
+model_settings = {'google_thinking_config': {'thinking_budget': 0}}
+
+SYSTEM_PROMPT = (
+    "You are an expert in customer communication and personalization. "
+    "Given insights about a customer's financial situation, life moments, "
+    "channel preferences, and recommended actions, craft a highly personalized "
+    "message that resonates with their specific context and needs. "
+    "The message should be relevant, timely, empathetic, and include a clear call-to-action. "
+    "Adapt tone and style based on the customer profile and recommended channel."
 )
 
-synthesis_agent = Agent(
-    'google-gla:gemini-2.5-flash-lite',
-    output_type=HyperpersonalizedMessage,
-    model_settings=model_settings,
-    system_prompt=(
-        "You are an expert in customer communication and personalization. "
-        "Given insights about a customer's financial situation, life moments, "
-        "channel preferences, and recommended actions, craft a highly personalized "
-        "message that resonates with their specific context and needs. "
-        "The message should be relevant, timely, empathetic, and include a clear call-to-action. "
-        "Adapt tone and style based on the customer profile and recommended channel."
+@register_agent('synthesis_agent')
+def build_synthesis_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent
+
+    return Agent(
+        # The model comes from dependencies.model_provider, passed per run by agents.runtime
+        name='synthesis_agent',
+        output_type=repairing_model(HyperpersonalizedMessage),
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
     )
+
+# Field order of streamed messages: the fields delivery routes on come first,
+# the long body late, so routing can start before the message is complete
+STREAM_FIELD_ORDER = [
+    "recommended_channel", "message_subject", "optimal_send_time", "tone",
+    "call_to_action", "message_body", "personalization_elements", "expected_engagement_rate",
+]
+ROUTING_FIELDS = {"recommended_channel", "message_subject"}
+
+StreamedMessage = create_model(
+    "StreamedMessage",
+    __doc__=HyperpersonalizedMessage.__doc__,
+    **{name: (HyperpersonalizedMessage.model_fields[name].annotation, HyperpersonalizedMessage.model_fields[name])
+       for name in STREAM_FIELD_ORDER},
 )
 
-async def synthesize_message(
+# Native (JSON text) output streams token by token; tool-call arguments may arrive in one piece
+@register_agent('synthesis_agent_streaming')
+def build_streaming_synthesis_agent() -> "Agent":
+    """Built on first use by agents.registry.get_agent"""
+    from pydantic_ai import Agent, NativeOutput
+
+    return Agent(
+        name='synthesis_agent_streaming',
+        output_type=NativeOutput(repairing_model(StreamedMessage)),
+        model_settings=model_settings,
+        system_prompt=SYSTEM_PROMPT
+    )
+
+@traced("prompt")
+def render_synthesis_prompt(
     financial: FinancialSituation,
     life_moment: LifeMoment,
     channel: ChannelPreference,
     action: NextBestAction,
     customer_name: str
-) -> HyperpersonalizedMessage:
-    """Synthesize all insights into personalized message"""
-    
-    prompt = f"""
+) -> str:
+    """Render the synthesis request from the analysis outputs"""
+    return f"""
 Generate a hyperpersonalized message for {customer_name} based on the following insights:
 
 FINANCIAL SITUATION:
@@ -72,6 +115,114 @@ Create a message that:
 4. Includes a compelling call-to-action
 5. Uses appropriate tone for the {channel.primary_channel} channel
 """
+
+async def synthesize_message(
+    financial: FinancialSituation,
+    life_moment: LifeMoment,
+    channel: ChannelPreference,
+    action: NextBestAction,
+    customer_name: str
+) -> HyperpersonalizedMessage:
+    """Synthesize all insights into personalized message"""
+    prompt = render_synthesis_prompt(financial, life_moment, channel, action, customer_name)
     
-    result = await synthesis_agent.run(prompt)
-    return result.output
+    # Synthesis goes ahead of new analysis work so started customers finish first
+    return await run_agent(get_agent('synthesis_agent'), prompt, system_prompt=SYSTEM_PROMPT, priority=PRIORITY_SYNTHESIS)
+
+@lru_cache(maxsize=None)
+def _field_adapter(name: str) -> TypeAdapter:
+    return TypeAdapter(HyperpersonalizedMessage.model_fields[name].annotation)
+
+class PartialMessageParser:
+    """
+    Extracts the validated fields of a message from partial JSON text. A
+    field counts as complete once the next key has started (or the text is
+    final), so truncated strings and numbers are never reported.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+
+    def feed(self, text: str, final: bool = False) -> List[str]:
+        """Parse the text received so far; returns the names of newly completed fields"""
+        try:
+            data = pydantic_core.from_json(text, allow_partial=True)
+        except ValueError:
+            return []
+        if not isinstance(data, dict):
+            return []
+        keys = list(data)
+        new = []
+        for key in keys if final else keys[:-1]:
+            if key in self.fields or key not in HyperpersonalizedMessage.model_fields:
+                continue
+            try:
+                self.fields[key] = _field_adapter(key).validate_python(data[key])
+            except ValidationError:
+                continue
+            new.append(key)
+        return new
+
+@dataclass
+class SynthesisUpdate:
+    """Progress of a streamed synthesis"""
+    fields: Dict[str, Any]  # validated fields so far
+    new_fields: List[str]  # fields completed by this update
+    elapsed: float  # seconds since the synthesis started
+    message: Optional[HyperpersonalizedMessage] = None  # set on the last update only
+
+@dataclass
+class SynthesisTiming:
+    """Time-to-field metrics of one streamed synthesis, in seconds from its start"""
+    first_field_s: Optional[float] = None
+    routing_fields_s: Optional[float] = None
+    complete_s: Optional[float] = None
+    field_s: Dict[str, float] = field(default_factory=dict)
+
+    def observe(self, update: SynthesisUpdate) -> None:
+        for name in update.new_fields:
+            self.field_s.setdefault(name, update.elapsed)
+        if self.first_field_s is None and update.new_fields:
+            self.first_field_s = update.elapsed
+        if self.routing_fields_s is None and ROUTING_FIELDS <= update.fields.keys():
+            self.routing_fields_s = update.elapsed
+        if update.message is not None:
+            self.complete_s = update.elapsed
+
+async def stream_synthesis(
+    financial: FinancialSituation,
+    life_moment: LifeMoment,
+    channel: ChannelPreference,
+    action: NextBestAction,
+    customer_name: str
+) -> AsyncIterator[SynthesisUpdate]:
+    """
+    Streaming variant of synthesize_message: yields an update whenever more
+    fields are complete and validated, routing fields first, and finally one
+    carrying the full HyperpersonalizedMessage. A cached response arrives as
+    that final update alone.
+    """
+    prompt = render_synthesis_prompt(financial, life_moment, channel, action, customer_name)
+    parser = PartialMessageParser()
+    updates: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    def on_partial(text: str) -> None:
+        new = parser.feed(text)
+        if new:
+            updates.put_nowait(SynthesisUpdate(dict(parser.fields), new, time.perf_counter() - started))
+
+    run = asyncio.create_task(run_agent(
+        get_agent('synthesis_agent_streaming'), prompt, system_prompt=SYSTEM_PROMPT, priority=PRIORITY_SYNTHESIS, on_partial=on_partial
+    ))
+    run.add_done_callback(lambda _: updates.put_nowait(None))
+    try:
+        while (update := await updates.get()) is not None:
+            yield update
+        streamed = run.result()
+    finally:
+        run.cancel()  # the consumer stopped early
+
+    message = HyperpersonalizedMessage.model_validate(streamed.model_dump())
+    remaining = [name for name in STREAM_FIELD_ORDER if name not in parser.fields]
+    yield SynthesisUpdate(message.model_dump(), remaining, time.perf_counter() - started, message)
@@ -0,0 +1,335 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterator, List, Optional, Tuple
+
+from pipeline.stats import StageStats
+
+# Deepest stack kept per CPU profile sample
+MAX_PROFILE_DEPTH = 64
+
+# Whether logfire has been configured and pydantic-ai instrumented in this process
+_instrumented = False
+
+
+def init_instrumentation() -> None:
+    """
+    Configure logfire and instrument pydantic-ai, once per process however
+    many modules ask. A failed configuration raises and is tried again by
+    the next call.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    import logfire
+
+    logfire.configure()
+    logfire.instrument_pydantic_ai()
+    _instrumented = True
+
+
+@dataclass
+class Span:
+    """One timed stage of a customer; `parent` indexes the enclosing span of the same trace"""
+    name: str
+    start: float
+    parent: Optional[int] = None
+    end: Optional[float] = None
+    retry_at: Optional[float] = None  # set on "model" spans whose output was rejected, see mark_retry
+
+
+@dataclass
+class CustomerTrace:
+    """Spans and CPU samples of one customer, rooted at a "customer" span"""
+    customer_id: str
+    spans: List[Span] = field(default_factory=list)
+    samples: Counter = field(default_factory=Counter)
+    tasks: List[asyncio.Task] = field(default_factory=list)
+
+    def open(self, name: str, parent: Optional[int]) -> int:
+        self.spans.append(Span(name, time.perf_counter(), parent))
+        return len(self.spans) - 1
+
+    def close(self, index: int) -> None:
+        span = self.spans[index]
+        span.end = time.perf_counter()
+        if span.retry_at is not None:
+            # Time after the rejected output is spent re-asking the model
+            retry = len(self.spans)
+            self.spans.append(Span("retry", span.retry_at, span.parent, span.end))
+            for child in self.spans[index + 1:retry]:
+                if child.parent == index and child.start >= span.retry_at:
+                    child.parent = retry
+            span.end = span.retry_at
+
+    def mark_retry(self, index: Optional[int]) -> None:
+        """Record that the output validated in span `index` was rejected and goes back to the model"""
+        while index is not None:
+            span = self.spans[index]
+            if span.name == "model":
+                if span.retry_at is None:
+                    span.retry_at = time.perf_counter()
+                return
+            index = span.parent
+
+    def children(self) -> Dict[int, List[int]]:
+        children: Dict[int, List[int]] = {}
+        for index, span in enumerate(self.spans):
+            if span.parent is not None and span.end is not None:
+                children.setdefault(span.parent, []).append(index)
+        return children
+
+    def critical_path(self, index: int = 0, children: Optional[Dict[int, List[int]]] = None) -> List[Tuple[str, float]]:
+        """
+        The chain of stages the span's end depends on, as (stage, seconds)
+        segments in time order that add up to its duration. Walking back from
+        its end, the child that finished last is followed and time not
+        covered by a child is the span's own; with fan-out, only the slowest
+        branch of each fan-in is on the path.
+        """
+        children = self.children() if children is None else children
+        span = self.spans[index]
+        backwards: List[Tuple[str, float]] = []
+        cursor = span.end
+        candidates = children.get(index, [])
+        while True:
+            ended = [child for child in candidates if self.spans[child].end <= cursor]
+            if not ended:
+                break
+            child = max(ended, key=lambda candidate: self.spans[candidate].end)
+            backwards.append((span.name, cursor - self.spans[child].end))
+            backwards.extend(reversed(self.critical_path(child, children)))
+            cursor = self.spans[child].start
+            candidates = ended
+        backwards.append((span.name, cursor - span.start))
+        path: List[Tuple[str, float]] = []
+        for name, seconds in reversed(backwards):
+            if seconds <= 0:
+                continue
+            if path and path[-1][0] == name:
+                path[-1] = (name, path[-1][1] + seconds)
+            else:
+                path.append((name, seconds))
+        return path
+
+    def to_dict(self) -> dict:
+        origin = self.spans[0].start
+        return {
+            "customer_id": self.customer_id,
+            "total_s": self.spans[0].end - origin,
+            "spans": [
+                {"name": span.name, "parent": span.parent, "start_s": span.start - origin, "end_s": span.end - origin}
+                for span in self.spans if span.end is not None
+            ],
+            "critical_path": self.critical_path(),
+        }
+
+
+# Trace and span that stages started here belong to; copied into tasks created here
+_current_span: contextvars.ContextVar[Optional[Tuple[CustomerTrace, int]]] = contextvars.ContextVar(
+    "trace_span", default=None
+)
+
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread's stack every `interval` seconds from a
+    background thread and files each sample under the trace of the task
+    running at that moment. Samples taken while the loop waits for I/O have
+    no running task and are dropped, so a trace collects only its CPU time.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.005):
+        self.loop = loop
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.traces: Dict[asyncio.Task, CustomerTrace] = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="trace-profiler", daemon=True)
+        self._thread.start()
+
+    def watch(self, trace: CustomerTrace) -> None:
+        """Attribute samples of the current task to `trace`"""
+        if threading.get_ident() != self.thread_id:
+            return  # e.g. a sync system prompt function pydantic-ai runs in a worker thread
+        task = asyncio.current_task()
+        if task is not None and task not in self.traces:
+            with self.lock:
+                self.traces[task] = trace
+            trace.tasks.append(task)
+
+    def release(self, trace: CustomerTrace) -> Counter:
+        """Stop sampling for `trace`; returns its samples as folded stack -> count"""
+        with self.lock:
+            for task in trace.tasks:
+                self.traces.pop(task, None)
+            return Counter(trace.samples)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            task = asyncio.current_task(self.loop)
+            trace = self.traces.get(task) if task is not None else None
+            frame = sys._current_frames().get(self.thread_id) if trace is not None else None
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_PROFILE_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            with self.lock:
+                if task in self.traces:
+                    trace.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class Tracer:
+    """
+    Stage tracing of process_customer_for_personalization. Each customer is
+    a tree of spans: the analyses ("analysis" fan-out, one branch per
+    analysis, or "fused"), "synthesis", and within them "prompt" building,
+    "queue" (waiting for the rate-limit scheduler), "model" (the request),
+    "validation" of the output and "retry" (re-asking after a rejected
+    output or a 429). When a customer finishes, its span durations and the
+    stages of its critical path go into `stats` (see pipeline.stats.StageStats).
+    Traces are written as JSONL to `path`, kept in memory (the last `keep`),
+    or both. With `profile_slower_than`, a sampling profiler records CPU
+    stacks of every customer and writes them, in folded format (for
+    flamegraph.pl or speedscope), to `profile_dir` for customers slower than
+    that many seconds only. With `window`, `stats` keeps rolling samples (see
+    StageStats).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        keep: int = 0,
+        profile_slower_than: Optional[float] = None,
+        profile_dir: str = "profiles",
+        sample_interval: float = 0.005,
+        window: Optional[int] = None,
+    ):
+        self.path = path
+        self.stats = StageStats(window=window)
+        self.recent: Deque[dict] = deque(maxlen=keep)
+        self.profile_slower_than = profile_slower_than
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.profiler: Optional[SamplingProfiler] = None
+        self._sink = open(path, "w") if path else None
+
+    @contextmanager
+    def customer(self, customer_id: str) -> Iterator[CustomerTrace]:
+        """Trace the stages run inside the block (and in tasks created in it) as one customer"""
+        trace = CustomerTrace(customer_id)
+        token = _current_span.set((trace, trace.open("customer", None)))
+        if self.profile_slower_than is not None:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(asyncio.get_running_loop(), self.sample_interval)
+            self.profiler.watch(trace)
+        try:
+            yield trace
+        finally:
+            _current_span.reset(token)
+            trace.close(0)
+            self._finish(trace)
+
+    def _finish(self, trace: CustomerTrace) -> None:
+        record = trace.to_dict()
+        self.stats.record(trace.spans, record["critical_path"], record["total_s"])
+        if self.profiler is not None:
+            samples = self.profiler.release(trace)
+            if record["total_s"] >= self.profile_slower_than and samples:
+                record["profile"] = self._write_profile(trace.customer_id, samples)
+                self.stats.profiles_written += 1
+        if self._sink is not None:
+            self._sink.write(json.dumps(record) + "\n")
+        self.recent.append(record)
+
+    def _write_profile(self, customer_id: str, samples: Counter) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, re.sub(r"[^\w.-]", "_", customer_id) + ".folded")
+        with open(path, "w") as handle:
+            for stack, count in samples.most_common():
+                handle.write(f"{stack} {count}\n")
+        return path
+
+    def close(self) -> None:
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+# Shared tracer; None records nothing
+_tracer: Optional[Tracer] = None
+
+
+def configure_tracer(tracer: Optional[Tracer]) -> None:
+    """Install (or remove, with None) the tracer customers are traced by"""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def trace_customer(customer_id: str) -> ContextManager:
+    """Trace a customer with the configured tracer; does nothing without one"""
+    return _tracer.customer(customer_id) if _tracer is not None else nullcontext()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the block as stage `name` of the customer being traced, if any"""
+    current = _current_span.get()
+    if current is None:
+        yield
+        return
+    trace, parent = current
+    index = trace.open(name, parent)
+    token = _current_span.set((trace, index))
+    tracer = _tracer
+    if tracer is not None and tracer.profiler is not None:
+        tracer.profiler.watch(trace)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        trace.close(index)
+
+
+def mark_retry() -> None:
+    """Record that the output being validated was rejected, so the rest of its model call counts as "retry" """
+    current = _current_span.get()
+    if current is not None:
+        current[0].mark_retry(current[1])
+
+
+def traced(name: str) -> Callable:
+    """Decorator timing every call of a (synchronous) function as stage `name`"""
+    def decorate(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _current_span.get() is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
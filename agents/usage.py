@@ -0,0 +1,204 @@
+import asyncio
+import contextvars
+import json
+import time
+import warnings
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, Optional
+
+# Customer the current agent calls are attributed to (set per customer by main.py)
+_current_customer: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_customer", default=None)
+
+# USD per million tokens; defaults are Gemini 2.5 Flash-Lite list prices
+DEFAULT_INPUT_COST_PER_MTOK = 0.10
+DEFAULT_OUTPUT_COST_PER_MTOK = 0.40
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised instead of sending a model request once the hard token budget is spent"""
+
+
+@contextmanager
+def customer_scope(customer_id: Optional[str]) -> Iterator[None]:
+    """Attribute agent calls made inside the block (and tasks created in it) to `customer_id`"""
+    token = _current_customer.set(customer_id)
+    try:
+        yield
+    finally:
+        _current_customer.reset(token)
+
+
+def current_customer() -> Optional[str]:
+    return _current_customer.get()
+
+
+@dataclass
+class UsageTotals:
+    """Aggregated usage of a group of agent runs"""
+    runs: int = 0
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    retries: int = 0
+    cache_hits: int = 0
+    failed: int = 0  # runs that raised; their tokens and requests are still counted
+    wall_s: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: "UsageTotals") -> None:
+        for name, value in asdict(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+def usage_totals(usage, wall_s: float, attempts: int = 1, failed: bool = False) -> UsageTotals:
+    """
+    UsageTotals of one agent run, from its result or its (possibly partial)
+    RunUsage. Retries count both rejected attempts (e.g. 429s retried by the
+    scheduler) and extra model requests pydantic-ai made to repair invalid
+    output.
+    """
+    usage = getattr(usage, "usage", usage)
+    usage = usage() if callable(usage) else usage  # a method in older pydantic-ai releases
+    requests = getattr(usage, "requests", 1) or 1
+    return UsageTotals(
+        runs=1,
+        requests=requests + attempts - 1,
+        input_tokens=getattr(usage, "input_tokens", None) or getattr(usage, "request_tokens", 0) or 0,
+        output_tokens=getattr(usage, "output_tokens", None) or getattr(usage, "response_tokens", 0) or 0,
+        retries=requests - 1 + attempts - 1,
+        failed=int(failed),
+        wall_s=wall_s,
+    )
+
+
+class UsageTracker:
+    """
+    Token accounting for every agent run, aggregated per agent, per customer
+    and for the whole batch. Optional budgets apply to the batch total: past
+    `soft_token_budget` at most `throttled_concurrency` model requests run at
+    a time; past `hard_token_budget` new requests raise TokenBudgetExceeded.
+    Requests already in flight when a budget is crossed still complete, so
+    the total can overshoot by up to one request per concurrent call.
+    """
+
+    def __init__(
+        self,
+        soft_token_budget: Optional[int] = None,
+        hard_token_budget: Optional[int] = None,
+        throttled_concurrency: int = 1,
+        input_cost_per_mtok: float = DEFAULT_INPUT_COST_PER_MTOK,
+        output_cost_per_mtok: float = DEFAULT_OUTPUT_COST_PER_MTOK,
+        keep_customers: bool = True,
+    ):
+        self.soft_token_budget = soft_token_budget
+        self.hard_token_budget = hard_token_budget
+        self.input_cost_per_mtok = input_cost_per_mtok
+        self.output_cost_per_mtok = output_cost_per_mtok
+        self.keep_customers = keep_customers
+        self.total = UsageTotals()
+        self.by_agent: Dict[str, UsageTotals] = defaultdict(UsageTotals)
+        self.by_customer: Dict[str, UsageTotals] = defaultdict(UsageTotals)
+        self.rejected = 0
+        self.throttled_concurrency = throttled_concurrency
+        self._throttle = asyncio.Semaphore(throttled_concurrency)
+        self._soft_warned = False
+        self._started = time.monotonic()
+
+    @property
+    def hard_budget_exhausted(self) -> bool:
+        return self.hard_token_budget is not None and self.total.total_tokens >= self.hard_token_budget
+
+    @property
+    def soft_budget_exceeded(self) -> bool:
+        return self.soft_token_budget is not None and self.total.total_tokens >= self.soft_token_budget
+
+    def admit(self, agent_name: str):
+        """
+        Check the budgets before a model request. Returns an async context
+        manager to hold around the request (a throttle slot past the soft budget).
+        """
+        if self.hard_budget_exhausted:
+            self.rejected += 1
+            raise TokenBudgetExceeded(
+                f"Token budget of {self.hard_token_budget} spent ({self.total.total_tokens} used); "
+                f"not running {agent_name}"
+            )
+        if self.soft_budget_exceeded:
+            if not self._soft_warned:
+                self._soft_warned = True
+                warnings.warn(
+                    f"Soft token budget of {self.soft_token_budget} reached; "
+                    f"throttling model requests to {self.throttled_concurrency} at a time"
+                )
+            return self._throttle
+        return nullcontext()
+
+    def record(self, agent_name: str, usage: UsageTotals, customer_id: Optional[str] = None) -> None:
+        self.total.add(usage)
+        self.by_agent[agent_name].add(usage)
+        if self.keep_customers and customer_id is not None:
+            self.by_customer[customer_id].add(usage)
+
+    def record_cache_hit(self, agent_name: str, customer_id: Optional[str] = None) -> None:
+        self.record(agent_name, UsageTotals(runs=1, cache_hits=1), customer_id)
+
+    def snapshot(self) -> dict:
+        """Picklable copy of the aggregates, e.g. to send from a worker process"""
+        return {
+            "total": self.total,
+            "by_agent": dict(self.by_agent),
+            "by_customer": dict(self.by_customer),
+            "rejected": self.rejected,
+        }
+
+    def absorb(self, snapshot: dict) -> None:
+        """Add the aggregates of another tracker's snapshot to this one"""
+        self.total.add(snapshot["total"])
+        for name, usage in snapshot["by_agent"].items():
+            self.by_agent[name].add(usage)
+        for customer_id, usage in snapshot["by_customer"].items():
+            self.by_customer[customer_id].add(usage)
+        self.rejected += snapshot["rejected"]
+
+    def cost(self, usage: UsageTotals) -> float:
+        """Estimated USD cost of `usage`"""
+        return (usage.input_tokens * self.input_cost_per_mtok + usage.output_tokens * self.output_cost_per_mtok) / 1e6
+
+    def _row(self, usage: UsageTotals) -> dict:
+        return {**asdict(usage), "total_tokens": usage.total_tokens, "cost_usd": self.cost(usage)}
+
+    def to_dict(self) -> dict:
+        """Structured metrics: batch totals, per-agent and per-customer breakdowns"""
+        customers = len(self.by_customer)
+        return {
+            "elapsed_s": time.monotonic() - self._started,
+            "batch": self._row(self.total),
+            "agents": {name: self._row(usage) for name, usage in sorted(self.by_agent.items())},
+            "customers": {cid: self._row(usage) for cid, usage in self.by_customer.items()},
+            "tokens_per_customer": self.total.total_tokens / customers if customers else None,
+            "budget": {
+                "soft_tokens": self.soft_token_budget,
+                "hard_tokens": self.hard_token_budget,
+                "soft_exceeded": self.soft_budget_exceeded,
+                "hard_exhausted": self.hard_budget_exhausted,
+                "rejected_requests": self.rejected,
+            },
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+
+    def agent_summary(self) -> str:
+        """One line per agent, most expensive first"""
+        rows = sorted(self.by_agent.items(), key=lambda item: item[1].total_tokens, reverse=True)
+        return "\n".join(
+            f"  {name:<28} {usage.runs:>6} runs {usage.input_tokens:>10} in {usage.output_tokens:>9} out "
+            f"{usage.retries:>4} retries  ${self.cost(usage):.4f}"
+            for name, usage in rows
+        )
@@ -0,0 +1,155 @@
+"""
+Compare the fused analysis mode with the four-agent fan-out on the same customers.
+
+For each mode the analyses (not synthesis) of every customer are run and
+the report gives latency percentiles, model requests and tokens per
+customer, then how often the two modes agree on each categorical field and
+how far apart their numeric estimates are. Agreement is only meaningful
+against a real model:
+
+    python3 -m benchmarks.compare_modes --customers 100            # Gemini, needs GOOGLE_API_KEY
+    python3 -m benchmarks.compare_modes --customers 100 --simulated  # offline smoke run
+"""
+import os
+
+# Keep telemetry local and quiet; must happen before the agents are imported
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+os.environ.setdefault("LOGFIRE_CONSOLE", "false")
+
+import argparse
+import asyncio
+import json
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.run_benchmark import RESULTS_DIR, _git_commit
+from benchmarks.simulated_model import LatencyProfile, SimulatedModel
+from benchmarks.synthetic_data import generate_customers
+from dependencies.model_provider import close_model_provider, override_model
+from pipeline.stats import LatencyStats
+
+# Fields compared for exact agreement, per analysis
+CATEGORICAL_FIELDS = {
+    "financial_situation": ["overall_health"],
+    "life_moment": ["time_sensitivity"],
+    "channel_preference": ["primary_channel", "personalization_level"],
+    "next_best_action": ["action_type", "priority"],
+}
+
+# Fields compared by mean absolute difference
+NUMERIC_FIELDS = {
+    "financial_situation": ["savings_rate"],
+    "life_moment": ["confidence_score"],
+    "channel_preference": ["engagement_likelihood"],
+}
+
+
+async def run_mode(name: str, profiles, concurrency: int) -> dict:
+    """Analyze every profile in one mode; returns its metrics and the outputs per customer"""
+    from agents.runtime import configure_usage_tracker
+    from agents.usage import UsageTracker
+    from dependencies.customer_deps import CustomerDependencies
+    from main import ANALYSES, run_fused_analysis, run_parallel_analyses
+    from pipeline.features import compute_features
+
+    analyze = run_fused_analysis if name == "fused" else run_parallel_analyses
+    tracker = UsageTracker(keep_customers=False)
+    configure_usage_tracker(tracker)
+    stats = LatencyStats()
+    outputs: Dict[str, dict] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(profile, features) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                results, _ = await analyze(CustomerDependencies(customer_profile=profile, features=features))
+            except Exception:
+                stats.errors += 1
+                return
+            stats.record(time.perf_counter() - started)
+            outputs[profile.customer_id] = {
+                analysis: result.model_dump() for (analysis, _, _), result in zip(ANALYSES, results)
+            }
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(p, f) for p, f in zip(profiles, compute_features(profiles))))
+    summary = stats.summary(time.perf_counter() - started)
+    configure_usage_tracker(None)
+    summary.update({
+        "mode": name,
+        "model_requests": tracker.total.requests,
+        "requests_per_customer": tracker.total.requests / max(summary["customers"], 1),
+        "input_tokens": tracker.total.input_tokens,
+        "output_tokens": tracker.total.output_tokens,
+        "tokens_per_customer": tracker.total.total_tokens / max(summary["customers"], 1),
+        "cost_usd": tracker.cost(tracker.total),
+    })
+    return {"summary": summary, "outputs": outputs}
+
+
+def agreement(fanout: Dict[str, dict], fused: Dict[str, dict]) -> dict:
+    """Per-field agreement rate (categorical) and mean absolute difference (numeric)"""
+    common = sorted(fanout.keys() & fused.keys())
+    report = {"customers_compared": len(common)}
+    if not common:
+        return report
+    for analysis, fields in CATEGORICAL_FIELDS.items():
+        for field in fields:
+            same = sum(fanout[c][analysis][field] == fused[c][analysis][field] for c in common)
+            report[f"{analysis}.{field}"] = same / len(common)
+    for analysis, fields in NUMERIC_FIELDS.items():
+        for field in fields:
+            diff = sum(abs(fanout[c][analysis][field] - fused[c][analysis][field]) for c in common)
+            report[f"{analysis}.{field}.mean_abs_diff"] = diff / len(common)
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare fused and fan-out analysis modes")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="Customers analyzed at the same time")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--simulated", action="store_true", help="Use the offline simulated model")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/modes-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    profiles = list(generate_customers(args.customers, seed=args.seed))
+    model = SimulatedModel(LatencyProfile(seed=args.seed)) if args.simulated else None
+
+    results: List[dict] = []
+    try:
+        with override_model(model) if model else nullcontext():
+            for mode in ("fanout", "fused"):
+                results.append(await run_mode(mode, profiles, args.concurrency))
+    finally:
+        await close_model_provider()
+
+    for result in results:
+        s = result["summary"]
+        print(f"{s['mode']:>7}: p50 {s['p50_s']:.2f}s  p95 {s['p95_s']:.2f}s  p99 {s['p99_s']:.2f}s  "
+              f"{s['requests_per_customer']:.1f} requests/customer  {s['tokens_per_customer']:.0f} tokens/customer  "
+              f"${s['cost_usd']:.4f}  {s['errors']} errors")
+    agree = agreement(results[0]["outputs"], results[1]["outputs"])
+    print(f"Agreement over {agree['customers_compared']} customers:")
+    for key, value in agree.items():
+        if key != "customers_compared":
+            print(f"  {key:<56} {value:.2f}")
+
+    commit = _git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIR / f"modes-{commit or 'nocommit'}-{int(time.time())}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit,
+        "simulated": args.simulated,
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "modes": [result["summary"] for result in results],
+        "agreement": agree,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+"""
+Startup benchmark and import-time budget check.
+
+Imports the pipeline in fresh interpreters and reports the median wall
+time of `import main` (interpreter startup excluded), the slowest
+top-level imports under `-X importtime`, and what the deferred work costs
+when it does happen: building every registered agent and importing the
+Gemini provider. Exits non-zero when the import exceeds the budget or
+pulls in a module that should only load on first use, so it can gate CI:
+
+    python3 -m benchmarks.import_time --budget 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from benchmarks.run_benchmark import RESULTS_DIR, _git_commit
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules only agents.registry.get_agent / get_model may import
+DEFERRED_MODULES = ("pydantic_ai", "google.genai", "httpx")
+
+CHILD = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import {module}
+import_s = time.perf_counter() - start
+deferred = sorted(name for name in {deferred!r} if name in sys.modules)
+from agents.registry import prewarm_agents, registered_agents
+prewarm_s = prewarm_agents(model=False)
+start = time.perf_counter()
+importlib.import_module("pydantic_ai.models.google")
+importlib.import_module("pydantic_ai.providers.google")
+provider_import_s = time.perf_counter() - start
+print(json.dumps({{
+    "import_s": import_s, "deferred_loaded": deferred, "agents": len(registered_agents()),
+    "prewarm_s": prewarm_s, "provider_import_s": provider_import_s,
+}}))
+"""
+
+
+def _child_env() -> Dict[str, str]:
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    env.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+    env.setdefault("LOGFIRE_CONSOLE", "false")
+    return env
+
+
+def measure(module: str) -> dict:
+    """One cold import of `module` and of everything it defers, in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(module=module, deferred=DEFERRED_MODULES)],
+        capture_output=True, text=True, check=True, cwd=ROOT, env=_child_env(),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int = 10) -> List[Tuple[str, float]]:
+    """Top-level imports of `module` by cumulative seconds, from `-X importtime`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, cwd=ROOT, env=_child_env(),
+    )
+    # A module is listed after everything it imports, so the direct imports of
+    # `module` are the depth-1 lines since the previous top-level line
+    children: List[Tuple[str, float]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda item: item[1], reverse=True)[:top]
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative) / 1e6))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure startup time and check it against a budget")
+    parser.add_argument("--module", default="main", help="Module whose import is measured")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters the median is taken over")
+    parser.add_argument("--budget", type=float, default=1.0, help="Largest median import time allowed (s)")
+    parser.add_argument("--output", default=None,
+                        help="Results file (default: benchmarks/results/import-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    import_s = statistics.median(run["import_s"] for run in runs)
+    deferred_loaded = sorted({name for run in runs for name in run["deferred_loaded"]})
+    report = {
+        "import_s": import_s,
+        "import_runs_s": [run["import_s"] for run in runs],
+        "deferred_loaded": deferred_loaded,
+        "agents": runs[0]["agents"],
+        "prewarm_s": statistics.median(run["prewarm_s"] for run in runs),
+        "provider_import_s": statistics.median(run["provider_import_s"] for run in runs),
+        "slowest_imports": slowest_imports(args.module),
+    }
+
+    print(f"import {args.module}: {import_s * 1000:.0f} ms median over {args.runs} runs (budget {args.budget * 1000:.0f} ms)")
+    for name, seconds in report["slowest_imports"]:
+        print(f"  {name:<40} {seconds * 1000:8.1f} ms")
+    print(f"Deferred to first use: {report['agents']} agents built in {report['prewarm_s'] * 1000:.0f} ms, "
+          f"Gemini provider imported in {report['provider_import_s'] * 1000:.0f} ms")
+
+    commit = _git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIR / f"import-{commit or 'nocommit'}-{int(time.time())}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"commit": commit, "config": vars(args), **report}, indent=2))
+    print(f"Results written to {output}")
+
+    failures = []
+    if import_s > args.budget:
+        failures.append(f"import took {import_s * 1000:.0f} ms, over the {args.budget * 1000:.0f} ms budget")
+    if deferred_loaded:
+        failures.append(f"import loaded {', '.join(deferred_loaded)}, which should load on first use only")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
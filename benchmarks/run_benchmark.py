@@ -0,0 +1,203 @@
+"""
+Offline benchmark for the personalization pipeline.
+
+All agents run against SimulatedModel, so no API key or network is needed.
+Each scenario reports throughput, latency percentiles, CPU time spent in
+the pipeline itself (the simulated model only sleeps) and peak memory, and
+the results are written as JSON for comparison between commits:
+
+    python3 -m benchmarks.run_benchmark --customers 2000 --concurrency 64
+"""
+import os
+
+# Keep telemetry local and quiet; must happen before the agents are imported
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+os.environ.setdefault("LOGFIRE_CONSOLE", "false")
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from benchmarks.simulated_model import LatencyProfile, SimulatedModel
+from benchmarks.synthetic_data import generate_customers
+from dependencies.model_provider import override_model
+from models.repair import configure_output_repair, repair_counts
+from pipeline.stats import LatencyStats
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def measure(name: str, model: SimulatedModel, scenario: Callable[[], Awaitable[dict]], trace_memory: bool) -> dict:
+    """Run a scenario and attach CPU, memory, request and token counts to its summary"""
+    from agents.runtime import configure_usage_tracker
+    from agents.usage import UsageTracker
+
+    tracker = UsageTracker(keep_customers=False)
+    configure_usage_tracker(tracker)
+    requests_before = model.requests
+    repairs_before = Counter(repair_counts)
+    if trace_memory:
+        tracemalloc.start()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+
+    summary = await scenario()
+
+    cpu_seconds = time.process_time() - cpu_start
+    summary.update({
+        "scenario": name,
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": cpu_seconds,
+        "cpu_ms_per_customer": 1000 * cpu_seconds / max(summary["customers"] + summary["errors"], 1),
+        "model_requests": model.requests - requests_before,
+        "output_repair": dict(repair_counts - repairs_before),
+        "input_tokens": tracker.total.input_tokens,
+        "output_tokens": tracker.total.output_tokens,
+        "tokens_per_customer": tracker.total.total_tokens / max(summary["customers"], 1),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+    if trace_memory:
+        summary["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    configure_usage_tracker(None)
+    return summary
+
+
+async def single_customer_scenario(count: int, seed: int) -> dict:
+    """Customers one after another, as main.py does for its sample customer"""
+    from main import process_customer_for_personalization
+
+    stats = LatencyStats()
+    started = time.perf_counter()
+    for profile in generate_customers(count, seed=seed):
+        t0 = time.perf_counter()
+        try:
+            await process_customer_for_personalization(profile, verbose=False)
+            stats.record(time.perf_counter() - t0)
+        except Exception:
+            stats.errors += 1
+    return stats.summary(time.perf_counter() - started)
+
+
+async def batch_scenario(count: int, seed: int, concurrency: int, mode: str) -> dict:
+    """Batch run in "fanout", "fused" or "packed" mode"""
+    from agents.packed import PackedAnalyzer
+    from main import process_customer_for_personalization
+    from pipeline.batch import run_batch, run_packed_batch
+
+    async def fused(profile, features) -> dict:
+        return await process_customer_for_personalization(profile, verbose=False, features=features, fused=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sink = os.path.join(tmp, "results.jsonl")
+        profiles = generate_customers(count, seed=seed)
+        if mode == "packed":
+            return await run_packed_batch(profiles, sink, PackedAnalyzer(), concurrency=max(1, concurrency // 16))
+        return await run_batch(profiles, sink, concurrency=concurrency, processor=fused if mode == "fused" else None)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a simulated model")
+    parser.add_argument("--customers", type=int, default=500, help="Customers in the batch scenarios")
+    parser.add_argument("--single-runs", type=int, default=20, help="Customers in the sequential scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Customers in flight in batch scenarios")
+    parser.add_argument("--median-latency", type=float, default=0.8, help="Median simulated request latency (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.35, help="Log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of structured responses with a near-miss value to repair or retry")
+    parser.add_argument("--no-output-repair", action="store_true",
+                        help="Retry every invalid response with the model instead of repairing near misses")
+    parser.add_argument("--rpm", type=float, default=None, help="Enable the rate-limit scheduler with this quota")
+    parser.add_argument("--agent-deadline", type=float, default=None, help="Per-analysis deadline before falling back (s)")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="Hedge analyses slower than this percentile")
+    parser.add_argument("--scenarios", default="single,batch,fused,packed", help="Comma-separated scenarios to run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--trace-memory", action="store_true", help="Also report tracemalloc peak (slower)")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    profile = LatencyProfile(
+        median_seconds=args.median_latency,
+        sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    model = SimulatedModel(profile)
+    configure_output_repair(not args.no_output_repair)
+
+    if args.rpm:
+        from agents.runtime import configure_scheduler
+        from agents.scheduler import RateLimitScheduler
+
+        configure_scheduler(RateLimitScheduler(requests_per_minute=args.rpm, backoff_seconds=0.1))
+
+    deadlines = None
+    if args.agent_deadline is not None or args.hedge_percentile is not None:
+        from agents.deadlines import DeadlinePolicy, configure_deadlines
+
+        deadlines = DeadlinePolicy(deadline_seconds=args.agent_deadline, hedge_percentile=args.hedge_percentile)
+        configure_deadlines(deadlines)
+
+    scenarios = {
+        "single": lambda: single_customer_scenario(args.single_runs, args.seed),
+        "batch": lambda: batch_scenario(args.customers, args.seed, args.concurrency, "fanout"),
+        "fused": lambda: batch_scenario(args.customers, args.seed, args.concurrency, "fused"),
+        "packed": lambda: batch_scenario(args.customers, args.seed, args.concurrency, "packed"),
+    }
+
+    results = []
+    with override_model(model):
+        for name in args.scenarios.split(","):
+            summary = await measure(name, model, scenarios[name], args.trace_memory)
+            if deadlines is not None:
+                summary["deadlines"] = dict(deadlines.stats)
+                deadlines.stats.clear()
+            results.append(summary)
+            print(f"{name:>8}: {summary['customers_per_s']:8.2f} customers/s  "
+                  f"p50 {summary['p50_s']:.2f}s  p95 {summary['p95_s']:.2f}s  p99 {summary['p99_s']:.2f}s  "
+                  f"cpu {summary['cpu_ms_per_customer']:.2f} ms/customer  "
+                  f"{summary['model_requests']} requests  {summary['tokens_per_customer']:.0f} tokens/customer  "
+                  f"{summary['errors']} errors  {summary['output_repair'].get('repaired_outputs', 0)} repaired")
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "latency_profile": asdict(profile),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit or 'nocommit'}-{int(time.time())}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
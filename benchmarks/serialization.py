@@ -0,0 +1,207 @@
+"""
+Result serialization benchmark: dict records vs compact records.
+
+Builds N synthetic results from the output models and measures, per
+encoding, how fast results are packaged and encoded to lines (or binary
+records), how fast they decode back, the encoded size and the memory
+held by N packaged results. Every compact record is checked to encode to
+exactly the bytes of the dict path and to round-trip to equal models:
+
+    python3 -m benchmarks.serialization --results 100000
+"""
+import argparse
+import gc
+import io
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from benchmarks.run_benchmark import RESULTS_DIR, _git_commit
+from models.outputs import ChannelPreference, FinancialSituation, HyperpersonalizedMessage, LifeMoment, NextBestAction
+from models.records import CustomerResult, read_binary, write_binary
+
+WORDS = (
+    "savings goal budget mortgage retirement college rent salary bonus travel family home car loan card "
+    "credit insurance invest fund emergency plan monthly weekly review offer rate account transfer"
+).split()
+
+Outputs = Tuple[str, FinancialSituation, LifeMoment, ChannelPreference, NextBestAction, HyperpersonalizedMessage]
+
+
+def _choice(rng: random.Random, model: type, field: str) -> str:
+    return rng.choice(model.model_fields[field].annotation.__args__)
+
+
+def synthetic_outputs(count: int, seed: int = 7) -> List[Outputs]:
+    """Validated output models of `count` customers with realistic text lengths"""
+    rng = random.Random(seed)
+
+    def text(words: int) -> str:
+        return " ".join(rng.choices(WORDS, k=words))
+
+    def texts() -> List[str]:
+        return [text(4) for _ in range(rng.randint(0, 4))]
+
+    outputs = []
+    for i in range(count):
+        outputs.append((
+            f"CUST_{i:07d}",
+            FinancialSituation(
+                overall_health=_choice(rng, FinancialSituation, "overall_health"),
+                spending_pattern=text(20), savings_rate=rng.random(), risk_indicators=texts(), opportunities=texts(),
+            ),
+            LifeMoment(
+                detected_moments=texts(), confidence_score=rng.random(),
+                time_sensitivity=_choice(rng, LifeMoment, "time_sensitivity"), relevant_needs=texts(),
+            ),
+            ChannelPreference(
+                primary_channel=_choice(rng, ChannelPreference, "primary_channel"), secondary_channels=texts(),
+                best_contact_time=text(2), engagement_likelihood=rng.random(),
+                personalization_level=_choice(rng, ChannelPreference, "personalization_level"),
+            ),
+            NextBestAction(
+                action_type=_choice(rng, NextBestAction, "action_type"), specific_recommendation=text(12),
+                priority=_choice(rng, NextBestAction, "priority"), expected_value=rng.uniform(0, 5000),
+                rationale=text(30),
+            ),
+            HyperpersonalizedMessage(
+                message_subject=text(8), message_body=text(120), call_to_action=text(6),
+                tone=_choice(rng, HyperpersonalizedMessage, "tone"), personalization_elements=texts(),
+                recommended_channel=_choice(rng, ChannelPreference, "primary_channel"), optimal_send_time=text(3),
+                expected_engagement_rate=rng.random(),
+            ),
+        ))
+    return outputs
+
+
+def package_dict(outputs: Outputs) -> dict:
+    """The result dict as main.synthesize_and_package builds it"""
+    customer_id, financial, life_moment, channel, action, message = outputs
+    return {
+        "customer_id": customer_id,
+        "analysis": {
+            "financial_situation": financial.model_dump(),
+            "life_moment": life_moment.model_dump(),
+            "channel_preference": channel.model_dump(),
+            "next_best_action": action.model_dump(),
+        },
+        "personalized_message": message.model_dump(),
+        "degraded": [],
+        "message_source": "synthesis",
+    }
+
+
+def package_compact(outputs: Outputs) -> CustomerResult:
+    return CustomerResult.from_models(*outputs)
+
+
+def _timed(call: Callable[[], object]) -> Tuple[object, float]:
+    """Run `call` with the garbage collector paused, as timeit does"""
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        value = call()
+        return value, time.perf_counter() - started
+    finally:
+        gc.enable()
+
+
+def _retained_bytes(build: Callable[[], list]) -> int:
+    """Memory still allocated by the list `build` returns"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del kept
+    return retained
+
+
+def run(outputs: List[Outputs]) -> dict:
+    count = len(outputs)
+
+    dicts, dict_package_s = _timed(lambda: [package_dict(o) for o in outputs])
+    dict_lines, dict_encode_s = _timed(lambda: [json.dumps(d, default=str) for d in dicts])
+    _, dict_decode_s = _timed(lambda: [json.loads(line) for line in dict_lines])
+
+    records, compact_package_s = _timed(lambda: [package_compact(o) for o in outputs])
+    lines, json_encode_s = _timed(lambda: [r.to_json() for r in records])
+    decoded, json_decode_s = _timed(lambda: [CustomerResult.from_dict(json.loads(line)) for line in lines])
+
+    binary = io.BytesIO()
+    _, binary_encode_s = _timed(lambda: write_binary(binary, records))
+    binary.seek(0)
+    from_binary, binary_decode_s = _timed(lambda: list(read_binary(binary)))
+
+    # Losslessness: identical JSON to the dict path, equal models after both round trips
+    mismatched_json = sum(a != b for a, b in zip(lines, dict_lines))
+    mismatched_models = sum(
+        tuple(o[1:]) != r.to_models() or tuple(o[1:]) != b.to_models()
+        for o, r, b in zip(outputs, decoded, from_binary)
+    )
+
+    def rate(seconds: float) -> float:
+        return count / seconds if seconds > 0 else 0.0
+
+    dict_write_s = dict_package_s + dict_encode_s
+    json_write_s = compact_package_s + json_encode_s
+    binary_write_s = compact_package_s + binary_encode_s
+    return {
+        "results": count,
+        "lossless": mismatched_json == 0 and mismatched_models == 0,
+        "mismatched_json": mismatched_json,
+        "mismatched_models": mismatched_models,
+        "dict_jsonl": {
+            "package_per_s": rate(dict_package_s), "write_per_s": rate(dict_write_s), "read_per_s": rate(dict_decode_s),
+            "bytes": sum(len(line) + 1 for line in dict_lines),
+            "retained_bytes": _retained_bytes(lambda: [package_dict(o) for o in outputs]),
+        },
+        "compact_jsonl": {
+            "package_per_s": rate(compact_package_s), "write_per_s": rate(json_write_s), "read_per_s": rate(json_decode_s),
+            "bytes": sum(len(line) + 1 for line in lines),
+            "retained_bytes": _retained_bytes(lambda: [package_compact(o) for o in outputs]),
+            "write_speedup": dict_write_s / json_write_s if json_write_s else None,
+        },
+        "compact_binary": {
+            "write_per_s": rate(binary_write_s), "read_per_s": rate(binary_decode_s),
+            "bytes": binary.getbuffer().nbytes,
+            "write_speedup": dict_write_s / binary_write_s if binary_write_s else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dict vs compact result serialization")
+    parser.add_argument("--results", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None,
+                        help="Results file (default: benchmarks/results/serialization-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    print(f"Generating {args.results} synthetic results...")
+    report = run(synthetic_outputs(args.results, args.seed))
+
+    print(f"Lossless: {report['lossless']} "
+          f"({report['mismatched_json']} JSON and {report['mismatched_models']} model mismatches)")
+    for name in ("dict_jsonl", "compact_jsonl", "compact_binary"):
+        r = report[name]
+        line = f"{name:>15}: write {r['write_per_s']:>9,.0f}/s  read {r['read_per_s']:>9,.0f}/s  {r['bytes'] / 1e6:7.1f} MB"
+        if "retained_bytes" in r:
+            line += f"  held in memory {r['retained_bytes'] / 1e6:7.1f} MB"
+        if r.get("write_speedup"):
+            line += f"  write x{r['write_speedup']:.2f}"
+        print(line)
+
+    commit = _git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIR / f"serialization-{commit or 'nocommit'}-{int(time.time())}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"commit": commit, "config": vars(args), **report}, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import random
+import re
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+# Matches the customer headers used in packed prompts (see agents.packed)
+CUSTOMER_HEADER = re.compile(r"### Customer (\S+)\n")
+
+
+@dataclass
+class LatencyProfile:
+    """Simulated model behaviour: log-normal latency plus injected failures"""
+    median_seconds: float = 0.8
+    sigma: float = 0.35  # spread of the log-normal; larger means a heavier tail
+    error_rate: float = 0.0  # fraction of requests failing with HTTP 500
+    rate_limit_rate: float = 0.0  # fraction of requests failing with HTTP 429
+    malformed_rate: float = 0.0  # fraction of structured responses with one near-miss value (see SchemaSampler)
+    first_token_fraction: float = 0.3  # share of a streamed response's latency before its first chunk
+    stream_chunk_chars: int = 24
+    seed: Optional[int] = None
+
+
+class SimulatedModel(FunctionModel):
+    """
+    Offline stand-in for Gemini. Each request sleeps for a latency drawn from
+    the profile, may fail with an injected 500 or 429, and otherwise answers
+    with a value generated from the agent's output schema, so every output
+    model (including packed lists keyed by customer_id) validates, apart
+    from the near misses injected at `malformed_rate`. Streamed runs receive
+    native (JSON text) output in chunks spread over the latency.
+    """
+
+    def __init__(self, profile: Optional[LatencyProfile] = None):
+        self.latency = profile or LatencyProfile()
+        self.rng = random.Random(self.latency.seed)
+        self.requests = 0
+        super().__init__(self._respond, stream_function=self._stream, model_name="simulated")
+
+    def _draw_latency(self) -> float:
+        """Count the request, draw its latency and raise any injected failure"""
+        self.requests += 1
+        latency = self.rng.lognormvariate(0, self.latency.sigma) * self.latency.median_seconds
+        roll = self.rng.random()
+        if roll < self.latency.rate_limit_rate:
+            raise ModelHTTPError(429, self.model_name, {"error": "simulated rate limit"})
+        if roll < self.latency.rate_limit_rate + self.latency.error_rate:
+            raise ModelHTTPError(500, self.model_name, {"error": "simulated server error"})
+        return latency
+
+    async def _respond(self, messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        latency = self._draw_latency()
+        await asyncio.sleep(latency)
+
+        output_object = info.model_request_parameters.output_object
+        if output_object is not None:
+            return ModelResponse(parts=[TextPart(self._sample_json(output_object.json_schema, messages))])
+        if not info.output_tools:
+            return ModelResponse(parts=[TextPart("Simulated response")])
+        tool = info.output_tools[0]
+        args = self._sampler(tool.parameters_json_schema, messages).sample(tool.parameters_json_schema)
+        return ModelResponse(parts=[ToolCallPart(tool.name, args)])
+
+    async def _stream(self, messages: List[ModelMessage], info: AgentInfo) -> AsyncIterator[str]:
+        latency = self._draw_latency()
+        output_object = info.model_request_parameters.output_object
+        text = self._sample_json(output_object.json_schema, messages) if output_object else "Simulated response"
+        await asyncio.sleep(latency * self.latency.first_token_fraction)
+        size = self.latency.stream_chunk_chars
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        pause = latency * (1 - self.latency.first_token_fraction) / len(chunks)
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(pause)
+
+    def _sampler(self, schema: Dict[str, Any], messages: List[ModelMessage]) -> "SchemaSampler":
+        rate = self.latency.malformed_rate
+        near_misses = 1 if rate and self.rng.random() < rate else 0
+        return SchemaSampler(
+            self.rng, schema.get("$defs", {}), CUSTOMER_HEADER.findall(_prompt_text(messages)), near_misses
+        )
+
+    def _sample_json(self, schema: Dict[str, Any], messages: List[ModelMessage]) -> str:
+        return json.dumps(self._sampler(schema, messages).sample(schema))
+
+
+def _prompt_text(messages: List[ModelMessage]) -> str:
+    return "\n".join(
+        part.content for message in messages for part in message.parts if isinstance(getattr(part, "content", None), str)
+    )
+
+
+class SchemaSampler:
+    """
+    Generates random values that satisfy a (pydantic-generated) JSON schema.
+    The first `near_misses` objects get one value the way models typically
+    get it wrong: a literal in title case, a number past its maximum or a
+    list sent as a single string.
+    """
+
+    def __init__(self, rng: random.Random, defs: Dict[str, Any], customer_ids: List[str], near_misses: int = 0):
+        self.rng = rng
+        self.defs = defs
+        self.customer_ids = customer_ids
+        self.near_misses = near_misses
+
+    def sample(self, schema: Dict[str, Any]) -> Any:
+        if "$ref" in schema:
+            return self.sample(self.defs[schema["$ref"].split("/")[-1]])
+        if "anyOf" in schema:
+            return self.sample(next((s for s in schema["anyOf"] if s.get("type") != "null"), schema["anyOf"][0]))
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        if "const" in schema:
+            return schema["const"]
+
+        kind = schema.get("type")
+        if kind == "object":
+            value = {name: self.sample(prop) for name, prop in schema.get("properties", {}).items()}
+            if self.near_misses:
+                self._near_miss(value, schema.get("properties", {}))
+            return value
+        if kind == "array":
+            items = schema.get("items", {})
+            if self.customer_ids and "customer_id" in self._properties(items):
+                # Packed output: one entry per customer in the prompt
+                return [dict(self.sample(items), customer_id=customer_id) for customer_id in self.customer_ids]
+            return [self.sample(items) for _ in range(self.rng.randint(1, 3))]
+        if kind == "number":
+            return round(self.rng.uniform(schema.get("minimum", 0.0), schema.get("maximum", 1.0)), 3)
+        if kind == "integer":
+            return self.rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+        if kind == "boolean":
+            return self.rng.random() < 0.5
+        return self.rng.choice(["simulated insight", "simulated recommendation", "simulated detail"])
+
+    def _near_miss(self, value: Dict[str, Any], properties: Dict[str, Any]) -> None:
+        candidates = [
+            name for name, prop in properties.items()
+            if "enum" in prop or "maximum" in prop or prop.get("items", {}).get("type") == "string"
+        ]
+        if not candidates:
+            return
+        name = self.rng.choice(candidates)
+        prop = properties[name]
+        if "enum" in prop:
+            value[name] = value[name].replace("_", " ").title()
+        elif "maximum" in prop:
+            value[name] = prop["maximum"] + 0.25
+        else:
+            value[name] = "; ".join(value[name])
+        self.near_misses -= 1
+
+    def _properties(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        if "$ref" in schema:
+            schema = self.defs[schema["$ref"].split("/")[-1]]
+        return schema.get("properties", {})
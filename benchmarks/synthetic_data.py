@@ -0,0 +1,45 @@
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from models.customer import CustomerProfile, Transaction
+
+CATEGORIES = ["rent", "groceries", "dining", "travel", "medical", "baby_supplies", "education", "utilities", "shopping"]
+CONTACT_TIMES = ["morning", "afternoon", "evening", "weekend"]
+
+
+def generate_customers(count: int, seed: int = 7, transactions_per_customer: int = 20,
+                       as_of: Optional[datetime] = None) -> Iterator[CustomerProfile]:
+    """Deterministic synthetic customer profiles for benchmarks"""
+    rng = random.Random(seed)
+    now = as_of or datetime(2025, 1, 1)
+    for i in range(count):
+        income = rng.uniform(25_000, 250_000)
+        yield CustomerProfile(
+            customer_id=f"CUST_{i:07d}",
+            customer_name=f"Customer {i}",
+            age=rng.randint(18, 85),
+            income=income,
+            account_balance=rng.uniform(0, income / 2),
+            credit_score=rng.choice([None, rng.randint(300, 850)]),
+            recent_transactions=[
+                Transaction(
+                    amount=round(rng.uniform(5, 2500), 2),
+                    category=rng.choice(CATEGORIES),
+                    date=now - timedelta(days=rng.uniform(0, 90)),
+                    merchant=f"Merchant {rng.randint(1, 500)}",
+                )
+                for _ in range(rng.randint(0, transactions_per_customer))
+            ],
+            location=rng.choice(["San Francisco, CA", "Austin, TX", "New York, NY", "Chicago, IL"]),
+            marital_status=rng.choice([None, "single", "married", "divorced"]),
+            employment_status=rng.choice([None, "employed", "self-employed", "retired"]),
+            has_children=rng.random() < 0.4,
+            preferred_contact_times=rng.sample(CONTACT_TIMES, rng.randint(0, 2)),
+            digital_engagement={
+                "mobile_app_sessions_per_week": rng.randint(0, 25),
+                "email_open_rate": round(rng.random(), 2),
+                "push_notification_enabled": rng.random() < 0.6,
+            },
+            account_data={"debts": [round(rng.uniform(50, 1500), 2) for _ in range(rng.randint(0, 3))]},
+        )
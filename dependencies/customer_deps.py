@@ -1,10 +1,24 @@
 from dataclasses import dataclass
+from typing import Optional
 from models.customer import CustomerProfile
+from models.transaction_store import TransactionSlice
+from pipeline.features import CustomerFeatures, compute_features
 
 @dataclass
 class CustomerDependencies:
     """Dependencies passed to all agents"""
     customer_profile: CustomerProfile
+    # Precomputed by the batch runner; computed on first use otherwise
+    features: Optional[CustomerFeatures] = None
+    # Columnar history from a TransactionStore; replaces customer_profile.recent_transactions
+    transactions: Optional[TransactionSlice] = None
     # Add additional dependencies as needed
     # db_connection: Optional[Any] = None
     # api_client: Optional[Any] = None
+
+    def get_features(self) -> CustomerFeatures:
+        """Return the customer's features, computing them if they were not precomputed"""
+        if self.features is None:
+            transactions = None if self.transactions is None else [self.transactions]
+            self.features = compute_features([self.customer_profile], transactions=transactions)[0]
+        return self.features
@@ -0,0 +1,95 @@
+import importlib.util
+import os
+import warnings
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    # Imported on first use: httpx, pydantic-ai and the Gemini SDK dominate startup time
+    import httpx
+    from pydantic_ai.models import Model
+
+
+@dataclass
+class ModelProviderConfig:
+    """Model and HTTP connection pool shared by every agent"""
+    model_name: str = field(default_factory=lambda: os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite"))
+    # Point all agents at a local stand-in server instead of the Gemini API
+    base_url: Optional[str] = field(default_factory=lambda: os.getenv("GEMINI_BASE_URL"))
+    api_key: Optional[str] = None  # defaults to GOOGLE_API_KEY
+    max_connections: int = 200
+    max_keepalive_connections: int = 50
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+    timeout: float = 60.0
+
+
+_config = ModelProviderConfig()
+_http_client: Optional["httpx.AsyncClient"] = None
+_model: Optional["Model"] = None
+_override: Optional["Model"] = None
+
+
+def configure_model_provider(config: ModelProviderConfig) -> None:
+    """Set the provider configuration; takes effect on the next get_model() after a close"""
+    global _config
+    _config = config
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Shared pooled HTTP client, created on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        import httpx
+
+        http2 = _config.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            warnings.warn("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=_config.timeout,
+            limits=httpx.Limits(
+                max_connections=_config.max_connections,
+                max_keepalive_connections=_config.max_keepalive_connections,
+                keepalive_expiry=_config.keepalive_expiry,
+            ),
+        )
+    return _http_client
+
+
+def get_model() -> "Model":
+    """The model every agent runs with: the active override, else the shared Gemini model"""
+    global _model
+    if _override is not None:
+        return _override
+    if _model is None:
+        from pydantic_ai.models.google import GoogleModel
+        from pydantic_ai.providers.google import GoogleProvider
+
+        provider_kwargs = {"api_key": _config.api_key, "http_client": get_http_client()}
+        if _config.base_url:
+            provider_kwargs["base_url"] = _config.base_url
+        _model = GoogleModel(_config.model_name, provider=GoogleProvider(**provider_kwargs))
+    return _model
+
+
+@contextmanager
+def override_model(model: "Model") -> Iterator["Model"]:
+    """Run all agents with `model` (e.g. a pydantic-ai FunctionModel or TestModel) inside the block"""
+    global _override
+    previous, _override = _override, model
+    try:
+        yield model
+    finally:
+        _override = previous
+
+
+async def close_model_provider() -> None:
+    """Close pooled connections; the next get_model() starts a fresh client"""
+    global _http_client, _model
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _model = None
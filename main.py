@@ -1,76 +1,242 @@
 import asyncio
-import logfire
 from datetime import datetime, timedelta
-from typing import Optional
+from dataclasses import asdict
+from typing import Callable, List, Optional, Sequence, Tuple, Union
 from dotenv import load_dotenv
 
-logfire.configure()  
-logfire.instrument_pydantic_ai()
+from agents.tracing import span, trace_customer
 
 # Load environment variables
 load_dotenv()
 
 from models.customer import CustomerProfile, Transaction
 from dependencies.customer_deps import CustomerDependencies
-from agents.financial_analyzer import analyze_financial_situation
-from agents.life_moment_identifier import identify_life_moment
-from agents.channel_analyzer import analyze_channel_preference
-from agents.next_best_action import recommend_next_action
-from agents.synthesis_agent import synthesize_message
+from models.outputs import ChannelPreference, FinancialSituation, LifeMoment, NextBestAction
+from models.records import CustomerResult
+from pipeline.features import CustomerFeatures, compute_features
+from pipeline.result_store import CustomerCheckpoint
+from dependencies.model_provider import close_model_provider
+from agents.financial_analyzer import analyze_financial_situation, default_financial_situation
+from agents.life_moment_identifier import identify_life_moment, default_life_moment
+from agents.channel_analyzer import analyze_channel_preference, default_channel_preference
+from agents.next_best_action import recommend_next_action, default_next_best_action
+from agents.synthesis_agent import (
+    STREAM_FIELD_ORDER, SynthesisTiming, SynthesisUpdate, stream_synthesis, synthesize_message
+)
+from agents.packed import PackedAnalyzer
+from agents.usage import customer_scope
+from agents.fused_analyzer import analyze_customer_fused, default_fused_analysis
+from agents.deadlines import run_within_deadline
+from agents.message_templates import get_message_templates
 
-async def process_customer_for_personalization(customer_profile: CustomerProfile) -> dict:
+# Analyses run per customer: result name, agent call and the deterministic
+# fallback used when the call misses its deadline (see agents.deadlines)
+ANALYSES = [
+    ("financial_situation", analyze_financial_situation, default_financial_situation),
+    ("life_moment", identify_life_moment, default_life_moment),
+    ("channel_preference", analyze_channel_preference, default_channel_preference),
+    ("next_best_action", recommend_next_action, default_next_best_action),
+]
+
+async def process_customer_for_personalization(
+    customer_profile: CustomerProfile,
+    verbose: bool = True,
+    features: Optional[CustomerFeatures] = None,
+    fused: bool = False,
+    on_synthesis_update: Optional[Callable[[CustomerProfile, SynthesisUpdate], None]] = None,
+    checkpoint: Optional[CustomerCheckpoint] = None,
+    compact: bool = False
+) -> Union[dict, CustomerResult]:
     """
     Main orchestration function that runs all agents in parallel
     and synthesizes the results into a hyperpersonalized message.
+    Set verbose=False to silence progress output (e.g. in batch runs) and
+    pass features precomputed for a whole batch to skip computing them here.
+    With fused=True the four analyses come from a single request instead.
+    With on_synthesis_update the message is streamed (see synthesize_and_package).
+    With a checkpoint (see pipeline.result_store), stages stored by an earlier
+    run are reused and newly completed stages are saved. With compact=True
+    the result is a CustomerResult instead of a dict (see models.records).
     """
     
-    print(f"Processing customer: {customer_profile.customer_id}")
-    print("=" * 60)
+    if verbose:
+        print(f"Processing customer: {customer_profile.customer_id}")
+        print("=" * 60)
     
-    # Create dependencies
-    deps = CustomerDependencies(customer_profile=customer_profile)
+    # Stages are timed per customer when a tracer is configured (see agents.tracing)
+    with trace_customer(customer_profile.customer_id):
+        # Create dependencies
+        deps = CustomerDependencies(customer_profile=customer_profile, features=features)
     
-    # Step 1: Run parallel agent execution for data gathering
-    print("\n🔄 Running parallel analysis agents...")
+        # Step 1: Run parallel agent execution for data gathering
+        if verbose:
+            print("\n🔄 Running fused analysis..." if fused else "\n🔄 Running parallel analysis agents...")
     
-    # Create tasks for concurrent execution
-    tasks = [
-        asyncio.create_task(analyze_financial_situation(deps)),
-        asyncio.create_task(identify_life_moment(deps)),
-        asyncio.create_task(analyze_channel_preference(deps)),
-        asyncio.create_task(recommend_next_action(deps))
-    ]
+        # Token usage of the analyses is attributed to this customer
+        with customer_scope(customer_profile.customer_id), span("analysis"):
+            if fused:
+                outputs, degraded = await run_fused_analysis(deps, checkpoint)
+            else:
+                outputs, degraded = await run_parallel_analyses(deps, checkpoint)
     
-    # Execute all agents in parallel using asyncio.gather
-    results = await asyncio.gather(*tasks)
+        financial_situation, life_moment, channel_preference, next_best_action = outputs
     
-    # Unpack results
-    financial_situation, life_moment, channel_preference, next_best_action = results
+        if verbose:
+            print("✅ Analysis complete!")
+        
+            # Display intermediate results
+            print("\n📊 Analysis Results:")
+            print(f"  Financial Health: {financial_situation.overall_health}")
+            print(f"  Life Moments: {', '.join(life_moment.detected_moments) or 'None detected'}")
+            print(f"  Best Channel: {channel_preference.primary_channel}")
+            print(f"  Recommendation: {next_best_action.specific_recommendation}")
+            if degraded:
+                print(f"  ⚠️  Fallbacks used (deadline missed): {', '.join(degraded)}")
+        
+            # Step 2: Synthesize insights into personalized message
+            print("\n✍️  Generating hyperpersonalized message...")
     
-    print("✅ Parallel analysis complete!")
+        result = await synthesize_and_package(
+            customer_profile, financial_situation, life_moment, channel_preference, next_best_action, degraded,
+            on_synthesis_update, checkpoint, compact
+        )
     
-    # Display intermediate results
-    print("\n📊 Analysis Results:")
-    print(f"  Financial Health: {financial_situation.overall_health}")
-    print(f"  Life Moments: {', '.join(life_moment.detected_moments) or 'None detected'}")
-    print(f"  Best Channel: {channel_preference.primary_channel}")
-    print(f"  Recommendation: {next_best_action.specific_recommendation}")
+    if verbose:
+        print("✅ Message generation complete!")
     
-    # Step 2: Synthesize insights into personalized message
-    print("\n✍️  Generating hyperpersonalized message...")
+    return result
+
+async def run_parallel_analyses(
+    deps: CustomerDependencies,
+    checkpoint: Optional[CustomerCheckpoint] = None
+) -> Tuple[list, List[str]]:
+    """
+    Run the four analysis agents concurrently; returns their outputs (in
+    ANALYSES order) and the names of analyses that fell back. With a deadline
+    policy configured, a slow agent is hedged and, past its deadline,
+    replaced by its fallback so one stuck call cannot stall the customer.
+    Analyses stored in `checkpoint` are reused instead of run.
+    """
+    def analysis(name, analyze, fallback):
+        async def run():
+            with span(name):
+                return await run_within_deadline(name, lambda: analyze(deps), lambda: fallback(deps))
+        return run() if checkpoint is None else checkpoint.run(name, run)
+    
+    tasks = [asyncio.create_task(analysis(name, analyze, fallback)) for name, analyze, fallback in ANALYSES]
     
-    personalized_message = await synthesize_message(
+    # Execute all agents in parallel using asyncio.gather
+    results = await asyncio.gather(*tasks)
+    
+    outputs = [output for output, _ in results]
+    degraded = [name for (name, _, _), (_, is_degraded) in zip(ANALYSES, results) if is_degraded]
+    return outputs, degraded
+
+async def run_fused_analysis(
+    deps: CustomerDependencies,
+    checkpoint: Optional[CustomerCheckpoint] = None
+) -> Tuple[list, List[str]]:
+    """
+    Fused counterpart of run_parallel_analyses: all four outputs from one
+    request, which is skipped only if `checkpoint` holds all four
+    """
+    if checkpoint is not None:
+        stored = [checkpoint.get(name) for name, _, _ in ANALYSES]
+        if all(output is not None for output in stored):
+            return stored, []
+    with span("fused"):
+        analysis, is_degraded = await run_within_deadline(
+            "fused",
+            lambda: analyze_customer_fused(deps),
+            lambda: default_fused_analysis(deps)
+        )
+    outputs = [getattr(analysis, name) for name, _, _ in ANALYSES]
+    if checkpoint is not None and not is_degraded:
+        for (name, _, _), output in zip(ANALYSES, outputs):
+            checkpoint.save(name, output)
+    return outputs, [name for name, _, _ in ANALYSES] if is_degraded else []
+
+async def synthesize_and_package(
+    customer_profile: CustomerProfile,
+    financial_situation: FinancialSituation,
+    life_moment: LifeMoment,
+    channel_preference: ChannelPreference,
+    next_best_action: NextBestAction,
+    degraded: Sequence[str] = (),
+    on_synthesis_update: Optional[Callable[[CustomerProfile, SynthesisUpdate], None]] = None,
+    checkpoint: Optional[CustomerCheckpoint] = None,
+    compact: bool = False
+) -> Union[dict, CustomerResult]:
+    """
+    Synthesize the analysis outputs into a message and package the customer result.
+    `degraded` names the analyses that are deterministic fallbacks. With
+    `on_synthesis_update`, the message is streamed: the callback receives each
+    update as fields complete (channel and subject first), and the result
+    carries time-to-field metrics under "synthesis_timing". With a segment
+    template library configured (see agents.message_templates), customers of
+    a known segment get its template filled in locally instead of a synthesis
+    request; their result has "message_source": "template". A message
+    stored in `checkpoint` is reused ("message_source": "checkpoint"); one
+    built on degraded analyses is not saved.
+    With compact=True the result is packaged as a CustomerResult, which
+    skips the model_dump() dicts and serializes to the same JSON.
+    """
+    insights = dict(
         financial=financial_situation,
         life_moment=life_moment,
         channel=channel_preference,
         action=next_best_action,
         customer_name=f"Customer {customer_profile.customer_name}"
     )
+    timing = None
+    templates = get_message_templates()
+    with customer_scope(customer_profile.customer_id), span("synthesis"):
+        personalized_message, source = None, "synthesis"
+        stored = checkpoint.get("personalized_message") if checkpoint is not None else None
+        if stored is not None:
+            personalized_message, source = stored, "checkpoint"
+        elif templates is not None:
+            personalized_message = await templates.personalize(
+                customer_profile, financial_situation, life_moment, channel_preference, next_best_action
+            )
+            if personalized_message is not None:
+                source = "template"
+        if personalized_message is not None:
+            if on_synthesis_update is not None:
+                # A stored or template message is complete at once: deliver it as the only update
+                timing = SynthesisTiming()
+                update = SynthesisUpdate(
+                    personalized_message.model_dump(), list(STREAM_FIELD_ORDER), 0.0, personalized_message
+                )
+                timing.observe(update)
+                on_synthesis_update(customer_profile, update)
+        elif on_synthesis_update is None:
+            personalized_message = await synthesize_message(**insights)
+        else:
+            timing = SynthesisTiming()
+            async for update in stream_synthesis(**insights):
+                timing.observe(update)
+                on_synthesis_update(customer_profile, update)
+                personalized_message = update.message
+    if checkpoint is not None and source != "checkpoint" and not degraded:
+        # A message written from fallback analyses is rewritten once a rerun has the real ones
+        checkpoint.save("personalized_message", personalized_message)
     
-    print("✅ Message generation complete!")
+    if compact:
+        return CustomerResult.from_models(
+            customer_profile.customer_id,
+            financial_situation,
+            life_moment,
+            channel_preference,
+            next_best_action,
+            personalized_message,
+            degraded,
+            source,
+            {"synthesis_timing": asdict(timing)} if timing is not None else None
+        )
     
     # Return comprehensive results
-    return {
+    result = {
         "customer_id": customer_profile.customer_id,
         "analysis": {
             "financial_situation": financial_situation.model_dump(),
@@ -78,8 +244,46 @@ async def process_customer_for_personalization(customer_profile: CustomerProfile
             "channel_preference": channel_preference.model_dump(),
             "next_best_action": next_best_action.model_dump()
         },
-        "personalized_message": personalized_message.model_dump()
+        "personalized_message": personalized_message.model_dump(),
+        "degraded": list(degraded),
+        "message_source": source
     }
+    if timing is not None:
+        result["synthesis_timing"] = asdict(timing)
+    return result
+
+async def process_customers_packed(
+    customer_profiles: List[CustomerProfile],
+    analyzer: PackedAnalyzer,
+    features: Optional[List[CustomerFeatures]] = None,
+    compact: bool = False
+) -> List[Union[dict, CustomerResult, BaseException]]:
+    """
+    Packed variant of process_customer_for_personalization for many customers:
+    each analysis agent sees chunks of customers in a single request, then
+    every customer is synthesized individually. Results are aligned with
+    `customer_profiles`; a customer whose analysis or synthesis failed gets
+    its exception, without affecting the others.
+    """
+    features = features or compute_features(customer_profiles)
+    deps_list = [
+        CustomerDependencies(customer_profile=profile, features=customer_features)
+        for profile, customer_features in zip(customer_profiles, features)
+    ]
+    
+    analyses = await analyzer.analyze(deps_list)
+
+    async def package(i: int, profile: CustomerProfile) -> Union[dict, CustomerResult]:
+        outputs = [analyses[name][i] for name, _, _ in ANALYSES]
+        for output in outputs:
+            if isinstance(output, BaseException):
+                raise output
+        return await synthesize_and_package(profile, *outputs, compact=compact)
+
+    return await asyncio.gather(
+        *(package(i, profile) for i, profile in enumerate(customer_profiles)),
+        return_exceptions=True
+    )
 
 async def main():
     """Main entry point with sample customer data"""
@@ -128,7 +332,10 @@ async def main():
     )
     
     # Process customer
-    result = await process_customer_for_personalization(customer)
+    try:
+        result = await process_customer_for_personalization(customer)
+    finally:
+        await close_model_provider()
     
     # Display final message
     print("\n" + "=" * 60)
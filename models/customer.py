@@ -25,3 +25,9 @@ class CustomerProfile(BaseModel):
     preferred_contact_times: List[str] = []
     digital_engagement: dict = {}  # app usage, email opens, etc.
     account_data: dict = {}  # income, debts, credit score, etc.
+
+class CustomerEvent(BaseModel):
+    """A change to a customer's profile, e.g. a new transaction or updated engagement data"""
+    customer_id: str
+    new_transactions: List[Transaction] = []
+    changes: dict = {}  # CustomerProfile fields to overwrite, e.g. {"digital_engagement": {...}}
@@ -42,3 +42,10 @@ class HyperpersonalizedMessage(BaseModel):
     recommended_channel: str
     optimal_send_time: str
     expected_engagement_rate: float
+
+class FusedAnalysis(BaseModel):
+    """All four analyses produced by a single request (fused mode)"""
+    financial_situation: FinancialSituation
+    life_moment: LifeMoment
+    channel_preference: ChannelPreference
+    next_best_action: NextBestAction
@@ -0,0 +1,679 @@
+import json
+import struct
+from math import isfinite
+from enum import IntEnum
+from json.encoder import encode_basestring_ascii as _str
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+from models.outputs import (
+    ChannelPreference,
+    FinancialSituation,
+    HyperpersonalizedMessage,
+    LifeMoment,
+    NextBestAction,
+)
+
+# Enum codes are part of the binary format: append new members, never renumber
+
+
+class Health(IntEnum):
+    EXCELLENT = 0
+    GOOD = 1
+    FAIR = 2
+    POOR = 3
+
+
+class TimeSensitivity(IntEnum):
+    IMMEDIATE = 0
+    NEAR_TERM = 1
+    MEDIUM_TERM = 2
+    LONG_TERM = 3
+
+
+class Channel(IntEnum):
+    EMAIL = 0
+    SMS = 1
+    PUSH_NOTIFICATION = 2
+    PHONE = 3
+    IN_APP = 4
+
+
+class Level(IntEnum):
+    HIGH = 0
+    MEDIUM = 1
+    LOW = 2
+
+
+class ActionType(IntEnum):
+    PRODUCT_OFFER = 0
+    SERVICE_UPGRADE = 1
+    FINANCIAL_ADVICE = 2
+    ENGAGEMENT = 3
+
+
+class Tone(IntEnum):
+    PROFESSIONAL = 0
+    FRIENDLY = 1
+    URGENT = 2
+    EDUCATIONAL = 3
+
+
+class _Codec:
+    """Maps the values of a Literal field to enum members and back"""
+
+    def __init__(self, enum: Type[IntEnum], model: type, field: str):
+        values = model.model_fields[field].annotation.__args__
+        self.by_code = tuple(sorted(enum))
+        self.member = {value: enum[value.upper().replace("-", "_")] for value in values}
+        self.text = [""] * len(enum)
+        for value, member in self.member.items():
+            self.text[member] = value
+        if len(self.member) != len(enum):
+            raise TypeError(f"{enum.__name__} does not match {model.__name__}.{field}")
+
+
+_HEALTH = _Codec(Health, FinancialSituation, "overall_health")
+_SENSITIVITY = _Codec(TimeSensitivity, LifeMoment, "time_sensitivity")
+_CHANNEL = _Codec(Channel, ChannelPreference, "primary_channel")
+_PERSONALIZATION = _Codec(Level, ChannelPreference, "personalization_level")
+_ACTION = _Codec(ActionType, NextBestAction, "action_type")
+_PRIORITY = _Codec(Level, NextBestAction, "priority")
+_TONE = _Codec(Tone, HyperpersonalizedMessage, "tone")
+
+
+def _float(value: float) -> str:
+    """A float as json.dumps writes it"""
+    if isfinite(value):
+        return float.__repr__(value)
+    if value != value:
+        return "NaN"
+    return "Infinity" if value > 0 else "-Infinity"
+
+
+def _strs(values: Sequence[str]) -> str:
+    return "[" + ", ".join(map(_str, values)) + "]"
+
+
+class FinancialRecord:
+    __slots__ = ("overall_health", "spending_pattern", "savings_rate", "risk_indicators", "opportunities")
+
+    def __init__(
+        self,
+        overall_health: Health,
+        spending_pattern: str,
+        savings_rate: float,
+        risk_indicators: Tuple[str, ...],
+        opportunities: Tuple[str, ...],
+    ):
+        self.overall_health = overall_health
+        self.spending_pattern = spending_pattern
+        self.savings_rate = savings_rate
+        self.risk_indicators = risk_indicators
+        self.opportunities = opportunities
+
+    @classmethod
+    def from_model(cls, model: FinancialSituation) -> "FinancialRecord":
+        return cls(
+            _HEALTH.member[model.overall_health],
+            model.spending_pattern,
+            model.savings_rate,
+            tuple(model.risk_indicators),
+            tuple(model.opportunities),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FinancialRecord":
+        return cls(
+            _HEALTH.member[data["overall_health"]],
+            data["spending_pattern"],
+            float(data["savings_rate"]),
+            tuple(data["risk_indicators"]),
+            tuple(data["opportunities"]),
+        )
+
+    def to_model(self) -> FinancialSituation:
+        return FinancialSituation.model_construct(
+            overall_health=_HEALTH.text[self.overall_health],
+            spending_pattern=self.spending_pattern,
+            savings_rate=self.savings_rate,
+            risk_indicators=list(self.risk_indicators),
+            opportunities=list(self.opportunities),
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"overall_health": "{_HEALTH.text[self.overall_health]}", '
+            f'"spending_pattern": {_str(self.spending_pattern)}, '
+            f'"savings_rate": {_float(self.savings_rate)}, '
+            f'"risk_indicators": {_strs(self.risk_indicators)}, '
+            f'"opportunities": {_strs(self.opportunities)}}}'
+        )
+
+
+class LifeMomentRecord:
+    __slots__ = ("detected_moments", "confidence_score", "time_sensitivity", "relevant_needs")
+
+    def __init__(
+        self,
+        detected_moments: Tuple[str, ...],
+        confidence_score: float,
+        time_sensitivity: TimeSensitivity,
+        relevant_needs: Tuple[str, ...],
+    ):
+        self.detected_moments = detected_moments
+        self.confidence_score = confidence_score
+        self.time_sensitivity = time_sensitivity
+        self.relevant_needs = relevant_needs
+
+    @classmethod
+    def from_model(cls, model: LifeMoment) -> "LifeMomentRecord":
+        return cls(
+            tuple(model.detected_moments),
+            model.confidence_score,
+            _SENSITIVITY.member[model.time_sensitivity],
+            tuple(model.relevant_needs),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LifeMomentRecord":
+        return cls(
+            tuple(data["detected_moments"]),
+            float(data["confidence_score"]),
+            _SENSITIVITY.member[data["time_sensitivity"]],
+            tuple(data["relevant_needs"]),
+        )
+
+    def to_model(self) -> LifeMoment:
+        return LifeMoment.model_construct(
+            detected_moments=list(self.detected_moments),
+            confidence_score=self.confidence_score,
+            time_sensitivity=_SENSITIVITY.text[self.time_sensitivity],
+            relevant_needs=list(self.relevant_needs),
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"detected_moments": {_strs(self.detected_moments)}, '
+            f'"confidence_score": {_float(self.confidence_score)}, '
+            f'"time_sensitivity": "{_SENSITIVITY.text[self.time_sensitivity]}", '
+            f'"relevant_needs": {_strs(self.relevant_needs)}}}'
+        )
+
+
+class ChannelRecord:
+    __slots__ = (
+        "primary_channel", "secondary_channels", "best_contact_time", "engagement_likelihood", "personalization_level"
+    )
+
+    def __init__(
+        self,
+        primary_channel: Channel,
+        secondary_channels: Tuple[str, ...],
+        best_contact_time: str,
+        engagement_likelihood: float,
+        personalization_level: Level,
+    ):
+        self.primary_channel = primary_channel
+        self.secondary_channels = secondary_channels
+        self.best_contact_time = best_contact_time
+        self.engagement_likelihood = engagement_likelihood
+        self.personalization_level = personalization_level
+
+    @classmethod
+    def from_model(cls, model: ChannelPreference) -> "ChannelRecord":
+        return cls(
+            _CHANNEL.member[model.primary_channel],
+            tuple(model.secondary_channels),
+            model.best_contact_time,
+            model.engagement_likelihood,
+            _PERSONALIZATION.member[model.personalization_level],
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChannelRecord":
+        return cls(
+            _CHANNEL.member[data["primary_channel"]],
+            tuple(data["secondary_channels"]),
+            data["best_contact_time"],
+            float(data["engagement_likelihood"]),
+            _PERSONALIZATION.member[data["personalization_level"]],
+        )
+
+    def to_model(self) -> ChannelPreference:
+        return ChannelPreference.model_construct(
+            primary_channel=_CHANNEL.text[self.primary_channel],
+            secondary_channels=list(self.secondary_channels),
+            best_contact_time=self.best_contact_time,
+            engagement_likelihood=self.engagement_likelihood,
+            personalization_level=_PERSONALIZATION.text[self.personalization_level],
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"primary_channel": "{_CHANNEL.text[self.primary_channel]}", '
+            f'"secondary_channels": {_strs(self.secondary_channels)}, '
+            f'"best_contact_time": {_str(self.best_contact_time)}, '
+            f'"engagement_likelihood": {_float(self.engagement_likelihood)}, '
+            f'"personalization_level": "{_PERSONALIZATION.text[self.personalization_level]}"}}'
+        )
+
+
+class ActionRecord:
+    __slots__ = ("action_type", "specific_recommendation", "priority", "expected_value", "rationale")
+
+    def __init__(
+        self,
+        action_type: ActionType,
+        specific_recommendation: str,
+        priority: Level,
+        expected_value: float,
+        rationale: str,
+    ):
+        self.action_type = action_type
+        self.specific_recommendation = specific_recommendation
+        self.priority = priority
+        self.expected_value = expected_value
+        self.rationale = rationale
+
+    @classmethod
+    def from_model(cls, model: NextBestAction) -> "ActionRecord":
+        return cls(
+            _ACTION.member[model.action_type],
+            model.specific_recommendation,
+            _PRIORITY.member[model.priority],
+            model.expected_value,
+            model.rationale,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ActionRecord":
+        return cls(
+            _ACTION.member[data["action_type"]],
+            data["specific_recommendation"],
+            _PRIORITY.member[data["priority"]],
+            float(data["expected_value"]),
+            data["rationale"],
+        )
+
+    def to_model(self) -> NextBestAction:
+        return NextBestAction.model_construct(
+            action_type=_ACTION.text[self.action_type],
+            specific_recommendation=self.specific_recommendation,
+            priority=_PRIORITY.text[self.priority],
+            expected_value=self.expected_value,
+            rationale=self.rationale,
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"action_type": "{_ACTION.text[self.action_type]}", '
+            f'"specific_recommendation": {_str(self.specific_recommendation)}, '
+            f'"priority": "{_PRIORITY.text[self.priority]}", '
+            f'"expected_value": {_float(self.expected_value)}, '
+            f'"rationale": {_str(self.rationale)}}}'
+        )
+
+
+class MessageRecord:
+    __slots__ = (
+        "message_subject", "message_body", "call_to_action", "tone", "personalization_elements",
+        "recommended_channel", "optimal_send_time", "expected_engagement_rate",
+    )
+
+    def __init__(
+        self,
+        message_subject: str,
+        message_body: str,
+        call_to_action: str,
+        tone: Tone,
+        personalization_elements: Tuple[str, ...],
+        recommended_channel: str,
+        optimal_send_time: str,
+        expected_engagement_rate: float,
+    ):
+        self.message_subject = message_subject
+        self.message_body = message_body
+        self.call_to_action = call_to_action
+        self.tone = tone
+        self.personalization_elements = personalization_elements
+        self.recommended_channel = recommended_channel  # free text in HyperpersonalizedMessage, so not an enum
+        self.optimal_send_time = optimal_send_time
+        self.expected_engagement_rate = expected_engagement_rate
+
+    @classmethod
+    def from_model(cls, model: HyperpersonalizedMessage) -> "MessageRecord":
+        return cls(
+            model.message_subject,
+            model.message_body,
+            model.call_to_action,
+            _TONE.member[model.tone],
+            tuple(model.personalization_elements),
+            model.recommended_channel,
+            model.optimal_send_time,
+            model.expected_engagement_rate,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MessageRecord":
+        return cls(
+            data["message_subject"],
+            data["message_body"],
+            data["call_to_action"],
+            _TONE.member[data["tone"]],
+            tuple(data["personalization_elements"]),
+            data["recommended_channel"],
+            data["optimal_send_time"],
+            float(data["expected_engagement_rate"]),
+        )
+
+    def to_model(self) -> HyperpersonalizedMessage:
+        return HyperpersonalizedMessage.model_construct(
+            message_subject=self.message_subject,
+            message_body=self.message_body,
+            call_to_action=self.call_to_action,
+            tone=_TONE.text[self.tone],
+            personalization_elements=list(self.personalization_elements),
+            recommended_channel=self.recommended_channel,
+            optimal_send_time=self.optimal_send_time,
+            expected_engagement_rate=self.expected_engagement_rate,
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"message_subject": {_str(self.message_subject)}, '
+            f'"message_body": {_str(self.message_body)}, '
+            f'"call_to_action": {_str(self.call_to_action)}, '
+            f'"tone": "{_TONE.text[self.tone]}", '
+            f'"personalization_elements": {_strs(self.personalization_elements)}, '
+            f'"recommended_channel": {_str(self.recommended_channel)}, '
+            f'"optimal_send_time": {_str(self.optimal_send_time)}, '
+            f'"expected_engagement_rate": {_float(self.expected_engagement_rate)}}}'
+        )
+
+
+class CustomerResult:
+    """
+    One customer's personalization result: the compact counterpart of the
+    dict built by main.synthesize_and_package. Outputs are held in slot-backed
+    records with literal fields as small IntEnums and lists as tuples; they
+    convert losslessly to and from the pydantic models. to_json writes the
+    same line as json.dumps of the result dict without building the dict,
+    and to_bytes a binary encoding for bulk storage. Keys beyond the fixed
+    ones (e.g. "synthesis_timing") are kept in `extras`.
+    """
+    __slots__ = ("customer_id", "financial", "life_moment", "channel", "action", "message", "degraded",
+                 "message_source", "extras")
+
+    def __init__(
+        self,
+        customer_id: str,
+        financial: FinancialRecord,
+        life_moment: LifeMomentRecord,
+        channel: ChannelRecord,
+        action: ActionRecord,
+        message: MessageRecord,
+        degraded: Tuple[str, ...] = (),
+        message_source: str = "synthesis",
+        extras: Optional[Dict[str, Any]] = None,
+    ):
+        self.customer_id = customer_id
+        self.financial = financial
+        self.life_moment = life_moment
+        self.channel = channel
+        self.action = action
+        self.message = message
+        self.degraded = degraded
+        self.message_source = message_source
+        self.extras = extras
+
+    @classmethod
+    def from_models(
+        cls,
+        customer_id: str,
+        financial: FinancialSituation,
+        life_moment: LifeMoment,
+        channel: ChannelPreference,
+        action: NextBestAction,
+        message: HyperpersonalizedMessage,
+        degraded: Sequence[str] = (),
+        message_source: str = "synthesis",
+        extras: Optional[Dict[str, Any]] = None,
+    ) -> "CustomerResult":
+        return cls(
+            customer_id,
+            FinancialRecord.from_model(financial),
+            LifeMomentRecord.from_model(life_moment),
+            ChannelRecord.from_model(channel),
+            ActionRecord.from_model(action),
+            MessageRecord.from_model(message),
+            tuple(degraded),
+            message_source,
+            extras,
+        )
+
+    def to_models(self) -> Tuple[FinancialSituation, LifeMoment, ChannelPreference, NextBestAction, HyperpersonalizedMessage]:
+        return (
+            self.financial.to_model(),
+            self.life_moment.to_model(),
+            self.channel.to_model(),
+            self.action.to_model(),
+            self.message.to_model(),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CustomerResult":
+        """
+        Parse a result dict (e.g. a decoded JSONL line) as written by
+        synthesize_and_package; an unknown literal value raises KeyError
+        """
+        analysis = data["analysis"]
+        fixed = {"customer_id", "analysis", "personalized_message", "degraded", "message_source"}
+        extras = {key: value for key, value in data.items() if key not in fixed}
+        return cls(
+            data["customer_id"],
+            FinancialRecord.from_dict(analysis["financial_situation"]),
+            LifeMomentRecord.from_dict(analysis["life_moment"]),
+            ChannelRecord.from_dict(analysis["channel_preference"]),
+            ActionRecord.from_dict(analysis["next_best_action"]),
+            MessageRecord.from_dict(data["personalized_message"]),
+            tuple(data.get("degraded", ())),
+            data.get("message_source", "synthesis"),
+            extras or None,
+        )
+
+    def to_dict(self) -> dict:
+        financial, life_moment, channel, action, message = self.to_models()
+        return {
+            "customer_id": self.customer_id,
+            "analysis": {
+                "financial_situation": financial.model_dump(),
+                "life_moment": life_moment.model_dump(),
+                "channel_preference": channel.model_dump(),
+                "next_best_action": action.model_dump(),
+            },
+            "personalized_message": message.model_dump(),
+            "degraded": list(self.degraded),
+            "message_source": self.message_source,
+            **(self.extras or {}),
+        }
+
+    def to_json(self) -> str:
+        """The JSON line json.dumps(self.to_dict(), default=str) would write, built directly from the slots"""
+        extras = ""
+        if self.extras:
+            extras = "".join(
+                f", {_str(key)}: {json.dumps(value, default=str)}" for key, value in self.extras.items()
+            )
+        return (
+            f'{{"customer_id": {_str(self.customer_id)}, '
+            f'"analysis": {{"financial_situation": {self.financial.to_json()}, '
+            f'"life_moment": {self.life_moment.to_json()}, '
+            f'"channel_preference": {self.channel.to_json()}, '
+            f'"next_best_action": {self.action.to_json()}}}, '
+            f'"personalized_message": {self.message.to_json()}, '
+            f'"degraded": {_strs(self.degraded)}, '
+            f'"message_source": {_str(self.message_source)}{extras}}}'
+        )
+
+    def to_bytes(self) -> bytes:
+        """Binary encoding (see encode_binary)"""
+        writer = _Writer()
+        writer.text(self.customer_id)
+        f = self.financial
+        writer.code(f.overall_health)
+        writer.text(f.spending_pattern)
+        writer.number(f.savings_rate)
+        writer.texts(f.risk_indicators)
+        writer.texts(f.opportunities)
+        m = self.life_moment
+        writer.texts(m.detected_moments)
+        writer.number(m.confidence_score)
+        writer.code(m.time_sensitivity)
+        writer.texts(m.relevant_needs)
+        c = self.channel
+        writer.code(c.primary_channel)
+        writer.texts(c.secondary_channels)
+        writer.text(c.best_contact_time)
+        writer.number(c.engagement_likelihood)
+        writer.code(c.personalization_level)
+        a = self.action
+        writer.code(a.action_type)
+        writer.text(a.specific_recommendation)
+        writer.code(a.priority)
+        writer.number(a.expected_value)
+        writer.text(a.rationale)
+        g = self.message
+        writer.text(g.message_subject)
+        writer.text(g.message_body)
+        writer.text(g.call_to_action)
+        writer.code(g.tone)
+        writer.texts(g.personalization_elements)
+        writer.text(g.recommended_channel)
+        writer.text(g.optimal_send_time)
+        writer.number(g.expected_engagement_rate)
+        writer.texts(self.degraded)
+        writer.text(self.message_source)
+        writer.text(json.dumps(self.extras, default=str) if self.extras else "")
+        return writer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CustomerResult":
+        reader = _Reader(data)
+        customer_id = reader.text()
+        financial = FinancialRecord(
+            _HEALTH.by_code[reader.code()], reader.text(), reader.number(), reader.texts(), reader.texts()
+        )
+        life_moment = LifeMomentRecord(
+            reader.texts(), reader.number(), _SENSITIVITY.by_code[reader.code()], reader.texts()
+        )
+        channel = ChannelRecord(
+            _CHANNEL.by_code[reader.code()], reader.texts(), reader.text(), reader.number(),
+            _PERSONALIZATION.by_code[reader.code()]
+        )
+        action = ActionRecord(
+            _ACTION.by_code[reader.code()], reader.text(), _PRIORITY.by_code[reader.code()], reader.number(), reader.text()
+        )
+        message = MessageRecord(
+            reader.text(), reader.text(), reader.text(), _TONE.by_code[reader.code()], reader.texts(),
+            reader.text(), reader.text(), reader.number()
+        )
+        degraded = reader.texts()
+        source = reader.text()
+        extras = reader.text()
+        return cls(
+            customer_id, financial, life_moment, channel, action, message, degraded, source,
+            json.loads(extras) if extras else None,
+        )
+
+
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_F64 = struct.Struct("<d")
+
+
+class _Writer:
+    """Binary field encoder: u8 enum codes, f64 numbers, u32-length UTF-8 strings, u16-count string lists"""
+    __slots__ = ("parts",)
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def code(self, value: int) -> None:
+        self.parts.append(_U8.pack(value))
+
+    def number(self, value: float) -> None:
+        self.parts.append(_F64.pack(value))
+
+    def text(self, value: str) -> None:
+        data = value.encode()
+        self.parts.append(_U32.pack(len(data)))
+        self.parts.append(data)
+
+    def texts(self, values: Sequence[str]) -> None:
+        self.parts.append(_U16.pack(len(values)))
+        for value in values:
+            self.text(value)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.parts)
+
+
+class _Reader:
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def code(self) -> int:
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def number(self) -> float:
+        (value,) = _F64.unpack_from(self.data, self.offset)
+        self.offset += 8
+        return value
+
+    def text(self) -> str:
+        (size,) = _U32.unpack_from(self.data, self.offset)
+        start = self.offset + 4
+        self.offset = start + size
+        return self.data[start:self.offset].decode()
+
+    def texts(self) -> Tuple[str, ...]:
+        (count,) = _U16.unpack_from(self.data, self.offset)
+        self.offset += 2
+        return tuple(self.text() for _ in range(count))
+
+
+# Leading bytes of a binary result file
+BINARY_MAGIC = b"HPR\x01"
+
+
+def encode_record(record: Any) -> str:
+    """JSON line of a batch record: a CustomerResult or a plain dict (error and resumed records)"""
+    if isinstance(record, CustomerResult):
+        return record.to_json()
+    return json.dumps(record, default=str)
+
+
+def write_binary(handle: BinaryIO, results: Iterator[CustomerResult]) -> int:
+    """Write results as BINARY_MAGIC followed by u32-length-prefixed records; returns the count"""
+    handle.write(BINARY_MAGIC)
+    count = 0
+    for result in results:
+        data = result.to_bytes()
+        handle.write(_U32.pack(len(data)))
+        handle.write(data)
+        count += 1
+    return count
+
+
+def read_binary(handle: BinaryIO) -> Iterator[CustomerResult]:
+    if handle.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not a binary result file")
+    while header := handle.read(4):
+        (size,) = _U32.unpack(header)
+        yield CustomerResult.from_bytes(handle.read(size))
@@ -0,0 +1,282 @@
+import contextvars
+import difflib
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, get_args, get_origin
+
+from pydantic import BaseModel, ModelWrapValidatorHandler, ValidationError, create_model, model_validator
+
+from agents.tracing import mark_retry, span
+
+# Outputs repaired locally (each one a model retry avoided) and outputs
+# left to the retry, plus a count per kind of repair
+repair_counts = Counter()
+
+# Whether near-miss outputs are repaired; False leaves every failure to a model retry
+repair_enabled = True
+
+# Spellings models use instead of a declared literal, keyed by normalized
+# spelling; the first target the field allows is used
+LITERAL_SYNONYMS = {
+    # channels
+    "e_mail": ("email",), "mail": ("email",), "newsletter": ("email",),
+    "text": ("sms",), "text_message": ("sms",), "texting": ("sms",),
+    "push": ("push_notification",), "push_notifications": ("push_notification",),
+    "notification": ("push_notification",),
+    "call": ("phone",), "phone_call": ("phone",), "telephone": ("phone",), "voice": ("phone",),
+    "app": ("in_app",), "mobile_app": ("in_app",), "in_app_message": ("in_app",),
+    # financial health
+    "very_good": ("excellent",), "great": ("excellent",), "strong": ("good",), "healthy": ("good",),
+    "average": ("fair", "medium"), "moderate": ("fair", "medium"), "weak": ("poor",), "bad": ("poor",),
+    # time sensitivity
+    "urgent": ("immediate", "high"), "now": ("immediate",), "asap": ("immediate",),
+    "short_term": ("near-term",), "soon": ("near-term",), "mid_term": ("medium-term",), "medium": ("medium-term",),
+    "long": ("long-term",), "later": ("long-term",),
+    # action types
+    "offer": ("product_offer",), "product": ("product_offer",), "cross_sell": ("product_offer",),
+    "upgrade": ("service_upgrade",), "advice": ("financial_advice",), "education": ("financial_advice",),
+    "engage": ("engagement",), "outreach": ("engagement",),
+    # priority and personalization levels
+    "highest": ("high",), "critical": ("high", "poor"), "med": ("medium",), "normal": ("medium",),
+    "lowest": ("low",), "minimal": ("low",),
+    # tones
+    "formal": ("professional",), "casual": ("friendly",), "warm": ("friendly",),
+    "informative": ("educational",), "informational": ("educational",),
+}
+
+# Kinds of repair counted in repair_counts
+REPAIR_KINDS = ("clamped", "number_parsed", "literal_mapped", "scalar_to_list", "number_to_string")
+
+# Lowest similarity (difflib ratio) at which a misspelled literal is mapped
+FUZZY_CUTOFF = 0.8
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Repair kinds applied so far inside the outermost output being validated;
+# nested output models (e.g. the parts of FusedAnalysis) report here instead
+# of repair_counts, so one model response is counted once
+_pending_repairs: contextvars.ContextVar = contextvars.ContextVar("pending_repairs", default=None)
+
+
+def configure_output_repair(enabled: bool) -> None:
+    """Turn local repair of near-miss agent outputs on or off"""
+    global repair_enabled
+    repair_enabled = enabled
+
+
+def _normalize(value: str) -> str:
+    return _NON_WORD.sub("_", value.strip().lower()).strip("_")
+
+
+def map_literal(value: Any, allowed: Tuple[str, ...]) -> Optional[str]:
+    """The allowed literal `value` was meant as, or None when it is not close to any"""
+    if not isinstance(value, str):
+        return None
+    by_normal = {_normalize(option): option for option in allowed}
+    normal = _normalize(value)
+    if normal in by_normal:
+        return by_normal[normal]
+    for synonym in LITERAL_SYNONYMS.get(normal, ()):
+        if synonym in allowed:
+            return synonym
+    close = difflib.get_close_matches(normal, by_normal, n=1, cutoff=FUZZY_CUTOFF)
+    return by_normal[close[0]] if close else None
+
+
+def _bounds(field) -> Tuple[Optional[float], Optional[float]]:
+    lower = upper = None
+    for constraint in field.metadata:
+        lower = getattr(constraint, "ge", lower)
+        upper = getattr(constraint, "le", upper)
+    return lower, upper
+
+
+def _clamp(value: float, field) -> float:
+    lower, upper = _bounds(field)
+    if lower is not None and value < lower:
+        return lower
+    if upper is not None and value > upper:
+        return upper
+    return value
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """A number written as text ("85%", "$1,200", " 0.4 "), or None; percentages become fractions"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    percent = text.endswith("%")
+    text = text.rstrip("%").replace(",", "").replace("$", "").strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return number / 100 if percent else number
+
+
+def _repair_error(model: type, data: Dict[str, Any], error: dict) -> Optional[str]:
+    """Fix the value behind one validation error in `data`; returns the kind of repair, or None"""
+    loc = error["loc"]
+    field = model.model_fields.get(loc[0]) if loc and isinstance(loc[0], str) else None
+    if field is None or loc[0] not in data:
+        return None
+    name, value, kind = loc[0], data[loc[0]], error["type"]
+
+    if len(loc) == 2 and isinstance(loc[1], int) and isinstance(value, list):
+        # An item of a list of strings
+        item = value[loc[1]]
+        if kind == "string_type" and isinstance(item, (int, float)) and not isinstance(item, bool):
+            data[name] = [*value[:loc[1]], str(item), *value[loc[1] + 1:]]
+            return "number_to_string"
+        return None
+    if len(loc) != 1:
+        return None  # nested models repair their own fields
+
+    if kind in ("greater_than_equal", "less_than_equal") and isinstance(value, (int, float)):
+        data[name] = _clamp(value, field)
+        return "clamped"
+    if kind == "float_parsing":
+        number = parse_number(value)
+        if number is None:
+            return None
+        data[name] = _clamp(number, field)
+        return "number_parsed"
+    if kind == "literal_error" and get_origin(field.annotation) is Literal:
+        mapped = map_literal(value, get_args(field.annotation))
+        if mapped is None:
+            return None
+        data[name] = mapped
+        return "literal_mapped"
+    if kind == "list_type" and get_origin(field.annotation) is list:
+        if value is None or (isinstance(value, str) and not value.strip()):
+            data[name] = []
+        elif isinstance(value, (str, int, float)):
+            data[name] = [value if isinstance(value, str) else str(value)]
+        else:
+            return None
+        return "scalar_to_list"
+    return None
+
+
+def repair_output(model: type, data: Any, error: ValidationError) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+    """
+    Deterministic fixes for the common near misses behind `error`: numbers
+    clamped into their declared range, numbers sent as text parsed, literals
+    matched case- and punctuation-insensitively, by synonym or by close
+    spelling, and single values wrapped into lists. Returns the repaired copy
+    of `data` and the kinds of repair applied, or None unless every error can
+    be fixed.
+    """
+    if not isinstance(data, dict):
+        return None
+    repaired = dict(data)
+    kinds = []
+    for detail in error.errors():
+        kind = _repair_error(model, repaired, detail)
+        if kind is None:
+            return None
+        kinds.append(kind)
+    return repaired, kinds
+
+
+def validate_with_repair(model: type, data: Any, handler: Callable[[Any], BaseModel]) -> BaseModel:
+    """
+    Validate `data` with `handler`; if that fails, validate its repaired copy
+    instead. The original error is raised when repair is off or cannot fix
+    every error, so pydantic-ai asks the model again as before. Only the
+    outermost output model counts the result in repair_counts.
+    """
+    pending = _pending_repairs.get()
+    if pending is not None:
+        return _validate(model, data, handler, pending)
+    pending = []
+    token = _pending_repairs.set(pending)
+    try:
+        with span("validation"):
+            try:
+                output = _validate(model, data, handler, pending)
+            except ValidationError:
+                repair_counts["unrepaired_outputs"] += 1
+                mark_retry()
+                raise
+    finally:
+        _pending_repairs.reset(token)
+    if pending:
+        repair_counts["repaired_outputs"] += 1
+        repair_counts.update(pending)
+    return output
+
+
+def _validate(model: type, data: Any, handler: Callable[[Any], BaseModel], pending: List[str]) -> BaseModel:
+    """validate_with_repair without the accounting; kinds of repair applied are added to `pending`"""
+    applied = len(pending)
+    try:
+        return handler(data)
+    except ValidationError as error:
+        # Repairs of nested models made in the failed attempt no longer apply
+        del pending[applied:]
+        if not repair_enabled:
+            raise
+        repair = repair_output(model, data, error)
+        if repair is None:
+            raise
+        repaired, kinds = repair
+        try:
+            output = handler(repaired)
+        except ValidationError:
+            del pending[applied:]
+        else:
+            pending.extend(kinds)
+            return output
+        raise
+
+
+class _RepairNearMisses(BaseModel):
+    """Base of the repairing output models built by repairing_model"""
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _repair_near_misses(cls, data: Any, handler: ModelWrapValidatorHandler) -> Any:
+        return validate_with_repair(cls, data, handler)
+
+
+# Strict output model of each repairing model
+_strict_models: Dict[type, type] = {}
+
+
+@lru_cache(maxsize=None)
+def repairing_model(model: type) -> type:
+    """
+    Subclass of output model `model`, with the same name and schema, that
+    repairs near-miss values (in nested output models too) before failing
+    validation. Agents parse their output with it; `model` stays strict for
+    everything else, and run_agent returns outputs as `model` (see
+    strict_output).
+    """
+    nested = {
+        name: (repairing_model(field.annotation), field)
+        for name, field in model.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel)
+    }
+    repairing = create_model(
+        model.__name__,
+        __base__=(model, _RepairNearMisses),
+        __module__=model.__module__,
+        __doc__=model.__doc__,
+        **nested,
+    )
+    _strict_models[repairing] = model
+    return repairing
+
+
+def strict_model(output_type: Any) -> Any:
+    """The strict model of a repairing model; any other output type as it is"""
+    return _strict_models.get(output_type, output_type)
+
+
+def strict_output(output: Any, output_type: Any) -> Any:
+    """`output` of a repairing model as an instance of the strict `output_type`"""
+    if isinstance(output, BaseModel) and type(output) is not output_type and type(output) in _strict_models:
+        return output_type.model_validate(output.model_dump())
+    return output
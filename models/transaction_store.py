@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from models.customer import Transaction
+
+# One fixed-width file per column; rows of a customer are contiguous
+COLUMNS = {
+    "amount": np.float64,
+    "category": np.uint16,
+    "timestamp": np.int64,  # seconds since the epoch
+    "merchant": np.uint32,  # 0 means no merchant
+}
+
+
+@dataclass
+class TransactionSlice:
+    """Zero-copy view of one customer's transactions in a TransactionStore"""
+    amounts: np.ndarray
+    category_codes: np.ndarray
+    timestamps: np.ndarray
+    merchant_ids: np.ndarray
+    store: "TransactionStore"
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def category_names(self) -> List[str]:
+        return [self.store.categories[code] for code in np.unique(self.category_codes)]
+
+    def to_transactions(self) -> List[Transaction]:
+        """Materialize pydantic Transactions (only for callers that really need objects)"""
+        return [
+            Transaction(
+                amount=float(amount),
+                category=self.store.categories[category],
+                date=datetime.fromtimestamp(int(timestamp)),
+                merchant=self.store.merchants[merchant] if merchant else None,
+            )
+            for amount, category, timestamp, merchant in zip(
+                self.amounts, self.category_codes, self.timestamps, self.merchant_ids
+            )
+        ]
+
+
+class TransactionStore:
+    """
+    Columnar transaction history for many customers, memory-mapped from
+    disk. Each column is a typed array; `offsets` delimits every customer's
+    rows, so slicing a customer is two lookups and no copy.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as handle:
+            meta = json.load(handle)
+        self.categories: List[str] = meta["categories"]
+        self.merchants: List[Optional[str]] = [None] + meta["merchants"]
+        self._index: Dict[str, int] = {customer_id: i for i, customer_id in enumerate(meta["customer_ids"])}
+        self.offsets = np.fromfile(os.path.join(path, "offsets.bin"), dtype=np.int64)
+        rows = int(self.offsets[-1]) if len(self.offsets) else 0
+        self.columns = {
+            name: np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=(rows,))
+            if rows else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+
+    def __contains__(self, customer_id: str) -> bool:
+        return customer_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, customer_id: str) -> Optional[TransactionSlice]:
+        i = self._index.get(customer_id)
+        if i is None:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return TransactionSlice(
+            amounts=self.columns["amount"][start:end],
+            category_codes=self.columns["category"][start:end],
+            timestamps=self.columns["timestamp"][start:end],
+            merchant_ids=self.columns["merchant"][start:end],
+            store=self,
+        )
+
+
+class TransactionStoreWriter:
+    """Streams customers' transactions into a new TransactionStore directory"""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "wb") for name in COLUMNS}
+        self._categories: Dict[str, int] = {}
+        self._merchants: Dict[str, int] = {}
+        self._customer_ids: List[str] = []
+        self._seen = set()
+        self._offsets: List[int] = [0]
+
+    def add(self, customer_id: str, rows: Iterable[tuple]) -> None:
+        """Append one customer's rows of (amount, category, timestamp, merchant)"""
+        if customer_id in self._seen:
+            raise ValueError(f"Transactions of {customer_id} must be written in one contiguous block")
+        amounts, categories, timestamps, merchants = [], [], [], []
+        for amount, category, timestamp, merchant in rows:
+            amounts.append(amount)
+            categories.append(self._categories.setdefault(category, len(self._categories)))
+            timestamps.append(timestamp)
+            merchants.append(self._merchants.setdefault(merchant, len(self._merchants) + 1) if merchant else 0)
+        for name, values in zip(COLUMNS, (amounts, categories, timestamps, merchants)):
+            np.asarray(values, dtype=COLUMNS[name]).tofile(self._files[name])
+        self._customer_ids.append(customer_id)
+        self._seen.add(customer_id)
+        self._offsets.append(self._offsets[-1] + len(amounts))
+
+    @property
+    def customer_count(self) -> int:
+        return len(self._customer_ids)
+
+    def add_transactions(self, customer_id: str, transactions: Iterable[Transaction]) -> None:
+        self.add(customer_id, ((t.amount, t.category, int(t.date.timestamp()), t.merchant) for t in transactions))
+
+    def close(self) -> None:
+        for handle in self._files.values():
+            handle.close()
+        np.asarray(self._offsets, dtype=np.int64).tofile(os.path.join(self.path, "offsets.bin"))
+        with open(os.path.join(self.path, "meta.json"), "w") as handle:
+            json.dump({
+                "customer_ids": self._customer_ids,
+                "categories": list(self._categories),
+                "merchants": list(self._merchants),
+            }, handle)
+
+    def __enter__(self) -> "TransactionStoreWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def build_store_from_csv(csv_path: str, path: str) -> int:
+    """
+    Build a store from a CSV of customer_id,amount,category,date,merchant rows
+    grouped by customer, without creating a Transaction per row. Returns the
+    number of customers written.
+    """
+    def grouped(reader: Iterator[dict]) -> Iterator[tuple]:
+        current, rows = None, []
+        for row in reader:
+            if row["customer_id"] != current and current is not None:
+                yield current, rows
+                rows = []
+            current = row["customer_id"]
+            rows.append((
+                float(row["amount"]),
+                row["category"],
+                int(datetime.fromisoformat(row["date"]).timestamp()),
+                row.get("merchant") or None,
+            ))
+        if current is not None:
+            yield current, rows
+
+    with open(csv_path, newline="") as handle, TransactionStoreWriter(path) as writer:
+        for customer_id, rows in grouped(csv.DictReader(handle)):
+            writer.add(customer_id, rows)
+        return writer.customer_count
+
+
+if __name__ == "__main__":
+    import sys
+
+    count = build_store_from_csv(sys.argv[1], sys.argv[2])
+    print(f"Wrote transactions of {count} customers to {sys.argv[2]}")
@@ -0,0 +1,676 @@
+import argparse
+import asyncio
+import csv
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from itertools import islice
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from agents.cache import ResponseCache
+from agents.channel_analyzer import channel_path_counts, configure_channel_rules
+from agents.deadlines import DeadlinePolicy, configure_deadlines
+from agents.message_templates import TemplateLibrary, configure_message_templates
+from agents.packed import PackedAnalyzer
+from agents.registry import prewarm_agents
+from agents.runtime import configure_response_cache, configure_scheduler, configure_usage_tracker, get_usage_tracker
+from agents.scheduler import RateLimitScheduler, TokenBucket
+from agents.synthesis_agent import ROUTING_FIELDS, SynthesisUpdate
+from agents.tracing import Tracer, configure_tracer, init_instrumentation
+from agents.usage import UsageTracker
+from dependencies.model_provider import ModelProviderConfig, close_model_provider, configure_model_provider
+from models.customer import CustomerProfile
+from models.records import encode_record
+from models.repair import REPAIR_KINDS, configure_output_repair, repair_counts
+from models.transaction_store import TransactionStore
+from pipeline.features import CustomerFeatures, compute_features
+from pipeline.result_store import ResultStore
+from pipeline.stats import LatencyStats, TimeToFieldStats
+
+# Columns that hold nested data and are stored as JSON strings in CSV sources
+JSON_COLUMNS = {"recent_transactions", "preferred_contact_times", "digital_engagement", "account_data"}
+
+Processor = Callable[[CustomerProfile, Optional[CustomerFeatures]], Awaitable[dict]]
+
+# Called with a record's position in the input, the record and the customer's latency
+# (None on error, and for records resumed from a result store, which carry "resumed": True)
+RecordCallback = Callable[[int, dict, Optional[float]], None]
+
+
+def _profile_from_csv_row(row: dict) -> CustomerProfile:
+    """Build a profile from a CSV row, decoding the nested JSON columns"""
+    data = {}
+    for key, value in row.items():
+        if value is None or value == "":
+            continue  # let the model defaults apply
+        data[key] = json.loads(value) if key in JSON_COLUMNS else value
+    return CustomerProfile.model_validate(data)
+
+
+def iter_customer_profiles(path: str, shard: int = 0, shards: int = 1) -> Iterator[CustomerProfile]:
+    """
+    Stream customer profiles from a JSONL or CSV file one record at a time.
+    With `shards` > 1 only every `shards`-th record, starting at `shard`, is
+    validated; the other records are skipped without being parsed.
+    """
+    source = Path(path)
+    with source.open(newline="") as handle:
+        if source.suffix.lower() == ".csv":
+            for i, row in enumerate(csv.DictReader(handle)):
+                if i % shards == shard:
+                    yield _profile_from_csv_row(row)
+        else:
+            for i, line in enumerate(line for line in handle if line.strip()):
+                if i % shards == shard:
+                    yield CustomerProfile.model_validate_json(line)
+
+
+def _with_features(
+    profiles: Iterator[CustomerProfile], chunk_size: int, store: Optional[TransactionStore] = None
+) -> Iterator[Tuple[List[CustomerProfile], List[CustomerFeatures]]]:
+    """
+    Read profiles in chunks and precompute their features one chunk at a time.
+    With a transaction store, transactions come from its memory-mapped columns
+    instead of the profiles.
+    """
+    while chunk := list(islice(profiles, chunk_size)):
+        transactions = None if store is None else [store.get(profile.customer_id) for profile in chunk]
+        yield chunk, compute_features(chunk, transactions=transactions)
+
+
+def _budget_stopped() -> bool:
+    tracker = get_usage_tracker()
+    return tracker is not None and tracker.hard_budget_exhausted
+
+
+def _until_budget_exhausted(items: Iterator) -> Iterator:
+    """Stop reading input once the usage tracker's hard token budget is spent"""
+    for item in items:
+        if _budget_stopped():
+            return
+        yield item
+
+
+async def _run_workers(items: Iterator, handle: Callable[[Any], Awaitable[None]], concurrency: int, queue_size: int) -> None:
+    """Feed items through a bounded queue to `concurrency` workers"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def worker() -> None:
+        while (item := await queue.get()) is not None:
+            await handle(item)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for item in items:
+            await queue.put(item)  # blocks while the queue is full (backpressure)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+
+def _error_record(profile: CustomerProfile, exc: BaseException) -> dict:
+    return {"customer_id": profile.customer_id, "error": f"{type(exc).__name__}: {exc}"}
+
+
+def _save_result(result_store: Optional[ResultStore], profile: CustomerProfile, record: Any) -> None:
+    """Store a finished customer's record unless it holds degraded fallbacks, which a rerun retries"""
+    if result_store is None:
+        return
+    degraded = record.get("degraded") if isinstance(record, dict) else record.degraded
+    if degraded:
+        result_store.stats["results_degraded"] += 1
+        return
+    result_store.save_result(profile, record)
+
+
+def _resume(
+    profile: CustomerProfile,
+    position: int,
+    result_store: Optional[ResultStore],
+    stats: LatencyStats,
+    emit: RecordCallback,
+) -> bool:
+    """Emit the stored record of a customer finished in an earlier run; False if it still has to be processed"""
+    record = result_store.completed(profile) if result_store is not None else None
+    if record is None:
+        return False
+    stats.resumed += 1
+    emit(position, {**record, "resumed": True}, None)
+    return True
+
+
+@contextmanager
+def _open_sink(sink_path: Optional[str], on_record: Optional[RecordCallback]) -> Iterator[RecordCallback]:
+    """Callback that appends records to the JSONL sink (if any) and forwards them to `on_record`"""
+    with (open(sink_path, "w") if sink_path else nullcontext()) as sink:
+
+        def emit(position: int, record: dict, latency: Optional[float]) -> None:
+            if sink is not None:
+                sink.write(encode_record(record) + "\n")
+            if on_record is not None:
+                on_record(position, record, latency)
+
+        yield emit
+
+
+async def run_batch(
+    profiles: Iterator[CustomerProfile],
+    sink_path: Optional[str],
+    concurrency: int = 16,
+    queue_size: Optional[int] = None,
+    processor: Optional[Processor] = None,
+    feature_chunk_size: int = 256,
+    transaction_store: Optional[TransactionStore] = None,
+    on_record: Optional[RecordCallback] = None,
+    result_store: Optional[ResultStore] = None,
+) -> dict:
+    """
+    Fan customer profiles through the personalization pipeline with at most
+    `concurrency` customers in flight. The input queue is bounded, so the
+    source is only read as fast as workers drain it, and results are appended
+    to the JSONL sink as soon as each customer finishes (and passed to
+    `on_record` with their input position, if given). Features are
+    precomputed for `feature_chunk_size` profiles at a time, reading
+    transactions from `transaction_store` when given. With a `result_store`,
+    customers it holds a record for are not processed again: their stored
+    record is emitted with "resumed": True. New records are saved to it.
+    """
+    if processor is None:
+        from main import process_customer_for_personalization
+
+        async def processor(profile: CustomerProfile, features: Optional[CustomerFeatures]) -> dict:
+            return await process_customer_for_personalization(profile, verbose=False, features=features, compact=True)
+
+    stats = LatencyStats()
+
+    with _open_sink(sink_path, on_record) as emit:
+
+        async def handle(item: Tuple[int, Tuple[CustomerProfile, CustomerFeatures]]) -> None:
+            position, (profile, features) = item
+            if _resume(profile, position, result_store, stats, emit):
+                return
+            started = time.perf_counter()
+            try:
+                record = await processor(profile, features)
+                latency = time.perf_counter() - started
+                stats.record(latency)
+            except Exception as exc:  # one failing customer must not stop the batch
+                stats.errors += 1
+                record, latency = _error_record(profile, exc), None
+            else:
+                _save_result(result_store, profile, record)
+            emit(position, record, latency)
+
+        items = (
+            item
+            for chunk, features in _with_features(profiles, feature_chunk_size, transaction_store)
+            for item in zip(chunk, features)
+        )
+        batch_start = time.perf_counter()
+        await _run_workers(
+            _until_budget_exhausted(enumerate(items)), handle, concurrency, queue_size or concurrency * 2
+        )
+
+    return {**stats.summary(time.perf_counter() - batch_start), "stopped_by_budget": _budget_stopped()}
+
+
+async def run_packed_batch(
+    profiles: Iterator[CustomerProfile],
+    sink_path: Optional[str],
+    analyzer: PackedAnalyzer,
+    chunk_size: int = 128,
+    concurrency: int = 4,
+    transaction_store: Optional[TransactionStore] = None,
+    on_record: Optional[RecordCallback] = None,
+    result_store: Optional[ResultStore] = None,
+) -> dict:
+    """
+    Packed variant of run_batch: customers are read in chunks of `chunk_size`
+    and each chunk goes through process_customers_packed, so every analysis
+    agent sees many customers per request. `concurrency` bounds the number
+    of chunks in flight; a customer's latency is that of its chunk.
+    Customers finished in an earlier run are resumed from `result_store` as
+    in run_batch; packed analyses are not checkpointed per stage.
+    """
+    from main import process_customers_packed
+
+    stats = LatencyStats()
+
+    def positioned(chunks):
+        position = 0
+        for chunk, features in chunks:
+            yield position, chunk, features
+            position += len(chunk)
+
+    with _open_sink(sink_path, on_record) as emit:
+
+        async def handle(item: Tuple[int, List[CustomerProfile], List[CustomerFeatures]]) -> None:
+            first, chunk, features = item
+            pending = [
+                (position, profile, customer_features)
+                for position, (profile, customer_features) in enumerate(zip(chunk, features), first)
+                if not _resume(profile, position, result_store, stats, emit)
+            ]
+            if not pending:
+                return
+            positions, chunk, features = (list(column) for column in zip(*pending))
+            started = time.perf_counter()
+            try:
+                results = await process_customers_packed(chunk, analyzer, features, compact=True)
+            except Exception as exc:  # one failing chunk must not stop the batch
+                results = [exc] * len(chunk)
+            elapsed = time.perf_counter() - started
+            for position, profile, result in zip(positions, chunk, results):
+                if isinstance(result, BaseException):
+                    stats.errors += 1
+                    emit(position, _error_record(profile, result), None)
+                else:
+                    stats.record(elapsed)
+                    _save_result(result_store, profile, result)
+                    emit(position, result, elapsed)
+
+        batch_start = time.perf_counter()
+        chunks = _until_budget_exhausted(positioned(_with_features(profiles, chunk_size, transaction_store)))
+        await _run_workers(chunks, handle, concurrency, concurrency)
+
+    return {**stats.summary(time.perf_counter() - batch_start), "stopped_by_budget": _budget_stopped()}
+
+
+def add_pipeline_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options shared by every entry point that runs the pipeline (batch runner and service)"""
+    parser.add_argument("--cache", default=None, help="SQLite file for the persistent agent response cache")
+    parser.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, help="Cache entry lifetime in seconds")
+    parser.add_argument("--channel-rules-threshold", type=float, default=None,
+                        help="Confidence needed to skip the channel LLM call (above 1.0 disables the rules)")
+    parser.add_argument("--segment-templates", action="store_true",
+                        help="Reuse one message template per customer segment instead of synthesizing every message")
+    parser.add_argument("--template-fields", default="",
+                        help="Extra comma-separated <analysis>.<field> names segments are keyed on, "
+                             "e.g. next_best_action.priority")
+    parser.add_argument("--template-min-support", type=int, default=3,
+                        help="Customers a segment needs before its template is written")
+    parser.add_argument("--template-similarity", type=float, default=0.3,
+                        help="Term similarity to the template's customer below which a message is synthesized")
+    parser.add_argument("--templates-file", default=None,
+                        help="JSON file templates are loaded from and (in single-process runs) saved to")
+    parser.add_argument("--no-output-repair", action="store_true",
+                        help="Retry every invalid agent output with the model instead of repairing near misses locally")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Requests/min quota shared by all agents (enables the rate-limit scheduler)")
+    parser.add_argument("--tpm", type=float, default=4_000_000, help="Tokens/min quota used with --rpm")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Hard token ceiling for the run; no new requests are sent once it is reached")
+    parser.add_argument("--soft-token-budget", type=int, default=None,
+                        help="Token count after which model requests are throttled to one at a time")
+    parser.add_argument("--usage-report", default=None, help="Write per-agent and per-customer token usage as JSON")
+    parser.add_argument("--agent-deadline", type=float, default=None,
+                        help="Seconds an analysis may take before its deterministic fallback is used")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Send a hedged duplicate of analyses still running past this latency percentile")
+    parser.add_argument("--trace", action="store_true",
+                        help="Time every customer's stages and report per-stage latency and critical-path shares")
+    parser.add_argument("--trace-file", default=None, help="JSONL file receiving every customer's stage spans (implies --trace)")
+    parser.add_argument("--profile-slower-than", type=float, default=None,
+                        help="Sample CPU stacks and keep folded profiles of customers slower than this many seconds "
+                             "(implies --trace)")
+    parser.add_argument("--profile-dir", default="profiles", help="Directory slow customers' CPU profiles are written to")
+    parser.add_argument("--prewarm-agents", default=None,
+                        help="Comma-separated agent names (or 'all') built, with the model client, when a worker "
+                             "starts rather than on its first customer, e.g. financial_analyzer,synthesis_agent")
+    parser.add_argument("--base-url", default=None, help="Send model requests to this server instead of Gemini")
+    parser.add_argument("--max-connections", type=int, default=200, help="HTTP connection pool size")
+    parser.add_argument("--no-http2", action="store_true", help="Use HTTP/1.1 for model requests")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Personalize a file of customers in batch")
+    parser.add_argument("source", help="Customer profiles as .jsonl or .csv")
+    parser.add_argument("sink", help="Output JSONL file for personalization results")
+    parser.add_argument("--concurrency", type=int, default=16, help="Customers (or packed chunks) processed at the same time")
+    parser.add_argument("--queue-size", type=int, default=None, help="Profiles read ahead of the workers")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Shard the input across this many worker processes (each with its own event loop)")
+    parser.add_argument("--transactions-store", default=None,
+                        help="Directory of a columnar transaction store to read transactions from")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--packed", action="store_true",
+                      help="Send many customers per analysis request instead of one")
+    mode.add_argument("--fused", action="store_true",
+                      help="Get all four analyses of a customer from one request instead of four")
+    parser.add_argument("--stream-synthesis", action="store_true",
+                        help="Stream synthesized messages and report time-to-field metrics (not with --packed)")
+    parser.add_argument("--early-sink", default=None,
+                        help="With --stream-synthesis, JSONL file receiving channel and subject as soon as they are known")
+    parser.add_argument("--result-store", default=None,
+                        help="SQLite file checkpointing every customer's stages and result; "
+                             "rerunning with the same file resumes where the last run stopped")
+    parser.add_argument("--store-flush-rows", type=int, default=256,
+                        help="Checkpoint rows buffered before a bulk insert into the result store")
+    parser.add_argument("--pack-chunk-size", type=int, default=128, help="Customers read per packed chunk")
+    parser.add_argument("--pack-token-budget", type=int, default=8000,
+                        help="Estimated tokens allowed per packed request")
+    parser.add_argument("--pack-max-customers", type=int, default=32, help="Upper bound on customers per request")
+    add_pipeline_arguments(parser)
+    return parser
+
+
+@dataclass
+class BatchComponents:
+    """Components configured from the command line in one process"""
+    tracker: UsageTracker
+    scheduler: Optional[RateLimitScheduler] = None
+    deadlines: Optional[DeadlinePolicy] = None
+    streaming: Optional[TimeToFieldStats] = None
+    cache: Optional[ResponseCache] = None
+    analyzer: Optional[PackedAnalyzer] = None
+    store: Optional[TransactionStore] = None
+    templates: Optional[TemplateLibrary] = None
+    results: Optional[ResultStore] = None
+    tracer: Optional[Tracer] = None
+
+    def report(self) -> dict:
+        """Picklable counters of this process; shards' reports are combined with merge_reports"""
+        return {
+            "usage": self.tracker.snapshot(),
+            "channel_paths": Counter(channel_path_counts),
+            "packed": Counter(self.analyzer.stats) if self.analyzer else None,
+            "scheduler": Counter(self.scheduler.stats) if self.scheduler else None,
+            "concurrency_limit": self.scheduler.limit if self.scheduler else None,
+            "cache": Counter(self.cache.stats) if self.cache else None,
+            "deadlines": Counter(self.deadlines.stats) if self.deadlines else None,
+            "streaming": self.streaming,
+            "templates": Counter(self.templates.stats) if self.templates else None,
+            "result_store": Counter(self.results.stats) if self.results else None,
+            "output_repair": Counter(repair_counts),
+            "tracing": self.tracer.stats if self.tracer else None,
+        }
+
+
+def configure_batch(
+    args: argparse.Namespace,
+    shards: int = 1,
+    rate_buckets: Optional[Tuple[TokenBucket, TokenBucket]] = None,
+    window: Optional[int] = None,
+) -> BatchComponents:
+    """
+    Install the provider, scheduler, usage tracker, channel rules and cache
+    for this process and pre-warm the agents asked for. A shard gets
+    1/`shards` of the token budgets, and its scheduler draws from
+    `rate_buckets` (requests, tokens) when they are given. Telemetry is
+    initialized here, so a bad logfire configuration fails at startup. With
+    `window`, for a long-running service, usage is not kept per customer and
+    stage latencies cover the latest `window` samples only, so memory stays
+    bounded.
+    """
+    init_instrumentation()
+    provider_config = ModelProviderConfig(max_connections=args.max_connections, http2=not args.no_http2)
+    if args.base_url:
+        provider_config.base_url = args.base_url
+    configure_model_provider(provider_config)
+
+    scheduler = None
+    if args.rpm:
+        requests_bucket, tokens_bucket = rate_buckets or (None, None)
+        scheduler = RateLimitScheduler(
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            requests_bucket=requests_bucket,
+            tokens_bucket=tokens_bucket,
+        )
+        configure_scheduler(scheduler)
+
+    def share(budget: Optional[int]) -> Optional[int]:
+        return None if budget is None else budget // shards
+
+    tracker = UsageTracker(
+        soft_token_budget=share(args.soft_token_budget),
+        hard_token_budget=share(args.token_budget),
+        keep_customers=window is None,
+    )
+    configure_usage_tracker(tracker)
+
+    deadlines = None
+    if args.agent_deadline is not None or args.hedge_percentile is not None:
+        deadlines = DeadlinePolicy(deadline_seconds=args.agent_deadline, hedge_percentile=args.hedge_percentile)
+        configure_deadlines(deadlines)
+
+    if args.channel_rules_threshold is not None:
+        configure_channel_rules(args.channel_rules_threshold)
+    configure_output_repair(not args.no_output_repair)
+
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, ttl_seconds=args.cache_ttl)
+        configure_response_cache(cache)
+
+    analyzer = None
+    if args.packed:
+        analyzer = PackedAnalyzer(token_budget=args.pack_token_budget, max_chunk_size=args.pack_max_customers)
+
+    templates = None
+    if args.segment_templates:
+        templates = TemplateLibrary(
+            extra_fields=[field for field in args.template_fields.split(",") if field],
+            min_support=args.template_min_support,
+            similarity_threshold=args.template_similarity,
+            path=args.templates_file,
+        )
+        configure_message_templates(templates)
+
+    store = TransactionStore(args.transactions_store) if args.transactions_store else None
+    results = ResultStore(args.result_store, flush_rows=args.store_flush_rows) if args.result_store else None
+    streaming = TimeToFieldStats() if args.stream_synthesis else None
+
+    tracer = None
+    if args.trace or args.trace_file or args.profile_slower_than is not None:
+        tracer = Tracer(
+            args.trace_file, profile_slower_than=args.profile_slower_than, profile_dir=args.profile_dir, window=window
+        )
+        configure_tracer(tracer)
+
+    if args.prewarm_agents:
+        names = [name.strip() for name in args.prewarm_agents.split(",") if name.strip()]
+        prewarm_agents(None if names == ["all"] else names)
+    return BatchComponents(
+        tracker=tracker,
+        scheduler=scheduler,
+        deadlines=deadlines,
+        streaming=streaming,
+        cache=cache,
+        analyzer=analyzer,
+        store=store,
+        templates=templates,
+        results=results,
+        tracer=tracer,
+    )
+
+
+async def run_configured(
+    args: argparse.Namespace,
+    components: BatchComponents,
+    profiles: Iterator[CustomerProfile],
+    sink_path: Optional[str],
+    on_record: Optional[RecordCallback] = None,
+) -> dict:
+    """Run the batch (fan-out, fused or packed, per `args`) and release the provider and cache afterwards"""
+    early_sink = open(args.early_sink, "w") if args.stream_synthesis and args.early_sink else None
+    try:
+        if components.analyzer is not None:
+            return await run_packed_batch(
+                profiles,
+                sink_path,
+                components.analyzer,
+                chunk_size=args.pack_chunk_size,
+                concurrency=args.concurrency,
+                transaction_store=components.store,
+                on_record=on_record,
+                result_store=components.results,
+            )
+        from main import process_customer_for_personalization
+
+        def on_synthesis_update(profile: CustomerProfile, update: SynthesisUpdate) -> None:
+            # Hand channel and subject on the moment both are known
+            if early_sink is not None and ROUTING_FIELDS <= update.fields.keys() and ROUTING_FIELDS & set(update.new_fields):
+                routing = {name: update.fields[name] for name in sorted(ROUTING_FIELDS)}
+                early_sink.write(json.dumps({"customer_id": profile.customer_id, **routing, "elapsed_s": update.elapsed}) + "\n")
+                early_sink.flush()
+
+        async def processor(profile: CustomerProfile, features: Optional[CustomerFeatures]) -> dict:
+            record = await process_customer_for_personalization(
+                profile,
+                verbose=False,
+                features=features,
+                fused=args.fused,
+                on_synthesis_update=on_synthesis_update if args.stream_synthesis else None,
+                checkpoint=components.results.checkpoint(profile) if components.results else None,
+                compact=True,
+            )
+            if components.streaming is not None:
+                components.streaming.record(record.extras["synthesis_timing"])
+            return record
+
+        return await run_batch(
+            profiles,
+            sink_path,
+            concurrency=args.concurrency,
+            queue_size=args.queue_size,
+            processor=processor,
+            transaction_store=components.store,
+            on_record=on_record,
+            result_store=components.results,
+        )
+    finally:
+        await close_batch(args, components)
+        if early_sink is not None:
+            early_sink.close()
+
+
+async def close_batch(args: argparse.Namespace, components: BatchComponents) -> None:
+    """
+    Release the provider and cache, flush the result store and trace file
+    and save the segment templates (outside shards)
+    """
+    await close_model_provider()
+    if components.tracer is not None:
+        components.tracer.close()
+    if components.cache is not None:
+        components.cache.close()
+    if components.results is not None:
+        components.results.close()
+    if components.templates is not None and args.templates_file and args.processes == 1:
+        components.templates.save()
+
+
+def merge_reports(reports: List[dict]) -> dict:
+    """Combine BatchComponents.report() of several shards"""
+    merged: dict = {}
+    for report in reports:
+        for key, value in report.items():
+            if key == "usage":
+                continue  # absorbed into a UsageTracker instead
+            if merged.get(key) is None:
+                merged[key] = value
+            elif value is not None:
+                merged[key] = merged[key] + value
+    return merged
+
+
+def print_summary(summary: dict, report: dict, tracker: UsageTracker, args: argparse.Namespace) -> None:
+    print("=" * 60)
+    print("📦 BATCH SUMMARY")
+    print("=" * 60)
+    print(f"Customers: {summary['customers']} ({summary['errors']} errors)")
+    results = report["result_store"]
+    if results is not None:
+        print(f"Result store: {summary['resumed']} customers resumed, {results['stages_reused']} stages reused, "
+              f"{results['results_saved']} results and {results['stages_saved']} stages saved "
+              f"in {results['flushes']} bulk writes; {results['results_degraded']} degraded results left to a rerun")
+    print(f"Throughput: {summary['customers_per_s']:.2f} customers/s")
+    print(f"Latency p50/p95/p99: {summary['p50_s']:.2f}s / {summary['p95_s']:.2f}s / {summary['p99_s']:.2f}s")
+    packed = report["packed"]
+    if packed is not None:
+        print(f"Packed requests: {packed['packed_requests']} "
+              f"({packed['packed_entries']} entries, {packed['individual_retries']} individual retries, "
+              f"{packed['failed_packed_requests']} failed)")
+    scheduler = report["scheduler"]
+    if scheduler is not None:
+        print(f"Scheduler: {scheduler['throttled']} throttled, {scheduler['slow']} slow, "
+              f"final concurrency limit {report['concurrency_limit']:.1f}")
+    deadlines = report["deadlines"]
+    if deadlines is not None:
+        for name in sorted({key.split(".")[0] for key in deadlines}):
+            print(f"Deadlines {name}: {deadlines[name + '.hedges']} hedged ({deadlines[name + '.hedge_wins']} won), "
+                  f"{deadlines[name + '.deadline_misses']} fell back")
+    streaming = report["streaming"]
+    if streaming is not None:
+        timing = streaming.summary()
+        print(f"Synthesis stream p50/p95: first field {timing['first_field_p50_s']:.2f}s / {timing['first_field_p95_s']:.2f}s, "
+              f"channel+subject {timing['routing_fields_p50_s']:.2f}s / {timing['routing_fields_p95_s']:.2f}s, "
+              f"complete {timing['complete_p50_s']:.2f}s / {timing['complete_p95_s']:.2f}s")
+    if summary["stopped_by_budget"]:
+        print(f"⚠️  Stopped early: token budget of {args.token_budget} reached")
+    print(f"Tokens: {tracker.total.input_tokens} in / {tracker.total.output_tokens} out "
+          f"over {tracker.total.requests} requests (~${tracker.cost(tracker.total):.4f})")
+    print(tracker.agent_summary())
+    if args.usage_report:
+        tracker.write_json(args.usage_report)
+    channel_paths = report["channel_paths"]
+    print(f"Channel decisions: {channel_paths['rules']} rule-based, {channel_paths['llm']} LLM")
+    repairs = report["output_repair"]
+    if repairs["repaired_outputs"] or repairs["unrepaired_outputs"]:
+        kinds = ", ".join(f"{repairs[kind]} {kind}" for kind in REPAIR_KINDS if repairs[kind])
+        print(f"Output repair: {repairs['repaired_outputs']} outputs repaired without a retry ({kinds}), "
+              f"{repairs['unrepaired_outputs']} left to a retry")
+    templates = report["templates"]
+    if templates is not None:
+        print(f"Segment templates: {templates['template_hits']} messages from templates "
+              f"({templates['templates_generated']} written, {templates['templates_rejected']} rejected, "
+              f"{templates['templates_failed']} failed); "
+              f"synthesized {templates['new_segment']} in new segments, {templates['low_similarity']} below similarity, "
+              f"{templates['rejected_segment']} in rejected segments, {templates['failed_segment']} after failed requests")
+    tracing = report["tracing"]
+    if tracing is not None:
+        stages = tracing.summary()
+        print("Stages by share of wall time on the critical path (span p50 / p95):")
+        for name in sorted(stages, key=lambda stage: stages[stage]["wall_share"], reverse=True):
+            stage = stages[name]
+            print(f"  {name:<20} {stage['wall_share']:6.1%}  {stage['p50_s'] * 1000:8.1f} ms / "
+                  f"{stage['p95_s'] * 1000:8.1f} ms  ({stage['spans']} spans)")
+        if tracing.profiles_written:
+            print(f"CPU profiles of {tracing.profiles_written} slow customers written to {args.profile_dir}/")
+    cache = report["cache"]
+    if cache is not None:
+        hits = cache["memory_hits"] + cache["disk_hits"]
+        hit_rate = hits / (hits + cache["misses"]) if hits + cache["misses"] else 0.0
+        print(f"Cache hit rate: {hit_rate:.1%} "
+              f"({cache['memory_hits']} memory, {cache['disk_hits']} disk, {cache['misses']} misses)")
+
+
+async def _run_in_process(args: argparse.Namespace) -> Tuple[dict, BatchComponents]:
+    components = configure_batch(args)
+    summary = await run_configured(args, components, iter_customer_profiles(args.source), args.sink)
+    return summary, components
+
+
+def main() -> dict:
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.stream_synthesis and args.packed:
+        parser.error("--stream-synthesis is not supported with --packed")
+    if args.processes > 1:
+        from pipeline.sharded import run_sharded
+
+        summary, report, tracker = run_sharded(args)
+    else:
+        summary, components = asyncio.run(_run_in_process(args))
+        report, tracker = components.report(), components.tracker
+    print_summary(summary, report, tracker, args)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models.customer import CustomerProfile
+from models.transaction_store import TransactionSlice
+
+# Trailing window used to estimate monthly spend
+SPEND_WINDOW_DAYS = 30
+
+
+@dataclass
+class CustomerFeatures:
+    """Deterministic financial features computed ahead of the agent calls"""
+    debt_to_income: float
+    monthly_income: float
+    monthly_debt: float
+    monthly_spend: float
+    savings_rate: float
+    category_spend: Dict[str, float] = field(default_factory=dict)
+    transaction_count: int = 0
+    days_since_last_transaction: Optional[float] = None
+    last_transaction_at: Optional[datetime] = None
+
+
+def _flatten_profile_transactions(profiles: Sequence[CustomerProfile]):
+    """Flatten `recent_transactions` of all profiles into column arrays"""
+    counts = np.fromiter((len(p.recent_transactions) for p in profiles), dtype=np.int64, count=len(profiles))
+    total = int(counts.sum())
+    amounts = np.fromiter((t.amount for p in profiles for t in p.recent_transactions), dtype=np.float64, count=total)
+    timestamps = np.fromiter(
+        (t.date.timestamp() for p in profiles for t in p.recent_transactions), dtype=np.float64, count=total
+    )
+    categories, category_codes = np.unique(
+        np.array([t.category for p in profiles for t in p.recent_transactions], dtype=object).astype(str),
+        return_inverse=True,
+    )
+    return counts, amounts, timestamps, categories, category_codes
+
+
+def _flatten_store_transactions(slices: Sequence[Optional[TransactionSlice]]):
+    """Concatenate the columns of store slices; no Transaction objects are created"""
+    present = [s for s in slices if s is not None]
+    counts = np.fromiter((len(s) if s is not None else 0 for s in slices), dtype=np.int64, count=len(slices))
+    if not present:
+        empty = np.empty(0)
+        return counts, empty, empty, np.empty(0, dtype=str), np.empty(0, dtype=np.int64)
+    amounts = np.concatenate([s.amounts for s in present]).astype(np.float64, copy=False)
+    timestamps = np.concatenate([s.timestamps for s in present]).astype(np.float64)
+    store_codes, category_codes = np.unique(np.concatenate([s.category_codes for s in present]), return_inverse=True)
+    store_categories = present[0].store.categories
+    categories = np.array([store_categories[code] for code in store_codes], dtype=str)
+    return counts, amounts, timestamps, categories, category_codes
+
+
+def compute_features(
+    profiles: Sequence[CustomerProfile],
+    as_of: Optional[datetime] = None,
+    transactions: Optional[Sequence[Optional[TransactionSlice]]] = None,
+) -> List[CustomerFeatures]:
+    """
+    Compute features for a batch of customers in one vectorized pass.
+    Transactions and debts of all customers are flattened into arrays and
+    reduced per customer with bincount, instead of looping per transaction.
+    When `transactions` holds TransactionStore slices (aligned with
+    `profiles`), they replace the profiles' `recent_transactions`.
+    """
+    n = len(profiles)
+    if n == 0:
+        return []
+    now = (as_of or datetime.now()).timestamp()
+
+    income = np.fromiter((p.income for p in profiles), dtype=np.float64, count=n)
+    monthly_income = income / 12  # income is annual
+
+    debt_counts = [len(p.account_data.get("debts", [])) for p in profiles]
+    debt_values = np.fromiter(
+        (d for p in profiles for d in p.account_data.get("debts", [])), dtype=np.float64, count=sum(debt_counts)
+    )
+    debt_owner = np.repeat(np.arange(n), debt_counts)
+    monthly_debt = np.bincount(debt_owner, weights=debt_values, minlength=n)
+
+    if transactions is None:
+        txn_counts, amounts, timestamps, categories, category_codes = _flatten_profile_transactions(profiles)
+    else:
+        txn_counts, amounts, timestamps, categories, category_codes = _flatten_store_transactions(transactions)
+    txn_owner = np.repeat(np.arange(n), txn_counts)
+    n_categories = len(categories)
+
+    # Spend per (customer, category) as a dense n x n_categories matrix
+    category_matrix = np.bincount(
+        txn_owner * n_categories + category_codes, weights=amounts, minlength=n * n_categories
+    ).reshape(n, n_categories)
+
+    age_days = (now - timestamps) / 86400
+    in_window = age_days <= SPEND_WINDOW_DAYS
+    monthly_spend = np.bincount(txn_owner[in_window], weights=amounts[in_window], minlength=n)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        debt_to_income = np.where(monthly_income > 0, monthly_debt / monthly_income, 0.0)
+        savings_rate = np.where(
+            monthly_income > 0,
+            np.clip((monthly_income - monthly_debt - monthly_spend) / monthly_income, -1.0, 1.0),
+            0.0,
+        )
+
+    last_txn_ts = np.full(n, -np.inf)
+    np.maximum.at(last_txn_ts, txn_owner, timestamps)
+    last_txn_age = (now - last_txn_ts) / 86400
+
+    features = []
+    for i in range(n):
+        row = category_matrix[i]
+        spent = np.nonzero(row)[0]
+        features.append(CustomerFeatures(
+            debt_to_income=float(debt_to_income[i]),
+            monthly_income=float(monthly_income[i]),
+            monthly_debt=float(monthly_debt[i]),
+            monthly_spend=float(monthly_spend[i]),
+            savings_rate=float(savings_rate[i]),
+            category_spend={str(categories[c]): float(row[c]) for c in spent},
+            transaction_count=int(txn_counts[i]),
+            days_since_last_transaction=float(last_txn_age[i]) if txn_counts[i] else None,
+            last_transaction_at=datetime.fromtimestamp(last_txn_ts[i]) if txn_counts[i] else None,
+        ))
+    return features
+
+
+def render_last_transaction(features: CustomerFeatures) -> str:
+    """Render the date of the customer's most recent transaction"""
+    # An absolute date keeps the rendered prompt (and its cache key) stable from day to day
+    if features.last_transaction_at is None:
+        return "No transactions"
+    return features.last_transaction_at.strftime("%Y-%m-%d")
+
+
+def render_features(features: CustomerFeatures) -> str:
+    """Render precomputed features for inclusion in a system prompt"""
+    spend = ", ".join(f"{category}: ${amount:,.2f}" for category, amount in features.category_spend.items())
+    return f"""
+Precomputed Financial Metrics:
+- Debt-to-Income Ratio (monthly): {features.debt_to_income:.2%}
+- Monthly Income: ${features.monthly_income:,.2f}
+- Monthly Debt Obligations: ${features.monthly_debt:,.2f}
+- Spend in Last {SPEND_WINDOW_DAYS} Days: ${features.monthly_spend:,.2f}
+- Estimated Savings Rate: {features.savings_rate:.1%}
+- Spending by Category: {spend or 'None'}
+- Last Transaction: {render_last_transaction(features)}
+"""
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from agents import channel_analyzer, financial_analyzer, life_moment_identifier, next_best_action
+from dependencies.customer_deps import CustomerDependencies
+from models.customer import CustomerEvent, CustomerProfile
+
+
+@dataclass
+class TrackedAnalysis:
+    """An analysis agent together with a fingerprint of exactly the inputs it reads"""
+    name: str
+    fingerprint: Callable[[CustomerDependencies], str]
+    run: Callable[[CustomerDependencies], Awaitable[BaseModel]]
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# Each agent's output depends only on its rendered context, so hashing the
+# rendered context tells whether a profile change can affect that agent.
+TRACKED_ANALYSES = [
+    TrackedAnalysis(
+        "financial_situation",
+        lambda deps: _digest(financial_analyzer.render_customer_context(deps.customer_profile, deps.get_features())),
+        financial_analyzer.analyze_financial_situation,
+    ),
+    TrackedAnalysis(
+        "life_moment",
+        lambda deps: _digest(life_moment_identifier.render_life_context(deps.customer_profile, deps.get_features())),
+        life_moment_identifier.identify_life_moment,
+    ),
+    TrackedAnalysis(
+        "channel_preference",
+        lambda deps: _digest(channel_analyzer.render_engagement_context(deps.customer_profile)),
+        channel_analyzer.analyze_channel_preference,
+    ),
+    TrackedAnalysis(
+        "next_best_action",
+        lambda deps: _digest(next_best_action.render_product_context(deps.customer_profile)),
+        next_best_action.recommend_next_action,
+    ),
+]
+
+
+@dataclass
+class CustomerState:
+    """Last known profile, agent inputs and outputs for one customer"""
+    profile: CustomerProfile
+    fingerprints: Dict[str, str] = field(default_factory=dict)
+    outputs: Dict[str, BaseModel] = field(default_factory=dict)
+    result: Optional[dict] = None
+
+
+def apply_event(profile: CustomerProfile, event: CustomerEvent) -> CustomerProfile:
+    """Return the profile with the event's transactions appended and field changes applied"""
+    data = profile.model_dump()
+    data.update(event.changes)
+    data["recent_transactions"] = data["recent_transactions"] + [t.model_dump() for t in event.new_transactions]
+    return CustomerProfile.model_validate(data)
+
+
+class IncrementalPersonalizer:
+    """
+    Keeps per-customer agent outputs and re-runs only the agents whose inputs
+    changed when a CustomerEvent arrives. Synthesis is repeated only if an
+    analysis output (or the customer's name) actually changed. Events for
+    the same customer are applied in order; different customers run
+    concurrently.
+    """
+
+    def __init__(self):
+        self.states: Dict[str, CustomerState] = {}
+        self.stats: Counter = Counter()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def personalize(self, profile: CustomerProfile) -> dict:
+        """Full personalization of a customer, remembering its state for later events"""
+        async with self._lock(profile.customer_id):
+            state = CustomerState(profile=profile)
+            result = await self._update(state, previous=None)
+            self.states[profile.customer_id] = state
+            return result
+
+    async def handle_event(self, event: CustomerEvent) -> dict:
+        """Apply a profile change and refresh only what it affects"""
+        async with self._lock(event.customer_id):
+            previous = self.states.get(event.customer_id)
+            if previous is None:
+                raise KeyError(f"No stored state for customer {event.customer_id}; call personalize() first")
+            state = CustomerState(profile=apply_event(previous.profile, event))
+            result = await self._update(state, previous)
+            self.states[event.customer_id] = state
+            return result
+
+    async def _update(self, state: CustomerState, previous: Optional[CustomerState]) -> dict:
+        from main import synthesize_and_package
+
+        deps = CustomerDependencies(customer_profile=state.profile)
+        state.fingerprints = {analysis.name: analysis.fingerprint(deps) for analysis in TRACKED_ANALYSES}
+
+        stale = [
+            analysis for analysis in TRACKED_ANALYSES
+            if previous is None or previous.fingerprints.get(analysis.name) != state.fingerprints[analysis.name]
+        ]
+        fresh = await asyncio.gather(*(analysis.run(deps) for analysis in stale))
+        state.outputs = dict(previous.outputs) if previous else {}
+        state.outputs.update({analysis.name: output for analysis, output in zip(stale, fresh)})
+        self.stats["agent_runs"] += len(stale)
+        self.stats["agent_reuses"] += len(TRACKED_ANALYSES) - len(stale)
+
+        unchanged = (
+            previous is not None
+            and previous.result is not None
+            and previous.outputs == state.outputs
+            and previous.profile.customer_name == state.profile.customer_name
+        )
+        if unchanged:
+            self.stats["synthesis_skips"] += 1
+            state.result = previous.result
+        else:
+            self.stats["synthesis_runs"] += 1
+            state.result = await synthesize_and_package(
+                state.profile,
+                state.outputs["financial_situation"],
+                state.outputs["life_moment"],
+                state.outputs["channel_preference"],
+                state.outputs["next_best_action"],
+            )
+        return {**state.result, "recomputed": [analysis.name for analysis in stale] + ([] if unchanged else ["personalized_message"])}
+
+    def _lock(self, customer_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(customer_id, asyncio.Lock())
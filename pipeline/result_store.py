@@ -0,0 +1,150 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+from models.customer import CustomerProfile
+from models.outputs import ChannelPreference, FinancialSituation, HyperpersonalizedMessage, LifeMoment, NextBestAction
+from models.records import encode_record
+
+T = TypeVar("T", bound=BaseModel)
+
+# Checkpointed stages of a customer and their output models
+STAGE_TYPES = {
+    "financial_situation": FinancialSituation,
+    "life_moment": LifeMoment,
+    "channel_preference": ChannelPreference,
+    "next_best_action": NextBestAction,
+    "personalized_message": HyperpersonalizedMessage,
+}
+
+
+def profile_fingerprint(profile: CustomerProfile) -> str:
+    """Content hash of a profile; requests with equal fingerprints would get the same personalization"""
+    canonical = json.dumps(profile.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    Checkpoints of batch runs in SQLite (WAL mode): every customer's stage
+    outputs (the four analyses and the synthesized message) and final
+    record, keyed by customer_id and profile fingerprint so a changed
+    profile is computed afresh. Writes are buffered and inserted in bulk
+    every `flush_rows` rows or `flush_seconds`, so a crash loses at most the
+    last buffer. A rerun against the same file skips customers that have a
+    record and reuses the stored stages of partly finished ones. Several
+    processes (shards) may share one file.
+    """
+
+    def __init__(self, path: str, flush_rows: int = 256, flush_seconds: float = 2.0):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.stats: Counter = Counter()
+        self._stages: List[Tuple[str, str, str, str, float]] = []
+        self._results: List[Tuple[str, str, str, float]] = []
+        self._flushed_at = time.monotonic()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; a crash loses at most recent commits
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "customer_id TEXT, stage TEXT, fingerprint TEXT, output TEXT, saved_at REAL, "
+            "PRIMARY KEY (customer_id, stage))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "customer_id TEXT PRIMARY KEY, fingerprint TEXT, record TEXT, saved_at REAL)"
+        )
+        self._db.commit()
+
+    def completed(self, profile: CustomerProfile) -> Optional[dict]:
+        """The stored record of a customer finished in an earlier run, if any"""
+        row = self._db.execute(
+            "SELECT record FROM results WHERE customer_id = ? AND fingerprint = ?",
+            (profile.customer_id, profile_fingerprint(profile)),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def checkpoint(self, profile: CustomerProfile) -> "CustomerCheckpoint":
+        """The stored stages of a customer, to be reused and extended while it is processed"""
+        fingerprint = profile_fingerprint(profile)
+        rows = self._db.execute(
+            "SELECT stage, output FROM stages WHERE customer_id = ? AND fingerprint = ?",
+            (profile.customer_id, fingerprint),
+        ).fetchall()
+        return CustomerCheckpoint(self, profile.customer_id, fingerprint, dict(rows))
+
+    def save_stage(self, customer_id: str, fingerprint: str, stage: str, output: BaseModel) -> None:
+        self._stages.append((customer_id, stage, fingerprint, output.model_dump_json(), time.time()))
+        self.stats["stages_saved"] += 1
+        self._maybe_flush()
+
+    def save_result(self, profile: CustomerProfile, record: Any) -> None:
+        """Save a customer's final record (a result dict or CustomerResult)"""
+        self._results.append((profile.customer_id, profile_fingerprint(profile), encode_record(record), time.time()))
+        self.stats["results_saved"] += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        pending = len(self._stages) + len(self._results)
+        if pending >= self.flush_rows or time.monotonic() - self._flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        """Insert the buffered rows in one transaction"""
+        self._flushed_at = time.monotonic()
+        if not self._stages and not self._results:
+            return
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)", self._stages)
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", self._results)
+        self.stats["flushes"] += 1
+        self._stages.clear()
+        self._results.clear()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+
+class CustomerCheckpoint:
+    """Stage outputs of one customer: those stored by earlier runs plus those saved as this run completes them"""
+
+    def __init__(self, store: ResultStore, customer_id: str, fingerprint: str, stored: Dict[str, str]):
+        self.store = store
+        self.customer_id = customer_id
+        self.fingerprint = fingerprint
+        self._stored = stored
+
+    def get(self, stage: str) -> Optional[BaseModel]:
+        """The stored output of `stage`, or None if it still has to run"""
+        output = self._stored.get(stage)
+        if output is None:
+            return None
+        self.store.stats["stages_reused"] += 1
+        return STAGE_TYPES[stage].model_validate_json(output)
+
+    def save(self, stage: str, output: BaseModel) -> None:
+        self.store.save_stage(self.customer_id, self.fingerprint, stage, output)
+
+    async def run(self, stage: str, call: Callable[[], Awaitable[Tuple[T, bool]]]) -> Tuple[T, bool]:
+        """
+        Reuse the stored output of `stage` or run `call`, which returns
+        (output, degraded). Degraded fallbacks are not saved, so a rerun
+        tries the agent again.
+        """
+        stored = self.get(stage)
+        if stored is not None:
+            return stored, False
+        output, degraded = await call()
+        if not degraded:
+            self.save(stage, output)
+        return output, degraded
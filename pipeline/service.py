@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models.customer import CustomerProfile
+from pipeline.batch import BatchComponents, add_pipeline_arguments, close_batch, configure_batch
+from pipeline.result_store import profile_fingerprint
+from pipeline.stats import RollingLatency
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request is shed because the queue is full or it waited too long for a slot"""
+
+
+class SingleFlight:
+    """
+    At most one computation per key at a time: callers arriving while a
+    computation for their key is running wait for it and share its result
+    (or exception). The computation continues if its first caller goes away.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.stats: Counter = Counter()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run (or join) the computation for `key`; returns its result and whether it was joined"""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(flight), True
+
+        flight = asyncio.ensure_future(call())
+        self._flights[key] = flight
+        self.stats["computed"] += 1
+
+        def landed(done: "asyncio.Future[Any]") -> None:
+            if self._flights.get(key) is done:
+                del self._flights[key]
+            if not done.cancelled():
+                done.exception()  # retrieved here in case every caller went away
+
+        flight.add_done_callback(landed)
+        return await asyncio.shield(flight), False
+
+
+class AdmissionQueue:
+    """
+    Bounded admission for computations: at most `max_in_flight` run at a
+    time and at most `max_queued` wait for a slot. Past that, and for
+    requests still waiting after `queue_timeout` seconds, Overloaded is
+    raised so the caller can shed the request instead of queueing unboundedly.
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queued: int = 128, queue_timeout: Optional[float] = 10.0):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.queued = 0
+        self.running = 0
+        self.stats: Counter = Counter()
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._slots.locked() and self.queued >= self.max_queued:
+            self.stats["shed_queue_full"] += 1
+            raise Overloaded(f"Request queue full ({self.queued} waiting)")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["shed_timeout"] += 1
+            raise Overloaded(f"No slot free within {self.queue_timeout}s") from None
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+
+async def _read_body(receive: Callable[[], Awaitable[dict]]) -> Optional[bytes]:
+    """The request body, or None if it is larger than MAX_BODY_BYTES"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b"".join(chunks)  # answered (as invalid) to a client that is gone
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send: Callable[[dict], Awaitable[None]], status: int, payload: Any, headers=()) -> None:
+    body = json.dumps(payload, default=str).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class PersonalizationService:
+    """
+    ASGI application serving process_customer_for_personalization.
+
+        POST /personalize   CustomerProfile JSON -> personalization result
+        GET  /health        liveness and current load
+        GET  /metrics       latency percentiles, coalescing and shedding counts, token usage
+
+    The provider, scheduler, cache and other components are configured once
+    at startup (from the batch runner's pipeline options) and shared by all
+    requests, so connections and agents stay warm. Concurrent requests with
+    the same customer_id and profile fingerprint share one computation, and
+    only that computation takes a slot of the admission queue; requests
+    shed by the queue get 503 with Retry-After.
+    """
+
+    def __init__(self, args: argparse.Namespace, admission: Optional[AdmissionQueue] = None, window: int = 1024):
+        self.args = args
+        self.admission = admission or AdmissionQueue()
+        self.flights = SingleFlight()
+        self.window = window
+        self.latency = RollingLatency(window)
+        self.stats: Counter = Counter()
+        self.components: Optional[BatchComponents] = None
+        self._process: Optional[Callable[..., Awaitable[dict]]] = None
+        self._started = time.monotonic()
+
+    async def startup(self) -> None:
+        """Configure the shared components and build the agents and model before the first request"""
+        self.components = configure_batch(self.args, window=self.window)
+        from agents.registry import prewarm_agents
+        from main import process_customer_for_personalization
+
+        if not self.args.prewarm_agents:
+            # Every agent, with the model and its pooled HTTP client; --prewarm-agents
+            # narrows the set, which configure_batch has built already
+            prewarm_agents()
+        self._process = process_customer_for_personalization
+
+    async def shutdown(self) -> None:
+        if self.components is None:
+            return
+        await close_batch(self.args, self.components)
+        if self.args.usage_report:
+            self.components.tracker.write_json(self.args.usage_report)
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as error:
+                    await send({"type": "lifespan.startup.failed", "message": f"{type(error).__name__}: {error}"})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: dict, receive, send) -> None:
+        route = (scope["method"], scope["path"].rstrip("/") or "/")
+        if route == ("POST", "/personalize"):
+            await self._personalize(receive, send)
+        elif route == ("GET", "/health"):
+            await _respond(send, 200 if self.components else 503, self.health())
+        elif route == ("GET", "/metrics"):
+            await _respond(send, 200, self.metrics())
+        elif route[1] in ("/personalize", "/health", "/metrics"):
+            await _respond(send, 405, {"error": "method not allowed"})
+        else:
+            await _respond(send, 404, {"error": "not found"})
+
+    async def _personalize(self, receive, send) -> None:
+        started = time.perf_counter()
+        self.stats["requests"] += 1
+        body = await _read_body(receive)
+        if body is None:
+            self.stats["rejected"] += 1
+            await _respond(send, 413, {"error": f"body larger than {MAX_BODY_BYTES} bytes"})
+            return
+        try:
+            profile = CustomerProfile.model_validate_json(body)
+        except ValidationError as error:
+            self.stats["rejected"] += 1
+            await _respond(send, 400, {"error": "invalid customer profile", "detail": json.loads(error.json(include_url=False))})
+            return
+        if self._process is None:
+            await _respond(send, 503, {"error": "service is starting"}, [(b"retry-after", b"1")])
+            return
+
+        key = (profile.customer_id, profile_fingerprint(profile))
+        try:
+            result, coalesced = await self.flights.run(key, lambda: self._compute(profile))
+        except Overloaded as error:
+            self.stats["shed"] += 1
+            await _respond(send, 503, {"error": str(error)}, [(b"retry-after", b"1")])
+            return
+        except Exception as error:
+            self.stats["errors"] += 1
+            await _respond(send, 500, {"error": type(error).__name__, "detail": str(error)})
+            return
+        self.latency.record(time.perf_counter() - started)
+        await _respond(send, 200, result, [(b"x-coalesced", b"1" if coalesced else b"0")])
+
+    async def _compute(self, profile: CustomerProfile) -> dict:
+        async with self.admission.slot():
+            return await self._process(profile, verbose=False, fused=self.args.fused)
+
+    def health(self) -> dict:
+        return {
+            "status": "ok" if self.components else "starting",
+            "uptime_s": time.monotonic() - self._started,
+            "running": self.admission.running,
+            "queued": self.admission.queued,
+            "in_flight_customers": self.flights.in_flight,
+        }
+
+    def metrics(self) -> dict:
+        metrics = {
+            "latency": self.latency.summary(),
+            "requests": {**self.stats, **self.flights.stats, **self.admission.stats},
+            **self.health(),
+        }
+        if self.components is not None:
+            report = self.components.report()
+            metrics["tokens"] = self.components.tracker.to_dict()["batch"]
+            metrics.update({
+                name: value for name, value in report.items() if name not in ("usage", "streaming", "tracing")
+            })
+            if report["tracing"] is not None:
+                metrics["stages"] = report["tracing"].summary()
+        return metrics
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serve customer personalization over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-in-flight", type=int, default=32, help="Customers personalized at the same time")
+    parser.add_argument("--max-queue", type=int, default=128,
+                        help="Customers waiting for a slot; further requests are shed with 503")
+    parser.add_argument("--queue-timeout", type=float, default=10.0,
+                        help="Seconds a request may wait for a slot before it is shed")
+    parser.add_argument("--latency-window", type=int, default=1024,
+                        help="Recent requests (and stage samples) /metrics percentiles cover")
+    parser.add_argument("--fused", action="store_true",
+                        help="Get all four analyses of a customer from one request instead of four")
+    add_pipeline_arguments(parser)
+    # Batch-only options configure_batch reads
+    parser.set_defaults(packed=False, stream_synthesis=False, transactions_store=None, result_store=None, processes=1)
+    return parser
+
+
+def create_app(args: argparse.Namespace) -> PersonalizationService:
+    admission = AdmissionQueue(args.max_in_flight, args.max_queue, args.queue_timeout)
+    return PersonalizationService(args, admission, args.latency_window)
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    import uvicorn
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
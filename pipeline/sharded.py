@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+from agents.scheduler import SharedTokenBucket, TokenBucket, burst_capacity
+from agents.usage import UsageTracker
+from models.records import encode_record
+from pipeline.batch import configure_batch, iter_customer_profiles, merge_reports, run_configured
+from pipeline.stats import LatencyStats
+
+# Records a shard sends to the parent per message
+FLUSH_RECORDS = 64
+
+
+async def _run_shard(
+    args: argparse.Namespace,
+    shard: int,
+    shards: int,
+    rate_buckets: Optional[Tuple[TokenBucket, TokenBucket]],
+    results: multiprocessing.Queue,
+) -> dict:
+    """Personalize every `shards`-th customer and stream serialized records to the parent"""
+    if args.early_sink:
+        # Each shard hands early channel/subject records to its own file
+        args = argparse.Namespace(**{**vars(args), "early_sink": f"{args.early_sink}.{shard}"})
+    if args.trace_file:
+        args = argparse.Namespace(**{**vars(args), "trace_file": f"{args.trace_file}.{shard}"})
+    components = configure_batch(args, shards, rate_buckets)
+    buffer: List[Tuple[int, str, Optional[float], bool]] = []
+
+    def on_record(position: int, record: dict, latency: Optional[float]) -> None:
+        # Serialize here so the parent only writes strings
+        resumed = isinstance(record, dict) and record.get("resumed", False)
+        buffer.append((position * shards + shard, encode_record(record), latency, resumed))
+        if len(buffer) >= FLUSH_RECORDS:
+            results.put(("records", buffer[:]))
+            buffer.clear()
+
+    summary = await run_configured(
+        args, components, iter_customer_profiles(args.source, shard, shards), None, on_record
+    )
+    if buffer:
+        results.put(("records", buffer))
+    return {**components.report(), "stopped_by_budget": summary["stopped_by_budget"]}
+
+
+def _shard_main(
+    args: argparse.Namespace,
+    shard: int,
+    shards: int,
+    rate_buckets: Optional[Tuple[TokenBucket, TokenBucket]],
+    results: multiprocessing.Queue,
+) -> None:
+    """Worker process entry point: one event loop and one set of agents per shard"""
+    try:
+        report = asyncio.run(_run_shard(args, shard, shards, rate_buckets, results))
+    except BaseException:
+        results.put(("failed", shard, traceback.format_exc()))
+        raise
+    results.put(("done", shard, report))
+
+
+def run_sharded(args: argparse.Namespace) -> Tuple[dict, dict, UsageTracker]:
+    """
+    Run the batch in `args.processes` worker processes. Record i of the
+    source goes to shard i % processes, so validation, prompt rendering and
+    serialization are spread over cores while every shard still streams its
+    input. With --rpm the shards draw from one shared requests/tokens quota.
+    Records are written to the sink in input order: each is held back until
+    all records before it have arrived (records skipped by a budget stop are
+    left out and do not hold back the rest at the end).
+
+    Returns the merged latency summary, the merged shard reports and a
+    UsageTracker holding the usage of all shards.
+    """
+    shards = args.processes
+    context = multiprocessing.get_context("spawn")  # no inherited event loops, threads or sockets
+    rate_buckets = None
+    if args.rpm:
+        rate_buckets = (
+            SharedTokenBucket(args.rpm, burst_capacity(args.rpm), context),
+            SharedTokenBucket(args.tpm, burst_capacity(args.tpm), context),
+        )
+
+    results = context.Queue()
+    workers = [
+        context.Process(target=_shard_main, args=(args, shard, shards, rate_buckets, results), daemon=True)
+        for shard in range(shards)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stats = LatencyStats()
+    pending = {}
+    next_index = 0
+    reports = []
+    started = time.perf_counter()
+    try:
+        with open(args.sink, "w") as sink:
+            while len(reports) < shards:
+                try:
+                    message = results.get(timeout=1.0)
+                except queue.Empty:
+                    crashed = [worker for worker in workers if worker.exitcode not in (None, 0)]
+                    if crashed:
+                        raise RuntimeError(f"Shard worker {crashed[0].name} exited with code {crashed[0].exitcode}")
+                    continue
+                kind = message[0]
+                if kind == "records":
+                    for index, line, latency, resumed in message[1]:
+                        if resumed:
+                            stats.resumed += 1
+                        elif latency is None:
+                            stats.errors += 1
+                        else:
+                            stats.record(latency)
+                        pending[index] = line
+                    while next_index in pending:
+                        sink.write(pending.pop(next_index) + "\n")
+                        next_index += 1
+                elif kind == "done":
+                    reports.append(message[2])
+                else:
+                    raise RuntimeError(f"Shard {message[1]} failed:\n{message[2]}")
+            for index in sorted(pending):
+                sink.write(pending[index] + "\n")
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+
+    tracker = UsageTracker()
+    for report in reports:
+        tracker.absorb(report["usage"])
+    merged = merge_reports(reports)
+    summary = {
+        **stats.summary(time.perf_counter() - started),
+        "stopped_by_budget": any(report["stopped_by_budget"] for report in reports),
+        "shards": shards,
+    }
+    return summary, merged, tracker
@@ -0,0 +1,175 @@
+import math
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, MutableSequence, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the stage histogram buckets; a last bucket takes the rest
+HISTOGRAM_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(rank - 1, 0)]
+
+
+@dataclass
+class LatencyStats:
+    """Collects per-customer latencies and reports throughput and tail latency"""
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    resumed: int = 0  # customers whose stored result was reused (see pipeline.result_store)
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    @property
+    def count(self) -> int:
+        return len(self.latencies)
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        ordered = sorted(self.latencies)
+        return {
+            "customers": self.count,
+            "errors": self.errors,
+            "resumed": self.resumed,
+            "elapsed_s": elapsed,
+            "customers_per_s": self.count / elapsed if elapsed > 0 else 0.0,
+            "p50_s": percentile(ordered, 50),
+            "p95_s": percentile(ordered, 95),
+            "p99_s": percentile(ordered, 99),
+        }
+
+
+@dataclass
+class TimeToFieldStats:
+    """Time-to-field distributions of streamed syntheses (see agents.synthesis_agent.SynthesisTiming)"""
+    first_field: List[float] = field(default_factory=list)
+    routing_fields: List[float] = field(default_factory=list)
+    complete: List[float] = field(default_factory=list)
+
+    def record(self, timing: dict) -> None:
+        for name in ("first_field", "routing_fields", "complete"):
+            value = timing.get(f"{name}_s")
+            if value is not None:
+                getattr(self, name).append(value)
+
+    def __add__(self, other: "TimeToFieldStats") -> "TimeToFieldStats":
+        return TimeToFieldStats(
+            self.first_field + other.first_field,
+            self.routing_fields + other.routing_fields,
+            self.complete + other.complete,
+        )
+
+    def summary(self) -> Dict[str, float]:
+        result = {}
+        for name in ("first_field", "routing_fields", "complete"):
+            ordered = sorted(getattr(self, name))
+            result[f"{name}_p50_s"] = percentile(ordered, 50)
+            result[f"{name}_p95_s"] = percentile(ordered, 95)
+        return result
+
+
+def histogram(values: Sequence[float], bounds: Sequence[float] = HISTOGRAM_BOUNDS) -> Dict[str, int]:
+    """Counts of `values` per bucket, keyed "le_<bound>" plus "gt_<last bound>" """
+    counts = Counter()
+    for value in values:
+        counts[next((f"le_{bound:g}" for bound in bounds if value <= bound), f"gt_{bounds[-1]:g}")] += 1
+    return {key: counts[key] for key in [f"le_{bound:g}" for bound in bounds] + [f"gt_{bounds[-1]:g}"] if counts[key]}
+
+
+@dataclass
+class StageStats:
+    """
+    Per-stage latency of traced customers (see agents.tracing): the
+    duration of every span of each stage, and per customer the seconds each
+    stage contributed to its critical path, which add up to its wall time.
+    With `window`, as in a long-running service, each list keeps only its
+    latest `window` samples; the span counts cover everything recorded.
+    """
+    durations: Dict[str, MutableSequence[float]] = field(default_factory=dict)
+    critical: Dict[str, MutableSequence[float]] = field(default_factory=dict)
+    totals: MutableSequence[float] = field(default_factory=list)
+    profiles_written: int = 0  # CPU profiles of slow customers
+    spans: Counter = field(default_factory=Counter)
+    window: Optional[int] = None
+
+    def __post_init__(self):
+        self.totals = self._samples(self.totals)
+
+    def _samples(self, values: Sequence[float] = ()) -> MutableSequence[float]:
+        return list(values) if self.window is None else deque(values, maxlen=self.window)
+
+    def _add(self, samples: Dict[str, MutableSequence[float]], name: str, values: Sequence[float]) -> None:
+        if name not in samples:
+            samples[name] = self._samples()
+        samples[name].extend(values)
+
+    def record(self, spans: Sequence[Any], critical_path: Sequence[Tuple[str, float]], total: float) -> None:
+        for span in spans:
+            if span.end is not None:
+                self._add(self.durations, span.name, (span.end - span.start,))
+                self.spans[span.name] += 1
+        on_path: Counter = Counter()
+        for name, seconds in critical_path:
+            on_path[name] += seconds
+        for name, seconds in on_path.items():
+            self._add(self.critical, name, (seconds,))
+        self.totals.append(total)
+
+    def __add__(self, other: "StageStats") -> "StageStats":
+        merged = StageStats(
+            totals=[*self.totals, *other.totals],
+            profiles_written=self.profiles_written + other.profiles_written,
+            spans=self.spans + other.spans,
+            window=self.window,
+        )
+        for source in (self, other):
+            for name, values in source.durations.items():
+                merged._add(merged.durations, name, values)
+            for name, values in source.critical.items():
+                merged._add(merged.critical, name, values)
+        return merged
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage: span count and percentiles, histogram, and share of the customers' total wall time"""
+        wall = sum(self.totals)
+        result = {}
+        for name in sorted(self.durations.keys() | self.critical.keys()):
+            ordered = sorted(self.durations.get(name, ()))
+            on_path = self.critical.get(name, [])
+            result[name] = {
+                "spans": self.spans[name],
+                "p50_s": percentile(ordered, 50),
+                "p95_s": percentile(ordered, 95),
+                "p99_s": percentile(ordered, 99),
+                "histogram": histogram(ordered),
+                "critical_path_customers": len(on_path),
+                "wall_share": sum(on_path) / wall if wall > 0 else 0.0,
+            }
+        return result
+
+
+class RollingLatency:
+    """Latencies of the most recent `window` requests of a long-running service"""
+
+    def __init__(self, window: int = 1024):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        return {
+            "requests": self.count,
+            "window": len(ordered),
+            "p50_s": percentile(ordered, 50),
+            "p95_s": percentile(ordered, 95),
+            "p99_s": percentile(ordered, 99),
+            "max_s": ordered[-1] if ordered else 0.0,
+        }